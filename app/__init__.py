@@ -7,6 +7,13 @@ from config import Config
 
 app = Flask(__name__)
 app.config.from_object(Config)
+if not 0 < app.config['ANALYSIS_WINDOW_STRIDE'] <= app.config['ANALYSIS_WINDOW_SENTENCES']:
+    raise ValueError('ANALYSIS_WINDOW_STRIDE must be between 1 and ANALYSIS_WINDOW_SENTENCES')
 db = SQLAlchemy(app)
 
-from app import routes,models
\ No newline at end of file
+from app.storage import configure_sqlite
+
+with app.app_context():
+    configure_sqlite(db.engine, app.config)
+
+from app import routes,models,corpus_stats
\ No newline at end of file
@@ -1,7 +1,61 @@
+"""Template-based AI documents, one at a time or in bulk.
+
+generate_ai_document() makes one document for /generate_ai.
+bulk_generate() builds large AI reference corpora, e.g. as the fixture
+corpus of load and performance tests: documents_per_topic documents per
+ACM topic, each a seeded permutation of sentences from that topic's
+templates, written with batched inserts. The same seed gives the same
+corpus. Generated documents are alike by design, so, as with
+/generate_ai, they are not checked for near-duplicates; they are not
+sketched either.
+
+Usage:
+    python -m app.ai_generator --per-topic 10000 [--min-sentences 5] [--max-sentences 15]
+                               [--seed 0] [--index]
+"""
+import argparse
 import random
-from app import db
+import time
+
+from app import app, db
 from app.models import ACMTopic, Text
 
+TEMPLATES = {
+    'Artificial Intelligence': [
+        "Artificial Intelligence (AI) is a rapidly evolving field that focuses on creating systems capable of performing tasks that typically require human intelligence. Machine learning, a subset of AI, enables computers to learn from data without explicit programming. Deep learning, which uses neural networks with multiple layers, has revolutionized areas such as image recognition and natural language processing. The development of AI technologies continues to accelerate, with applications ranging from autonomous vehicles to medical diagnosis.",
+        "The field of Artificial Intelligence encompasses various approaches to creating intelligent systems. These include rule-based systems, machine learning algorithms, and neural networks. Recent advances in deep learning have led to breakthroughs in computer vision, speech recognition, and natural language understanding. As AI technologies mature, they are being integrated into numerous industries, transforming how we work and live. Ethical considerations surrounding AI development and deployment remain important topics of discussion."
+    ],
+    'Computer Systems': [
+        "Computer systems form the foundation of modern computing infrastructure. These systems include hardware components such as processors, memory, and storage devices, as well as software layers like operating systems and middleware. The design of efficient computer systems requires careful consideration of performance, power consumption, and reliability. Advances in computer architecture have led to the development of multi-core processors, specialized accelerators, and cloud computing platforms that enable scalable and flexible computing resources.",
+        "Modern computer systems are characterized by their complexity and specialization. From mobile devices to supercomputers, these systems are designed to meet specific performance and efficiency requirements. The field of computer systems engineering involves the design, implementation, and evaluation of computing hardware and software. Key challenges include managing parallelism, optimizing energy efficiency, and ensuring security. As computing demands continue to grow, computer systems must evolve to provide greater performance and functionality."
+    ],
+    'Networks': [
+        "Computer networks enable communication and resource sharing between computing devices. The Internet, a global network of networks, has transformed how we access information and communicate with others. Network protocols such as TCP/IP provide the foundation for data transmission across networks. The design of efficient and secure networks involves addressing challenges related to scalability, reliability, and performance. Emerging technologies like 5G and software-defined networking are shaping the future of network infrastructure.",
+        "Networking technologies continue to evolve to meet the growing demands for connectivity and bandwidth. Local area networks (LANs), wide area networks (WANs), and wireless networks each serve different communication needs. Network security is a critical concern, with threats ranging from unauthorized access to malicious attacks. The development of network protocols and architectures must balance performance, security, and ease of management. As the Internet of Things expands, networks must accommodate an increasing number of connected devices."
+    ],
+    'Software Engineering': [
+        "Software engineering is a discipline focused on the systematic design, development, and maintenance of software systems. It encompasses various methodologies, including waterfall, agile, and DevOps approaches. The software development lifecycle involves requirements analysis, design, implementation, testing, and deployment. Quality assurance and testing are essential components of software engineering, ensuring that software meets requirements and is free of defects. Effective software engineering practices improve productivity, quality, and maintainability.",
+        "Modern software engineering emphasizes collaboration, automation, and continuous improvement. Agile methodologies promote iterative development and rapid response to changing requirements. DevOps practices integrate development and operations to streamline the software delivery process. Software architecture design addresses the structure and organization of software systems, impacting their scalability and maintainability. As software systems grow in complexity, software engineering must evolve to address new challenges in security, performance, and user experience."
+    ],
+    'Theory of Computation': [
+        "The theory of computation explores the fundamental capabilities and limitations of computation. It includes the study of automata, formal languages, and computability. Automata theory examines abstract machines and the problems they can solve. Formal languages provide a framework for describing syntax and semantics. Computability theory addresses which problems can be solved algorithmically. Complexity theory classifies problems based on the computational resources required to solve them. These theoretical foundations underpin all of computer science.",
+        "Computational theory provides the mathematical basis for understanding what can and cannot be computed. The Church-Turing thesis establishes the equivalence of various computational models. Complexity classes such as P and NP categorize problems based on their solvability. NP-complete problems represent a class of problems for which no efficient solution is known, yet their solutions can be verified efficiently. The study of algorithms and their complexity is central to computer science, enabling the development of efficient solutions to computational problems."
+    ],
+    'Human-Computer Interaction': [
+        "Human-Computer Interaction (HCI) focuses on the design and evaluation of interactive computing systems for human use. It draws on knowledge from computer science, psychology, design, and other fields. User interface design considers how users interact with software and hardware systems. Usability engineering ensures that systems are efficient, effective, and satisfying to use. The field has evolved to include new interaction paradigms such as touch, gesture, and voice interfaces. As computing becomes more pervasive, HCI must address diverse user needs and contexts.",
+        "The field of Human-Computer Interaction emphasizes user-centered design principles. Understanding user needs, capabilities, and limitations is essential for creating effective interfaces. Interaction design involves creating dialogues between users and systems that are intuitive and efficient. Evaluation methods such as usability testing and heuristic analysis help identify design improvements. Accessibility ensures that systems can be used by people with diverse abilities. Emerging areas in HCI include augmented reality, virtual reality, and brain-computer interfaces, each presenting unique design challenges and opportunities."
+    ]
+}
+
+# Sentences of each topic's templates, the material bulk generation permutes
+TEMPLATE_SENTENCES = {
+    topic: [sentence if sentence.endswith('.') else sentence + '.'
+            for template in templates for sentence in template.split('. ')]
+    for topic, templates in TEMPLATES.items()
+}
+
+INSERT_BATCH_SIZE = 5000
+
 
 def initialize_acm_topics():
     """Initialize ACM topics in the database"""
@@ -56,35 +110,8 @@ def generate_ai_document(topic_name, length=500):
     # In a real implementation, this would call an AI API
     # For now, we'll generate a simple template-based document
 
-    templates = {
-        'Artificial Intelligence': [
-            "Artificial Intelligence (AI) is a rapidly evolving field that focuses on creating systems capable of performing tasks that typically require human intelligence. Machine learning, a subset of AI, enables computers to learn from data without explicit programming. Deep learning, which uses neural networks with multiple layers, has revolutionized areas such as image recognition and natural language processing. The development of AI technologies continues to accelerate, with applications ranging from autonomous vehicles to medical diagnosis.",
-            "The field of Artificial Intelligence encompasses various approaches to creating intelligent systems. These include rule-based systems, machine learning algorithms, and neural networks. Recent advances in deep learning have led to breakthroughs in computer vision, speech recognition, and natural language understanding. As AI technologies mature, they are being integrated into numerous industries, transforming how we work and live. Ethical considerations surrounding AI development and deployment remain important topics of discussion."
-        ],
-        'Computer Systems': [
-            "Computer systems form the foundation of modern computing infrastructure. These systems include hardware components such as processors, memory, and storage devices, as well as software layers like operating systems and middleware. The design of efficient computer systems requires careful consideration of performance, power consumption, and reliability. Advances in computer architecture have led to the development of multi-core processors, specialized accelerators, and cloud computing platforms that enable scalable and flexible computing resources.",
-            "Modern computer systems are characterized by their complexity and specialization. From mobile devices to supercomputers, these systems are designed to meet specific performance and efficiency requirements. The field of computer systems engineering involves the design, implementation, and evaluation of computing hardware and software. Key challenges include managing parallelism, optimizing energy efficiency, and ensuring security. As computing demands continue to grow, computer systems must evolve to provide greater performance and functionality."
-        ],
-        'Networks': [
-            "Computer networks enable communication and resource sharing between computing devices. The Internet, a global network of networks, has transformed how we access information and communicate with others. Network protocols such as TCP/IP provide the foundation for data transmission across networks. The design of efficient and secure networks involves addressing challenges related to scalability, reliability, and performance. Emerging technologies like 5G and software-defined networking are shaping the future of network infrastructure.",
-            "Networking technologies continue to evolve to meet the growing demands for connectivity and bandwidth. Local area networks (LANs), wide area networks (WANs), and wireless networks each serve different communication needs. Network security is a critical concern, with threats ranging from unauthorized access to malicious attacks. The development of network protocols and architectures must balance performance, security, and ease of management. As the Internet of Things expands, networks must accommodate an increasing number of connected devices."
-        ],
-        'Software Engineering': [
-            "Software engineering is a discipline focused on the systematic design, development, and maintenance of software systems. It encompasses various methodologies, including waterfall, agile, and DevOps approaches. The software development lifecycle involves requirements analysis, design, implementation, testing, and deployment. Quality assurance and testing are essential components of software engineering, ensuring that software meets requirements and is free of defects. Effective software engineering practices improve productivity, quality, and maintainability.",
-            "Modern software engineering emphasizes collaboration, automation, and continuous improvement. Agile methodologies promote iterative development and rapid response to changing requirements. DevOps practices integrate development and operations to streamline the software delivery process. Software architecture design addresses the structure and organization of software systems, impacting their scalability and maintainability. As software systems grow in complexity, software engineering must evolve to address new challenges in security, performance, and user experience."
-        ],
-        'Theory of Computation': [
-            "The theory of computation explores the fundamental capabilities and limitations of computation. It includes the study of automata, formal languages, and computability. Automata theory examines abstract machines and the problems they can solve. Formal languages provide a framework for describing syntax and semantics. Computability theory addresses which problems can be solved algorithmically. Complexity theory classifies problems based on the computational resources required to solve them. These theoretical foundations underpin all of computer science.",
-            "Computational theory provides the mathematical basis for understanding what can and cannot be computed. The Church-Turing thesis establishes the equivalence of various computational models. Complexity classes such as P and NP categorize problems based on their solvability. NP-complete problems represent a class of problems for which no efficient solution is known, yet their solutions can be verified efficiently. The study of algorithms and their complexity is central to computer science, enabling the development of efficient solutions to computational problems."
-        ],
-        'Human-Computer Interaction': [
-            "Human-Computer Interaction (HCI) focuses on the design and evaluation of interactive computing systems for human use. It draws on knowledge from computer science, psychology, design, and other fields. User interface design considers how users interact with software and hardware systems. Usability engineering ensures that systems are efficient, effective, and satisfying to use. The field has evolved to include new interaction paradigms such as touch, gesture, and voice interfaces. As computing becomes more pervasive, HCI must address diverse user needs and contexts.",
-            "The field of Human-Computer Interaction emphasizes user-centered design principles. Understanding user needs, capabilities, and limitations is essential for creating effective interfaces. Interaction design involves creating dialogues between users and systems that are intuitive and efficient. Evaluation methods such as usability testing and heuristic analysis help identify design improvements. Accessibility ensures that systems can be used by people with diverse abilities. Emerging areas in HCI include augmented reality, virtual reality, and brain-computer interfaces, each presenting unique design challenges and opportunities."
-        ]
-    }
-
-    if topic_name in templates:
-        template = random.choice(templates[topic_name])
+    if topic_name in TEMPLATES:
+        template = random.choice(TEMPLATES[topic_name])
         # Add some variation to the template
         sentences = template.split('. ')
         if len(sentences) > 3:
@@ -93,4 +120,82 @@ def generate_ai_document(topic_name, length=500):
         return '. '.join(sentences) + '.'
 
     # Default template if topic not found
-    return f"This is a generated document about {topic_name}. It contains relevant information and follows the topic closely. The content is structured to provide a comprehensive overview of the subject matter, including key concepts and applications."
\ No newline at end of file
+    return f"This is a generated document about {topic_name}. It contains relevant information and follows the topic closely. The content is structured to provide a comprehensive overview of the subject matter, including key concepts and applications."
+
+
+def generate_documents(documents_per_topic, min_sentences=5, max_sentences=15, seed=0):
+    """Yield (topic, text) of documents_per_topic documents per topic, the same for the same seed.
+
+    Topics take turns, so any prefix of the output covers every topic.
+    Each document is min_sentences to max_sentences sentences of its
+    topic's templates in random order; longer documents than a topic
+    has sentences repeat some of them.
+    """
+    rng = random.Random(seed)
+    topics = list(TEMPLATE_SENTENCES)
+    for _ in range(documents_per_topic):
+        for topic in topics:
+            sentences = TEMPLATE_SENTENCES[topic]
+            n = rng.randint(min_sentences, max_sentences)
+            chosen = rng.sample(sentences, n) if n <= len(sentences) else rng.choices(sentences, k=n)
+            yield topic, ' '.join(chosen)
+
+
+def bulk_generate(documents_per_topic, min_sentences=5, max_sentences=15, seed=0, batch_size=INSERT_BATCH_SIZE):
+    """Insert generated AI documents, one transaction per batch; returns (documents, characters)"""
+    from app.content_store import store_content
+    from app.corpus_stats import record_texts
+    from app.models import content_fields
+
+    inserted = characters = 0
+    batch = []
+
+    def flush():
+        # Bulk inserts skip the model's event listeners: the bodies are stored
+        # and the counters adjusted here
+        db.session.execute(db.insert(Text), batch)
+        record_texts(batch)
+        db.session.commit()
+
+    for topic, text in generate_documents(documents_per_topic, min_sentences, max_sentences, seed):
+        fields = content_fields(text)
+        store_content(fields['content_hash'], text)
+        batch.append(dict(fields, source='generated', topic=topic, is_ai=True, acm_topic=topic))
+        characters += len(text)
+        if len(batch) >= batch_size:
+            flush()
+            inserted += len(batch)
+            batch = []
+    if batch:
+        flush()
+        inserted += len(batch)
+    return inserted, characters
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-generate AI reference documents for every ACM topic.')
+    parser.add_argument('--per-topic', type=int, required=True, help='documents per topic')
+    parser.add_argument('--min-sentences', type=int, default=5)
+    parser.add_argument('--max-sentences', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=INSERT_BATCH_SIZE)
+    parser.add_argument('--index', action='store_true',
+                        help='bring the reference index up to date afterwards instead of at the next analysis')
+    args = parser.parse_args()
+
+    with app.app_context():
+        start = time.perf_counter()
+        documents, characters = bulk_generate(args.per_topic, args.min_sentences, args.max_sentences, args.seed,
+                                              args.batch_size)
+        elapsed = time.perf_counter() - start
+        print(f"Generated {documents} documents ({characters / 1e6:.1f} M characters) in {elapsed:.1f}s, "
+              f"{documents / elapsed:.0f} documents/s")
+        if args.index:
+            from app.reference_index import update_reference_index
+            start = time.perf_counter()
+            update_reference_index()
+            print(f"Indexed in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Content-addressed store for the bodies of Text rows.
+
+Each body is a zlib-compressed file under CONTENT_FOLDER named after the
+SHA-256 of its text (Text.content_hash), fanned out by the first two hex
+digits. The Text row keeps only the hash, length and preview, so table
+scans and database backups no longer carry whole dissertations, and a
+body is read and decompressed only when a page or an analysis asks for
+text.content. Identical texts share one file.
+
+A file is written when the row pointing at it is flushed, before the
+transaction commits; a rollback can therefore leave an unreferenced file
+behind, which gc removes.
+
+The tokenized features of a stored text (see
+app.feature_cache.document_features) are kept next to its body as
+<hash>.features.npz, written once when the text is first indexed.
+
+Usage:
+    python -m app.content_store stats   # files, raw and stored bytes
+    python -m app.content_store gc      # delete files no Text refers to
+"""
+import os
+import sys
+import tempfile
+import zlib
+
+from flask import current_app
+
+COMPRESSION_LEVEL = 6
+SUFFIX = '.z'
+FEATURES_SUFFIX = '.features.npz'
+
+
+def content_path(content_hash, folder=None, suffix=SUFFIX):
+    folder = folder or current_app.config['CONTENT_FOLDER']
+    return os.path.join(folder, content_hash[:2], content_hash + suffix)
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a concurrent reader never sees half a file
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def store_content(content_hash, content, folder=None):
+    """Write content under content_hash unless it is already stored; returns the bytes written"""
+    path = content_path(content_hash, folder)
+    if os.path.exists(path):
+        return 0
+    data = zlib.compress(content.encode('utf-8'), COMPRESSION_LEVEL)
+    _write_file(path, data)
+    return len(data)
+
+
+def load_content(content_hash, folder=None):
+    """The text stored under content_hash, or None for a row without content"""
+    if content_hash is None:
+        return None
+    with open(content_path(content_hash, folder), 'rb') as f:
+        return zlib.decompress(f.read()).decode('utf-8')
+
+
+def store_feature_payload(content_hash, payload):
+    """Write the encoded document features of the text stored under content_hash"""
+    _write_file(content_path(content_hash, suffix=FEATURES_SUFFIX), payload)
+
+
+def load_feature_payload(content_hash):
+    """The encoded document features stored under content_hash, or None"""
+    try:
+        with open(content_path(content_hash, suffix=FEATURES_SUFFIX), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def stored_files(folder=None):
+    """(content_hash, size, path) of every stored body and features file"""
+    folder = folder or current_app.config['CONTENT_FOLDER']
+    if not os.path.isdir(folder):
+        return
+    for shard in sorted(os.listdir(folder)):
+        shard_folder = os.path.join(folder, shard)
+        if not os.path.isdir(shard_folder):
+            continue
+        for name in sorted(os.listdir(shard_folder)):
+            if name.endswith(SUFFIX) or name.endswith(FEATURES_SUFFIX):
+                path = os.path.join(shard_folder, name)
+                yield name.split('.')[0], os.path.getsize(path), path
+
+
+def collect_garbage():
+    """Delete stored files that no Text refers to; returns (files, bytes) removed"""
+    from app import db
+    from app.models import Text
+
+    referenced = {h for (h,) in db.session.query(Text.content_hash).distinct()}
+    files = removed = 0
+    for content_hash, size, path in list(stored_files()):
+        if content_hash not in referenced:
+            os.unlink(path)
+            files += 1
+            removed += size
+    return files, removed
+
+
+def store_stats():
+    """Counts and sizes of the store next to the characters they hold"""
+    from app import db
+    from app.models import Text
+
+    files = stored = features = 0
+    for _, size, path in stored_files():
+        if path.endswith(FEATURES_SUFFIX):
+            features += size
+            continue
+        files += 1
+        stored += size
+    characters = (db.session.query(db.func.sum(Text.content_length))
+                  .filter(Text.id.in_(db.session.query(db.func.min(Text.id)).group_by(Text.content_hash)))
+                  .scalar()) or 0
+    return {'files': files, 'stored_bytes': stored, 'feature_bytes': features, 'characters': characters}
+
+
+def main():
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    with app.app_context():
+        if command == 'gc':
+            files, removed = collect_garbage()
+            print(f"Removed {files} unreferenced files ({removed / 1e6:.1f} MB)")
+        elif command == 'stats':
+            stats = store_stats()
+            ratio = stats['characters'] / stats['stored_bytes'] if stats['stored_bytes'] else 0.0
+            print(f"{stats['files']} files, {stats['stored_bytes'] / 1e6:.1f} MB stored for "
+                  f"{stats['characters'] / 1e6:.1f} M characters ({ratio:.1f}x), "
+                  f"{stats['feature_bytes'] / 1e6:.1f} MB of document features")
+        else:
+            sys.exit(f"Unknown command {command!r}; use stats or gc")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Running totals behind the dashboard.
+
+CorpusStat holds one counter per key: texts per class, per source and
+per ACM topic, ACM topics, analyses, and histograms of the analysis
+scores. The counters are adjusted on the same connection, and so in the
+same transaction, as the rows they count: by the mapper events below
+for ORM writes and by record_texts() for bulk inserts. Reading the
+dashboard is then one small query however large the tables grow.
+
+Usage:
+    python -m app.corpus_stats    # recount everything from the tables
+"""
+from collections import Counter
+
+from app import app, db
+from app.models import ACMTopic, AnalysisResult, CorpusStat, Text
+
+HISTOGRAM_BUCKETS = 10
+
+
+def score_bucket(value):
+    return min(max(int(value * HISTOGRAM_BUCKETS), 0), HISTOGRAM_BUCKETS - 1)
+
+
+def text_keys(is_ai, source, acm_topic):
+    keys = ['texts:ai' if is_ai else 'texts:human']
+    if source:
+        keys.append(f'source:{source}')
+    if acm_topic:
+        keys.append(f'acm_topic:{acm_topic}')
+    return keys
+
+
+def analysis_keys(ai_proportion, overall_score):
+    keys = ['analyses']
+    if ai_proportion is not None:
+        keys.append(f'ai_proportion:{score_bucket(ai_proportion)}')
+    if overall_score is not None:
+        keys.append(f'ai_score:{score_bucket(overall_score)}')
+    return keys
+
+
+def apply_deltas(connection, deltas):
+    """Add each delta to its counter, creating missing counters"""
+    table = CorpusStat.__table__
+    for key, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        updated = connection.execute(table.update().where(table.c.key == key).values(count=table.c.count + delta))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(key=key, count=delta))
+
+
+def record_texts(rows):
+    """Count texts bulk-inserted as dicts, which skips the mapper events"""
+    deltas = Counter(key for row in rows
+                     for key in text_keys(row.get('is_ai'), row.get('source'), row.get('acm_topic')))
+    apply_deltas(db.session.connection(), deltas)
+
+
+def _stored_and_pending(connection, target, columns):
+    """Stored and pending values of columns when the flush changes any of them, else None.
+
+    The stored values are read back from the row, since an attribute set
+    on an expired object has no old value in its history.
+    """
+    state = db.inspect(target)
+    if not any(state.attrs[column.key].history.has_changes() for column in columns):
+        return None
+    stored = connection.execute(db.select(*columns).where(target.__class__.id == target.id)).one()
+    return tuple(stored), tuple(getattr(target, column.key) for column in columns)
+
+
+def _moved(old_keys, new_keys):
+    deltas = Counter(new_keys)
+    deltas.subtract(old_keys)
+    return deltas
+
+
+@db.event.listens_for(Text, 'after_insert')
+def count_inserted_text(mapper, connection, target):
+    apply_deltas(connection, Counter(text_keys(target.is_ai, target.source, target.acm_topic)))
+
+
+@db.event.listens_for(Text, 'before_update')
+def count_updated_text(mapper, connection, target):
+    values = _stored_and_pending(connection, target, (Text.is_ai, Text.source, Text.acm_topic))
+    if values:
+        apply_deltas(connection, _moved(text_keys(*values[0]), text_keys(*values[1])))
+
+
+@db.event.listens_for(Text, 'after_delete')
+def count_deleted_text(mapper, connection, target):
+    apply_deltas(connection, _moved(text_keys(target.is_ai, target.source, target.acm_topic), []))
+
+
+@db.event.listens_for(AnalysisResult, 'after_insert')
+def count_inserted_analysis(mapper, connection, target):
+    apply_deltas(connection, Counter(analysis_keys(target.ai_proportion, target.overall_score)))
+
+
+@db.event.listens_for(AnalysisResult, 'before_update')
+def count_updated_analysis(mapper, connection, target):
+    values = _stored_and_pending(connection, target, (AnalysisResult.ai_proportion, AnalysisResult.overall_score))
+    if values:
+        apply_deltas(connection, _moved(analysis_keys(*values[0]), analysis_keys(*values[1])))
+
+
+@db.event.listens_for(AnalysisResult, 'after_delete')
+def count_deleted_analysis(mapper, connection, target):
+    apply_deltas(connection, _moved(analysis_keys(target.ai_proportion, target.overall_score), []))
+
+
+@db.event.listens_for(ACMTopic, 'after_insert')
+def count_inserted_topic(mapper, connection, target):
+    apply_deltas(connection, {'acm_topics': 1})
+
+
+@db.event.listens_for(ACMTopic, 'after_delete')
+def count_deleted_topic(mapper, connection, target):
+    apply_deltas(connection, {'acm_topics': -1})
+
+
+def corpus_stats():
+    """Every counter, as a dict"""
+    return dict(db.session.query(CorpusStat.key, CorpusStat.count))
+
+
+def score_histogram(stats, name):
+    """Counts of histogram name ('ai_proportion' or 'ai_score') per bucket, lowest first"""
+    return [stats.get(f'{name}:{bucket}', 0) for bucket in range(HISTOGRAM_BUCKETS)]
+
+
+def _sql_bucket(value):
+    """score_bucket() of a column expression, computed by the database"""
+    return db.case((value < 0, 0), (value >= 1, HISTOGRAM_BUCKETS - 1),
+                   else_=db.cast(value * HISTOGRAM_BUCKETS, db.Integer))
+
+
+def rebuild_corpus_stats():
+    """Recount every counter from the tables, e.g. after bulk deletes"""
+    deltas = Counter()
+    for is_ai, source, acm_topic, count in (db.session.query(Text.is_ai, Text.source, Text.acm_topic,
+                                                             db.func.count(Text.id))
+                                            .group_by(Text.is_ai, Text.source, Text.acm_topic)):
+        for key in text_keys(is_ai, source, acm_topic):
+            deltas[key] += count
+
+    proportion_buckets = _sql_bucket(AnalysisResult.ai_proportion)
+    score_buckets = _sql_bucket(AnalysisResult.overall_score)
+    for proportion_key, score_key, count in (db.session.query(proportion_buckets, score_buckets,
+                                                             db.func.count(AnalysisResult.id))
+                                             .group_by(proportion_buckets, score_buckets)):
+        deltas['analyses'] += count
+        if proportion_key is not None:
+            deltas[f'ai_proportion:{proportion_key}'] += count
+        if score_key is not None:
+            deltas[f'ai_score:{score_key}'] += count
+
+    deltas['acm_topics'] = db.session.query(db.func.count(ACMTopic.id)).scalar()
+
+    CorpusStat.query.delete(synchronize_session=False)
+    apply_deltas(db.session.connection(), deltas)
+    db.session.commit()
+    return deltas
+
+
+def main():
+    with app.app_context():
+        stats = rebuild_corpus_stats()
+        print(f"Recounted {len(stats)} statistics: {stats['texts:ai']} AI texts, "
+              f"{stats['texts:human']} human texts, {stats['analyses']} analyses")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Near-duplicate detection for reference documents.
+
+Every reference Text gets a MinHash sketch of its word shingles when it
+is stored; the bands of the sketch are kept in MinHashBand so a new
+upload is checked against the corpus with a few indexed lookups instead
+of a comparison with every document.
+
+Only uploaded and ingested references are checked and registered.
+Generated texts come from shared templates and are alike by design, and
+texts submitted to /detect (those with an AnalysisJob) are not
+references anyone chose, so neither is ever flagged nor made the text
+others are flagged against.
+
+Usage:
+    python -m app.dedupe              # flag near-duplicates already stored
+    python -m app.dedupe --delete     # delete them instead
+
+Either way the reference index is rebuilt without them.
+"""
+import argparse
+
+import numpy as np
+from flask import current_app
+
+from app import app, db
+from app.language_model import ngram_hashes
+from app.lsh import SHINGLE_SIZE, minhash, minhash_band_keys, minhash_similarity
+from app.models import AnalysisJob, AnalysisResult, MinHashBand, Text
+from app.tokenization import tokenize_document
+
+# Bucket keys per IN (...) query, well under SQLite's parameter limit
+KEYS_PER_QUERY = 500
+
+
+def shingle_hashes(text):
+    """Hashes of the overlapping SHINGLE_SIZE-word shingles of text (a string or tokenized document)"""
+    token_hashes = tokenize_document(text).token_hashes
+    size = min(SHINGLE_SIZE, len(token_hashes))
+    if size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    return ngram_hashes(token_hashes, size)[size - 1]
+
+
+def minhash_sketch(text):
+    """MinHash sketch of the shingles of text"""
+    return minhash(shingle_hashes(text))
+
+
+def load_sketch(payload):
+    return np.frombuffer(payload, dtype=np.uint32)
+
+
+def band_rows(text_id, sketch):
+    """MinHashBand rows registering a stored text's sketch"""
+    return [{'text_id': text_id, 'key': int(key)} for key in minhash_band_keys(sketch)]
+
+
+def stored_near_duplicates(sketches, is_ai, threshold):
+    """For each sketch, (text_id, similarity) of the closest stored text with
+    the same label at or above threshold, or None"""
+    sketch_keys = [minhash_band_keys(sketch) for sketch in sketches]
+    all_keys = np.unique(np.concatenate(sketch_keys)).tolist() if sketches else []
+
+    bucket_ids = {}
+    for start in range(0, len(all_keys), KEYS_PER_QUERY):
+        rows = (db.session.query(MinHashBand.key, MinHashBand.text_id)
+                .join(Text, Text.id == MinHashBand.text_id)
+                .filter(MinHashBand.key.in_(all_keys[start:start + KEYS_PER_QUERY]), Text.is_ai == is_ai)
+                .all())
+        for key, text_id in rows:
+            bucket_ids.setdefault(key, set()).add(text_id)
+
+    candidate_ids = set().union(*bucket_ids.values()) if bucket_ids else set()
+    stored = dict(db.session.query(Text.id, Text.minhash).filter(Text.id.in_(candidate_ids))) if candidate_ids else {}
+
+    matches = []
+    for sketch, keys in zip(sketches, sketch_keys):
+        ids = sorted(set().union(*(bucket_ids.get(int(key), ()) for key in keys)))
+        matches.append(_best_match(sketch, ids, [load_sketch(stored[i]) for i in ids], threshold))
+    return matches
+
+
+def batch_near_duplicates(sketches, threshold):
+    """For each sketch, (position, similarity) of an earlier sketch in the list
+    it nearly duplicates, or None; only kept (unmatched) sketches are matched"""
+    buckets = {}
+    matches = []
+    for position, sketch in enumerate(sketches):
+        keys = [int(key) for key in minhash_band_keys(sketch)]
+        candidates = sorted({i for key in keys for i in buckets.get(key, ())})
+        match = _best_match(sketch, candidates, [sketches[i] for i in candidates], threshold)
+        if match is None:
+            for key in keys:
+                buckets.setdefault(key, []).append(position)
+        matches.append(match)
+    return matches
+
+
+def _best_match(sketch, ids, candidate_sketches, threshold):
+    if not ids:
+        return None
+    similarities = minhash_similarity(sketch, np.stack(candidate_sketches))
+    best = int(np.argmax(similarities))
+    if similarities[best] < threshold:
+        return None
+    return ids[best], float(similarities[best])
+
+
+def checked_texts():
+    """Condition on Text selecting the texts near-duplicate checking covers"""
+    return db.and_(Text.source != 'generated', Text.id.notin_(db.session.query(AnalysisJob.text_id)))
+
+
+def add_reference_text(text, deduplicate=True):
+    """Add a new reference Text and its sketch unless it nearly duplicates a stored one.
+
+    Returns (text_id, similarity) of the stored near-duplicate, or None.
+    With NEAR_DUPLICATE_ACTION 'collapse' a near-duplicate is not added;
+    with 'flag' it is added with duplicate_of set. Without deduplicate
+    the text is neither checked nor registered as a lookup target. The
+    caller commits.
+    """
+    from app.feature_cache import persist_features
+
+    # Tokenized once here; indexing and analysis read the persisted features
+    document = tokenize_document(text.content)
+    sketch = minhash_sketch(document)
+    match = None
+    if deduplicate:
+        match = stored_near_duplicates([sketch], bool(text.is_ai), current_app.config['NEAR_DUPLICATE_THRESHOLD'])[0]
+        if match and current_app.config['NEAR_DUPLICATE_ACTION'] == 'collapse':
+            return match
+
+    persist_features(text.content_hash, document)
+    text.minhash = sketch.tobytes()
+    text.duplicate_of = match[0] if match else None
+    db.session.add(text)
+    db.session.flush()
+    if deduplicate and match is None:
+        # Only kept texts are lookup targets, so matches always point at them
+        db.session.execute(db.insert(MinHashBand), band_rows(text.id, sketch))
+    return match
+
+
+def backfill_sketches(batch_size=200):
+    """Compute the sketches of the checked texts that have none"""
+    from app.feature_cache import document_features
+
+    filled = 0
+    while True:
+        rows = (db.session.query(Text.id, Text.content_hash)
+                .filter(Text.minhash.is_(None), checked_texts())
+                .order_by(Text.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            return filled
+        db.session.execute(db.update(Text), [{'id': text_id,
+                                              'minhash': minhash_sketch(document_features(content_hash)[0]).tobytes()}
+                                             for text_id, content_hash in rows])
+        db.session.commit()
+        filled += len(rows)
+
+
+def dedupe_database(threshold, delete=False):
+    """Regroup the checked texts into kept texts and near-duplicates of them.
+
+    The earliest text of each group is kept. Flagged texts leave the
+    reference index, which is rebuilt if anything changed; with delete
+    they are removed, except those that have analysis results. Texts
+    outside the checked ones are never flagged.
+    """
+    from app.corpus_stats import rebuild_corpus_stats
+    from app.reference_index import rebuild_reference_index
+
+    backfill_sketches()
+    rows = (db.session.query(Text.id, Text.is_ai, Text.minhash, Text.duplicate_of)
+            .filter(checked_texts()).order_by(Text.id).all())
+
+    duplicate_of = {}
+    for is_ai in (True, False):
+        group = [row for row in rows if bool(row.is_ai) == is_ai]
+        matches = batch_near_duplicates([load_sketch(row.minhash) for row in group], threshold)
+        for row, match in zip(group, matches):
+            duplicate_of[row.id] = group[match[0]].id if match else None
+
+    changed = [{'id': row.id, 'duplicate_of': duplicate_of[row.id]}
+               for row in rows if row.duplicate_of != duplicate_of[row.id]]
+    # e.g. generated texts flagged by an earlier run
+    changed += [{'id': text_id, 'duplicate_of': None}
+                for (text_id,) in db.session.query(Text.id).filter(Text.duplicate_of.isnot(None), ~checked_texts())]
+    if changed:
+        db.session.execute(db.update(Text), changed)
+
+    # Re-register the buckets of the kept texts only
+    MinHashBand.query.delete(synchronize_session=False)
+    band_entries = [entry for row in rows if duplicate_of[row.id] is None
+                    for entry in band_rows(row.id, load_sketch(row.minhash))]
+    if band_entries:
+        db.session.execute(db.insert(MinHashBand), band_entries)
+
+    deleted = 0
+    if delete:
+        doomed = (db.session.query(Text.id)
+                  .filter(Text.duplicate_of.isnot(None),
+                          Text.id.notin_(db.session.query(AnalysisResult.text_id)))
+                  .scalar_subquery())
+        AnalysisJob.query.filter(AnalysisJob.text_id.in_(doomed)).delete(synchronize_session=False)
+        deleted = Text.query.filter(Text.id.in_(doomed)).delete(synchronize_session=False)
+    db.session.commit()
+    if deleted:
+        # Bulk deletes skip the counters' mapper events
+        rebuild_corpus_stats()
+
+    if changed or deleted:
+        rebuild_reference_index()
+    return {
+        'texts': len(rows),
+        'duplicates': sum(original is not None for original in duplicate_of.values()),
+        'changed': len(changed),
+        'deleted': deleted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flag or delete near-duplicate texts in the database.')
+    parser.add_argument('--threshold', type=float, help='estimated Jaccard similarity (default: config)')
+    parser.add_argument('--delete', action='store_true',
+                        help='delete near-duplicates that have no analysis results instead of only flagging them')
+    args = parser.parse_args()
+
+    with app.app_context():
+        threshold = args.threshold or app.config['NEAR_DUPLICATE_THRESHOLD']
+        stats = dedupe_database(threshold, args.delete)
+        print(f"{stats['texts']} texts, {stats['duplicates']} near-duplicates "
+              f"({stats['changed']} newly flagged or cleared, {stats['deleted']} deleted)")
+
+
+if __name__ == '__main__':
+    main()
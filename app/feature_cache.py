@@ -0,0 +1,179 @@
+import datetime
+import hashlib
+import io
+import json
+
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.content_store import load_content, load_feature_payload, store_feature_payload
+from app.models import FeatureCache
+from app.tokenization import TokenizedDocument, splitter_name, tokenize_document
+
+# Least-recently-used order only needs to be this precise
+TOUCH_INTERVAL = datetime.timedelta(minutes=1)
+
+
+def content_hash(text):
+    """SHA-256 of the extracted text, used as the cache key"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _join(strings):
+    return np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8)
+
+
+def _split(array):
+    data = array.tobytes().decode('utf-8')
+    return data.split('\n') if data else []
+
+
+def encode_features(features):
+    """Pack a feature dict into a compressed .npz payload"""
+    term_counts = features['term_counts']
+    arrays = {
+        'vocabulary': _join(features['vocabulary']),
+        'token_ids': features['token_ids'],
+        'sentence_lengths': features['sentence_lengths'],
+        'terms': _join(term_counts.keys()),
+        'term_counts': np.fromiter(term_counts.values(), dtype=np.int64, count=len(term_counts)),
+        'metrics': np.frombuffer(json.dumps(features.get('metrics')).encode('utf-8'), dtype=np.uint8),
+        'splitter': _join([features['splitter']]),
+    }
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_features(payload):
+    """Inverse of encode_features; arrays written by older versions are ignored"""
+    arrays = np.load(io.BytesIO(payload), allow_pickle=False)
+    return {
+        'vocabulary': _split(arrays['vocabulary']),
+        'token_ids': arrays['token_ids'],
+        'sentence_lengths': arrays['sentence_lengths'],
+        'term_counts': dict(zip(_split(arrays['terms']), arrays['term_counts'].tolist())),
+        'metrics': json.loads(arrays['metrics'].tobytes().decode('utf-8')),
+        'splitter': _split(arrays['splitter'])[0] if 'splitter' in arrays.files else None,
+    }
+
+
+def extract_features(document):
+    """Text-only features of a tokenized document (no corpus-dependent values)"""
+    return {
+        'vocabulary': document.vocabulary,
+        'token_ids': document.token_ids,
+        'sentence_lengths': document.sentence_lengths,
+        'term_counts': document.term_counts,
+        'metrics': None,
+        'splitter': splitter_name(),
+    }
+
+
+def current_features(payload):
+    """Decoded payload, or None if its text was split into sentences by another splitter"""
+    features = decode_features(payload)
+    return features if features['splitter'] == splitter_name() else None
+
+
+def load_features(key):
+    """Return the cached features for key, marking the entry as recently used.
+
+    Entries are keyed by content hash and splitter_name(): one tokenized
+    by the other sentence splitter is a miss, and is replaced when the
+    text is tokenized again.
+    """
+    entry = db.session.get(FeatureCache, key)
+    if entry is None:
+        return None
+    features = current_features(entry.features)
+    if features is None:
+        return None
+    now = datetime.datetime.utcnow()
+    if entry.last_accessed is None or now - entry.last_accessed > TOUCH_INTERVAL:
+        # A cache hit is a read; only take the write lock once in a while
+        entry.last_accessed = now
+        db.session.commit()
+    return features
+
+
+def save_features(key, features):
+    """Insert or replace the cached features for key, then enforce the size bounds"""
+    payload = encode_features(features)
+    entry = db.session.get(FeatureCache, key)
+    if entry is None:
+        entry = FeatureCache(content_hash=key)
+        db.session.add(entry)
+    entry.features = payload
+    entry.size = len(payload)
+    entry.last_accessed = datetime.datetime.utcnow()
+    db.session.commit()
+    evict(current_app.config['FEATURE_CACHE_MAX_ENTRIES'], current_app.config['FEATURE_CACHE_MAX_BYTES'])
+
+
+def evict(max_entries, max_bytes):
+    """Drop least recently used entries until both bounds hold"""
+    count, total = db.session.query(db.func.count(FeatureCache.content_hash),
+                                    db.func.coalesce(db.func.sum(FeatureCache.size), 0)).one()
+    if count <= max_entries and total <= max_bytes:
+        return 0
+
+    evicted = []
+    entries = (db.session.query(FeatureCache.content_hash, FeatureCache.size)
+               .order_by(FeatureCache.last_accessed)
+               .yield_per(500))
+    for key, size in entries:
+        if count <= max_entries and total <= max_bytes:
+            break
+        evicted.append(key)
+        count -= 1
+        total -= size
+
+    FeatureCache.query.filter(FeatureCache.content_hash.in_(evicted)).delete(synchronize_session=False)
+    db.session.commit()
+    return len(evicted)
+
+
+def features_document(features, text=None):
+    """The tokenized document that features were extracted from"""
+    return TokenizedDocument.from_parts(text, features['vocabulary'], features['token_ids'],
+                                        features['sentence_lengths'], features['term_counts'])
+
+
+def cached_document(text):
+    """Return (key, tokenized document, features), tokenizing only on a cache miss"""
+    key = content_hash(text)
+    features = load_features(key)
+    if features is not None:
+        return key, features_document(features, text), features
+
+    document = tokenize_document(text)
+    features = extract_features(document)
+    save_features(key, features)
+    return key, document, features
+
+
+def document_features(content_hash):
+    """Return (tokenized document, features) of a stored text, tokenizing it only once.
+
+    Unlike cache entries these are kept for as long as the text is: they
+    are written to the content store when the text is uploaded or
+    ingested (or else first indexed), so re-analysing or re-scoring a
+    stored text never tokenizes it again, unless the sentence splitter
+    has changed since.
+    """
+    payload = load_feature_payload(content_hash)
+    features = current_features(payload) if payload is not None else None
+    if features is not None:
+        return features_document(features), features
+
+    document = tokenize_document(load_content(content_hash))
+    return document, persist_features(content_hash, document)
+
+
+def persist_features(content_hash, document):
+    """Keep the features of the stored text tokenized as document; returns them"""
+    features = extract_features(document)
+    store_feature_payload(content_hash, encode_features(features))
+    return features
@@ -0,0 +1,157 @@
+"""Conditional responses and rendered-fragment caching for the result views.
+
+What a result page shows only changes when its analysis is re-run
+(AnalysisResult.analyzed_at) or re-ranked (score_version), when its
+text row changes (Text.updated_at) or, while it is queued, when its job
+moves on. A view lists those versions; they make up its ETag and
+Last-Modified, so a client that already has the page gets a 304
+without anything being queried or rendered beyond the versions.
+
+Rendered pages and fragments are kept in a bounded in-process LRU keyed
+by the same versions, so a change to a row is never served stale: its
+new version simply misses, and the old entries age out. The key also
+covers the template files, so a deploy never serves old markup.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+
+from app.scoring import version_time
+
+
+class FragmentCache:
+    """Least-recently-used cache of rendered strings, bounded by entries and characters"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def render(self, key, build):
+        """The cached string for key, built and cached on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+
+_cache = None
+_template_version = None
+
+
+def fragment_cache():
+    """The process-wide fragment cache"""
+    global _cache
+    if _cache is None:
+        _cache = FragmentCache(current_app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                               current_app.config['FRAGMENT_CACHE_MAX_BYTES'])
+    return _cache
+
+
+def template_version():
+    """Changes whenever a template file does"""
+    global _template_version
+    if _template_version is None:
+        stamps = []
+        for root, _, names in os.walk(os.path.join(current_app.root_path, current_app.template_folder)):
+            for name in sorted(names):
+                stat = os.stat(os.path.join(root, name))
+                stamps.append((name, stat.st_mtime_ns, stat.st_size))
+        _template_version = hashlib.sha1(repr(sorted(stamps)).encode()).hexdigest()[:12]
+    return _template_version
+
+
+def text_version(text):
+    return ('text', text.id, text.updated_at or text.created_at)
+
+
+def analysis_version(analysis):
+    if analysis is None:
+        return ('analysis', None)
+    # A re-ranked score counts as modified when its model was trained
+    return ('analysis', analysis.id, analysis.analyzed_at, version_time(analysis.score_version))
+
+
+def job_version(job):
+    if job is None:
+        return ('job', None)
+    return ('job', job.id, job.status, job.created_at, job.started_at, job.finished_at)
+
+
+def wants_json():
+    """Whether the client asked for the JSON variant of a view (?format=json or Accept)"""
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def fragment_key(*versions):
+    return hashlib.sha1(repr((template_version(),) + versions).encode()).hexdigest()
+
+
+def cached_fragment(versions, build):
+    """Markup of a fragment that depends only on versions, rendered by build() on a miss"""
+    return Markup(fragment_cache().render(fragment_key(*versions), build))
+
+
+def cached_view(versions, render_html, render_json):
+    """Response of a view whose output depends only on versions.
+
+    A conditional request that matches gets a 304; otherwise the body
+    comes from the fragment cache or from render_html() / render_json(),
+    which are only called on a miss. render_json returns a JSON-serialisable
+    object.
+    """
+    variant = 'json' if wants_json() else 'html'
+    etag = fragment_key(request.endpoint, variant, request.query_string, *versions)
+    stamps = [part for version in versions for part in version if isinstance(part, datetime.datetime)]
+    last_modified = max(stamps) if stamps else None
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    elif variant == 'json':
+        body = fragment_cache().render(etag, lambda: json.dumps(render_json()))
+        response = Response(body, mimetype='application/json')
+    else:
+        response = Response(fragment_cache().render(etag, render_html), mimetype='text/html')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Cacheable, but always revalidated, so a re-run analysis shows at once
+    response.cache_control.no_cache = True
+    response.vary.add('Accept')
+    return response
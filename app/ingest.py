@@ -0,0 +1,216 @@
+"""Bulk-load reference documents into the Text table.
+
+Usage:
+    python -m app.ingest --label human uploads/
+    python -m app.ingest --label ai "corpora/ai/**/*.txt" --workers 8
+
+PDFs and .txt files are extracted and sketched in parallel, deduplicated
+by content hash and by MinHash near-duplicate lookup (see app.dedupe),
+and inserted in batched transactions; the reference index is
+brought up to date after every batch. Files whose path is already
+stored are skipped without being read again, so an interrupted run can
+simply be started again.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from app import app, db
+from app.content_store import store_content, store_feature_payload
+from app.corpus_stats import record_texts
+from app.dedupe import band_rows, batch_near_duplicates, minhash_sketch, stored_near_duplicates
+from app.feature_cache import encode_features, extract_features
+from app.models import PREVIEW_LENGTH, MinHashBand, Text
+from app.pdf_extractor import extract_text_from_pdf
+from app.reference_index import update_reference_index
+from app.tokenization import tokenize_document
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+
+
+def find_documents(patterns):
+    """Expand directories and glob patterns into a sorted list of document paths"""
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.update(os.path.join(root, name) for name in files)
+        else:
+            paths.update(glob.glob(pattern, recursive=True))
+    return sorted(os.path.abspath(path) for path in paths
+                  if path.lower().endswith(SUPPORTED_EXTENSIONS) and os.path.isfile(path))
+
+
+def read_document(path):
+    """Extract one document inside a worker process; returns (path, text, hash, sketch, features).
+
+    The text is tokenized here, once: the sketch comes from its tokens
+    and its encoded document features are persisted with the body.
+    """
+    if path.lower().endswith('.pdf'):
+        # One process per file already; don't fan pages out a second time
+        content = extract_text_from_pdf(path, workers=1)
+    else:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    if not content or not content.strip():
+        return path, None, None, None, None
+    document = tokenize_document(content)
+    return (path, content, hashlib.sha256(content.encode('utf-8')).hexdigest(), minhash_sketch(document),
+            encode_features(extract_features(document)))
+
+
+def read_documents(executor, paths, window):
+    """Yield read_document results as they complete, with at most window files in flight.
+
+    Only the pending files and the results not yet consumed are held, so
+    memory does not grow with the size of the corpus.
+    """
+    paths = iter(paths)
+    pending = set()
+    while True:
+        for path in itertools.islice(paths, window - len(pending)):
+            pending.add(executor.submit(read_document, path))
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def insert_batch(batch, is_ai, topic):
+    """Insert a batch of (path, content, hash, sketch, features) in one transaction.
+
+    Exact copies (known hashes) are skipped; near-duplicates of stored
+    texts or of earlier texts in the batch are skipped or flagged as
+    NEAR_DUPLICATE_ACTION says. Returns (inserted, near_duplicates).
+    """
+    hashes = [document[2] for document in batch]
+    known = {h for (h,) in db.session.query(Text.content_hash).filter(Text.content_hash.in_(hashes))}
+    unique = []
+    for document in batch:
+        if document[2] not in known:
+            known.add(document[2])
+            unique.append(document)
+
+    threshold = app.config['NEAR_DUPLICATE_THRESHOLD']
+    sketches = [document[3] for document in unique]
+    stored_matches = stored_near_duplicates(sketches, is_ai, threshold)
+    batch_matches = batch_near_duplicates(sketches, threshold)
+
+    def row(path, content, content_hash, sketch, features, duplicate_of=None):
+        # Bulk inserts skip the model's event listeners, so store the body and
+        # derive the other content columns here
+        store_content(content_hash, content)
+        store_feature_payload(content_hash, features)
+        return {
+            'content_hash': content_hash,
+            'preview': content[:PREVIEW_LENGTH],
+            'content_length': len(content),
+            'minhash': sketch.tobytes(),
+            'duplicate_of': duplicate_of,
+            'source': 'pdf' if path.lower().endswith('.pdf') else 'txt',
+            'topic': topic,
+            'file_path': path,
+            'is_ai': is_ai,
+        }
+
+    # Kept texts first: their ids are what the near-duplicates point at
+    kept = [i for i in range(len(unique)) if not stored_matches[i] and not batch_matches[i]]
+    ids = {}
+    if kept:
+        rows = [row(*unique[i]) for i in kept]
+        inserted = db.session.execute(db.insert(Text).returning(Text.id, sort_by_parameter_order=True), rows)
+        ids = dict(zip(kept, inserted.scalars()))
+        record_texts(rows)
+        db.session.execute(db.insert(MinHashBand), [entry for i in kept for entry in band_rows(ids[i], unique[i][3])])
+
+    near_duplicates = [i for i in range(len(unique)) if i not in ids]
+    if near_duplicates and app.config['NEAR_DUPLICATE_ACTION'] == 'flag':
+        rows = []
+        for i in near_duplicates:
+            # A batch text matched in the batch is a kept one, unless it matched a stored text itself
+            original = stored_matches[i] or stored_matches[batch_matches[i][0]]
+            rows.append(row(*unique[i], duplicate_of=original[0] if original else ids[batch_matches[i][0]]))
+        db.session.execute(db.insert(Text), rows)
+        record_texts(rows)
+    db.session.commit()
+    return len(ids), len(near_duplicates)
+
+
+def insert_and_count(batch, is_ai, topic, stats):
+    inserted, near_duplicates = insert_batch(batch, is_ai, topic)
+    stats['inserted'] += inserted
+    stats['near_duplicates'] += near_duplicates
+    stats['duplicates'] += len(batch) - inserted - near_duplicates
+
+
+def ingest(patterns, is_ai, topic=None, workers=None, batch_size=100):
+    """Ingest every matching document; returns a dict of counters"""
+    topic = topic or ('Bulk AI Document' if is_ai else 'Bulk Human Document')
+    paths = find_documents(patterns)
+
+    # Resume: anything whose file is already stored was ingested by an earlier run
+    stored = {path for (path,) in db.session.query(Text.file_path).filter(Text.file_path.isnot(None))}
+    todo = [path for path in paths if path not in stored]
+    stats = {'found': len(paths), 'already_stored': len(paths) - len(todo),
+             'inserted': 0, 'duplicates': 0, 'near_duplicates': 0, 'empty': 0}
+
+    start = time.perf_counter()
+    batch = []
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # Enough files queued to keep every worker busy, and no more
+        for document in read_documents(executor, todo, 2 * workers):
+            if document[1] is None:
+                stats['empty'] += 1
+                continue
+            batch.append(document)
+            if len(batch) >= batch_size:
+                insert_and_count(batch, is_ai, topic, stats)
+                batch = []
+                update_reference_index()
+                print(f"  {stats['inserted']} inserted, {stats['duplicates']} duplicates, "
+                      f"{stats['near_duplicates']} near-duplicates")
+
+    if batch:
+        insert_and_count(batch, is_ai, topic, stats)
+    update_reference_index()
+
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-load reference documents into the database.')
+    parser.add_argument('paths', nargs='+', help='directories, files or glob patterns of .pdf/.txt documents')
+    parser.add_argument('--label', choices=['ai', 'human'], required=True, help='corpus the documents belong to')
+    parser.add_argument('--topic', help='topic stored on every row')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='extraction processes')
+    parser.add_argument('--batch-size', type=int, default=100, help='rows per transaction')
+    parser.add_argument('--rebuild-language-model', action='store_true',
+                        help='retrain the perplexity language model afterwards')
+    args = parser.parse_args()
+
+    with app.app_context():
+        stats = ingest(args.paths, args.label == 'ai', args.topic, args.workers, args.batch_size)
+        rate = stats['inserted'] / stats['seconds'] if stats['seconds'] else 0.0
+        print(f"Found {stats['found']} documents ({stats['already_stored']} already stored). "
+              f"Inserted {stats['inserted']}, skipped {stats['duplicates']} duplicates, "
+              f"found {stats['near_duplicates']} near-duplicates "
+              f"and {stats['empty']} without text in {stats['seconds']:.1f}s "
+              f"({rate:.1f} documents/s)")
+
+        if args.rebuild_language_model:
+            from app.language_model import build_language_model
+            print(f"Language model written to {build_language_model()}")
+
+
+if __name__ == '__main__':
+    main()
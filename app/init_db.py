@@ -1,13 +1,16 @@
 from app import app, db
 from app.models import Text, AnalysisResult, ACMTopic
 from app.ai_generator import initialize_acm_topics
+from app.schema import upgrade_schema
 
 
 def init_db():
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables and upgrade older databases in place
+        added = upgrade_schema()
         print("Database tables created successfully!")
+        if added:
+            print(f"Added columns: {', '.join(added)}")
 
         # Initialize ACM topics
         initialize_acm_topics()
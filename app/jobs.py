@@ -0,0 +1,248 @@
+import datetime
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from app import db
+from app.metrics import merge, profiled, recording, text_bytes, timed
+from app.models import AnalysisJob, AnalysisResult, AnalysisWindow, Text
+
+
+# Jobs that still owe their text an analysis
+ACTIVE_STATUSES = ('pending', 'running')
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def save_analysis_result(text_id, analysis_results, windows=None, profile_path=None):
+    """Create or update the AnalysisResult of a text, replacing its window scores if given"""
+    analysis = AnalysisResult.query.filter_by(text_id=text_id).first()
+    if analysis is None:
+        analysis = AnalysisResult(text_id=text_id)
+        db.session.add(analysis)
+
+    analysis.perplexity = analysis_results['perplexity']
+    analysis.burstiness = analysis_results['burstiness']
+    analysis.ai_proportion = analysis_results['ai_proportion']
+    analysis.ai_similarity = analysis_results['ai_similarity']
+    analysis.human_similarity = analysis_results['human_similarity']
+    analysis.overall_score = analysis_results['overall_ai_score']
+    analysis.score_version = analysis_results['score_version']
+    analysis.analyzed_at = datetime.datetime.utcnow()
+    analysis.profile_path = profile_path
+
+    if windows is not None:
+        AnalysisWindow.query.filter_by(text_id=text_id).delete(synchronize_session=False)
+        db.session.execute(db.insert(AnalysisWindow), [dict(window, text_id=text_id) for window in windows])
+    return analysis
+
+
+def job_status(job):
+    """JSON-serialisable view of a job"""
+    return {
+        'id': job.id,
+        'text_id': job.text_id,
+        'status': job.status,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def enqueue_analysis(text, file_path=None):
+    """Queue an analysis of text; file_path is a PDF to extract into it first"""
+    from flask import current_app
+
+    job = AnalysisJob(text_id=text.id, file_path=file_path)
+    db.session.add(job)
+    db.session.commit()
+
+    if current_app.config['ANALYSIS_ASYNC']:
+        start_job_dispatcher(current_app._get_current_object())
+        _wake.set()
+    else:
+        claim_job(job.id)
+        run_analysis_job(job.id)
+        db.session.refresh(job)
+    return job
+
+
+def claim_job(job_id):
+    """Atomically move a pending job to running; False if someone else got it"""
+    claimed = (AnalysisJob.query
+               .filter_by(id=job_id, status='pending')
+               .update({'status': 'running',
+                        'started_at': datetime.datetime.utcnow(),
+                        'attempts': AnalysisJob.attempts + 1},
+                       synchronize_session=False))
+    db.session.commit()
+    return claimed == 1
+
+
+def claim_next_job():
+    """Claim the oldest pending job, returning its id or None"""
+    while True:
+        job_id = (db.session.query(AnalysisJob.id)
+                  .filter_by(status='pending')
+                  .order_by(AnalysisJob.id)
+                  .limit(1)
+                  .scalar())
+        if job_id is None:
+            return None
+        if claim_job(job_id):
+            return job_id
+
+
+def _requeue(jobs, max_attempts, error):
+    # attempts already counts the claim that left the job running
+    for job in jobs:
+        if job.attempts >= max_attempts:
+            job.status = 'failed'
+            job.error = job.error or error
+            job.finished_at = datetime.datetime.utcnow()
+        else:
+            job.status = 'pending'
+    db.session.commit()
+
+
+def requeue_stale_jobs(timeout, max_attempts):
+    """Return jobs left running by a crashed or restarted process to the queue"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=timeout)
+    stale = AnalysisJob.query.filter(AnalysisJob.status == 'running', AnalysisJob.started_at < cutoff)
+    _requeue(stale, max_attempts, 'Analysis did not finish')
+
+
+def requeue_jobs(job_ids, max_attempts):
+    """Return the running jobs of a worker pool that broke to the queue at once"""
+    running = AnalysisJob.query.filter(AnalysisJob.id.in_(job_ids), AnalysisJob.status == 'running')
+    _requeue(running, max_attempts, 'Analysis worker died')
+
+
+def job_pdf_workers(config):
+    """PDF extraction processes per job worker, so all job workers together stay within PDF_WORKERS"""
+    return max(1, config['PDF_WORKERS'] // config['ANALYSIS_WORKERS'])
+
+
+def run_analysis_job(job_id):
+    """Extract (if needed) and analyze the text of a claimed job.
+
+    Returns the final status and the stage timings recorded on the way,
+    for the dispatcher to merge into the serving process' metrics.
+    """
+    from app import app
+    from app.pdf_extractor import extract_text_from_pdf
+    from app.text_analyzer import stored_text_analysis
+
+    with app.app_context(), recording() as observations:
+        job = db.session.get(AnalysisJob, job_id)
+        try:
+            text = db.session.get(Text, job.text_id)
+            if job.file_path:
+                with timed('job.extract_pdf', os.path.getsize(job.file_path)):
+                    text_content = extract_text_from_pdf(job.file_path, workers=job_pdf_workers(app.config))
+                if not text_content:
+                    raise ValueError('Error extracting text from PDF')
+                with timed('job.store_text', text_bytes(text_content)):
+                    text.content = text_content
+                    db.session.commit()
+
+            # Analyse outside any write transaction, then write in one short one
+            with profiled(f'text-{job.text_id}') as profile:
+                with timed('job.analysis', text.content_length):
+                    analysis_results, windows = stored_text_analysis(text)
+            save_analysis_result(job.text_id, analysis_results, windows, profile['path'])
+            job.status = 'done'
+            job.error = None
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(AnalysisJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+        job.finished_at = datetime.datetime.utcnow()
+        with timed('job.commit'):
+            db.session.commit()
+        return job.status, observations
+
+
+class JobDispatcher(threading.Thread):
+    """Feeds queued jobs from the database to a local process pool"""
+
+    def __init__(self, app):
+        super().__init__(name='analysis-dispatcher', daemon=True)
+        self.app = app
+        self.workers = app.config['ANALYSIS_WORKERS']
+        self.executor = None
+
+    def _new_executor(self):
+        # spawn: workers must not inherit the web process' threads and DB connections
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def run(self):
+        config = self.app.config
+        self.executor = self._new_executor()
+        in_flight = {}
+        while True:
+            with self.app.app_context():
+                try:
+                    requeue_stale_jobs(config['ANALYSIS_JOB_TIMEOUT'], config['ANALYSIS_MAX_ATTEMPTS'])
+                    while len(in_flight) < self.workers:
+                        job_id = claim_next_job()
+                        if job_id is None:
+                            break
+                        in_flight[self.executor.submit(run_analysis_job, job_id)] = job_id
+                except RuntimeError:
+                    # The pool refuses new work once the interpreter is shutting down
+                    return
+                except Exception as e:
+                    self.app.logger.error('Analysis dispatcher error: %s', e)
+                finally:
+                    db.session.remove()
+
+            if not in_flight:
+                _wake.wait(config['ANALYSIS_POLL_INTERVAL'])
+                _wake.clear()
+                continue
+
+            done, _ = wait(in_flight, timeout=config['ANALYSIS_POLL_INTERVAL'], return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                job_id = in_flight.pop(future)
+                try:
+                    _, observations = future.result()
+                    merge(observations)
+                except BrokenProcessPool:
+                    broken.append(job_id)
+                except Exception as e:
+                    self.app.logger.error('Analysis job %s crashed: %s', job_id, e)
+            if broken:
+                # A worker died mid-job and took the pool down with it: every
+                # job still in flight is lost, so queue them all again now
+                broken.extend(in_flight.values())
+                in_flight.clear()
+                self.app.logger.error('Analysis worker died; requeueing jobs %s', broken)
+                with self.app.app_context():
+                    try:
+                        requeue_jobs(broken, config['ANALYSIS_MAX_ATTEMPTS'])
+                    finally:
+                        db.session.remove()
+                self.executor = self._new_executor()
+
+
+def start_job_dispatcher(app):
+    """Start this process' dispatcher thread if it is not running yet"""
+    global _dispatcher
+    if multiprocessing.parent_process() is not None:
+        # Pool workers re-import the main module under spawn; only the
+        # serving process dispatches
+        return None
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = JobDispatcher(app)
+            _dispatcher.start()
+    return _dispatcher
@@ -0,0 +1,286 @@
+import datetime
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+
+# Multiplier used to fold a token hash into the hash of the n-gram before it
+NGRAM_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Absolute discount subtracted from every observed n-gram count
+DEFAULT_DISCOUNT = 0.75
+
+# Every HOLDOUT_EVERY-th training text is held out to measure the
+# perplexity scale of unseen text (see perplexity_percentiles)
+HOLDOUT_EVERY = 10
+SCALE_PERCENTILES = (5, 50, 95)
+# Without a measured scale, perplexity is read as the self-perplexity
+# of a text always has been: 100 and above counts as fully human
+DEFAULT_PERPLEXITY_SCALE = 100
+
+
+def ngram_hashes(token_hashes, order):
+    """Hashes of every n-gram of each length up to order.
+
+    Element k-1 of the result holds the hashes of all k-grams, where
+    entry j covers tokens j .. j+k-1.
+    """
+    grams = [np.asarray(token_hashes, dtype=np.uint64)]
+    for k in range(2, order + 1):
+        if len(token_hashes) < k:
+            grams.append(np.zeros(0, dtype=np.uint64))
+            continue
+        # Unsigned overflow is the intended wrap-around of the hash
+        grams.append(grams[-1][:-1] * NGRAM_HASH_MULTIPLIER + grams[0][k - 1:])
+    return grams
+
+
+def lookup(keys, values, queries, default):
+    """Vectorized table lookup: values for queries found in sorted keys, else default"""
+    if len(keys) == 0:
+        return np.full(len(queries), default, dtype=np.float64)
+    positions = np.searchsorted(keys, queries)
+    positions[positions == len(keys)] = 0
+    found = keys[positions] == queries
+    return np.where(found, values[positions], default)
+
+
+def self_perplexity(token_hashes, n=2):
+    """Perplexity of the n-grams of a text under their own relative frequencies"""
+    grams = ngram_hashes(token_hashes, n)[n - 1]
+    if len(grams) == 0:
+        return float('inf')
+    _, inverse, counts = np.unique(grams, return_inverse=True, return_counts=True)
+    log_probs = np.log(counts[inverse] / len(grams))
+    return math.exp(-log_probs.mean())
+
+
+class NgramLanguageModel:
+    """Interpolated absolute-discounting n-gram model over hashed tokens.
+
+    Every table is a sorted uint64 key array next to a float32 value
+    array, saved as plain .npy files and memory-mapped on load, so a
+    model opens in milliseconds and scoring is a handful of
+    searchsorted lookups per order over the whole document.
+    """
+
+    def __init__(self, path, tables, meta):
+        self.path = path
+        self.tables = tables
+        self.meta = meta
+        self.order = meta['order']
+        self.version = meta['version']
+        self.unknown_prob = meta['unknown_prob']
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        tables = {}
+        for name in meta['tables']:
+            tables[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        return cls(path, tables, meta)
+
+    def token_log_probs(self, token_hashes):
+        """Log-probability of every token that has a full (order - 1) context"""
+        order = min(self.order, len(token_hashes))
+        if order == 0:
+            return np.zeros(0)
+        grams = ngram_hashes(token_hashes, order)
+        n_scored = len(token_hashes) - order + 1
+
+        # Unigram level, then interpolate one order at a time
+        probs = lookup(self.tables['order1_keys'], self.tables['order1_probs'],
+                       grams[0][order - 1:], self.unknown_prob)
+        for k in range(2, order + 1):
+            start = order - k
+            keys = grams[k - 1][start:start + n_scored]
+            contexts = grams[k - 2][start:start + n_scored]
+            discounted = lookup(self.tables[f'order{k}_keys'], self.tables[f'order{k}_probs'], keys, 0.0)
+            backoff = lookup(self.tables[f'order{k}_context_keys'], self.tables[f'order{k}_context_weights'],
+                             contexts, 1.0)
+            probs = discounted + backoff * probs
+        return np.log(probs)
+
+    def perplexity(self, token_hashes):
+        log_probs = self.token_log_probs(token_hashes)
+        if len(log_probs) == 0:
+            return float('inf')
+        return math.exp(-log_probs.mean())
+
+    def normalized_perplexity(self, perplexity):
+        """Where perplexity falls between the 5th and 95th percentile of held-out texts, in 0..1"""
+        percentiles = self.meta.get('perplexity_percentiles')
+        if not percentiles:
+            return min(perplexity / DEFAULT_PERPLEXITY_SCALE, 1.0)
+        low, high = math.log(percentiles['5']), math.log(percentiles['95'])
+        if high <= low:
+            return 1.0 if perplexity > percentiles['95'] else 0.0
+        return min(max((math.log(perplexity) - low) / (high - low), 0.0), 1.0)
+
+
+def count_ngrams(token_hash_arrays, order):
+    """Sorted unique n-gram hashes, their counts and their context hashes, per order"""
+    occurrences = [[] for _ in range(order)]
+    context_occurrences = [[] for _ in range(order)]
+    for token_hashes in token_hash_arrays:
+        grams = ngram_hashes(token_hashes, order)
+        for k in range(order):
+            occurrences[k].append(grams[k])
+            if k:
+                # The context of a k-gram is the (k-1)-gram starting at the same position
+                context_occurrences[k].append(grams[k - 1][:len(grams[k])])
+
+    counts = []
+    for k in range(order):
+        grams = np.concatenate(occurrences[k]) if occurrences[k] else np.zeros(0, dtype=np.uint64)
+        keys, first, gram_counts = np.unique(grams, return_index=True, return_counts=True)
+        contexts = np.concatenate(context_occurrences[k])[first] if k and occurrences[k] else None
+        counts.append((keys, gram_counts, contexts))
+    return counts
+
+
+def train_language_model(token_hash_arrays, order=2, discount=DEFAULT_DISCOUNT):
+    """Estimate the model tables from per-document token hash arrays"""
+    counts = count_ngrams(list(token_hash_arrays), order)
+    tables = {}
+
+    keys, gram_counts, _ = counts[0]
+    n_tokens = int(gram_counts.sum())
+    # Add-one unigrams with one extra slot for unseen tokens
+    denominator = n_tokens + len(keys) + 1
+    tables['order1_keys'] = keys
+    tables['order1_probs'] = ((gram_counts + 1) / denominator).astype(np.float32)
+
+    for k in range(2, order + 1):
+        keys, gram_counts, contexts = counts[k - 1]
+        context_keys, inverse = np.unique(contexts, return_inverse=True)
+        context_totals = np.bincount(inverse, weights=gram_counts)
+        context_types = np.bincount(inverse)
+
+        tables[f'order{k}_keys'] = keys
+        tables[f'order{k}_probs'] = (np.maximum(gram_counts - discount, 0)
+                                     / context_totals[inverse]).astype(np.float32)
+        tables[f'order{k}_context_keys'] = context_keys
+        tables[f'order{k}_context_weights'] = (discount * context_types / context_totals).astype(np.float32)
+
+    meta = {
+        'order': order,
+        'discount': discount,
+        'n_tokens': n_tokens,
+        'vocabulary_size': int(len(counts[0][0])),
+        'unknown_prob': 1.0 / denominator,
+        'tables': sorted(tables),
+    }
+    return tables, meta
+
+
+def perplexity_percentiles(token_hash_arrays, order=2, discount=DEFAULT_DISCOUNT):
+    """Percentiles of the perplexity of held-out texts under a model of the others, or None.
+
+    A text scored by a model trained on it looks far more predictable
+    than any new text would, so the scale is measured on texts the
+    model has not seen.
+    """
+    token_hash_arrays = list(token_hash_arrays)
+    training = [hashes for i, hashes in enumerate(token_hash_arrays) if i % HOLDOUT_EVERY]
+    held_out = [hashes for i, hashes in enumerate(token_hash_arrays) if not i % HOLDOUT_EVERY and len(hashes) >= order]
+    if not training or len(held_out) < 2:
+        return None
+    tables, meta = train_language_model(training, order, discount)
+    model = NgramLanguageModel(None, tables, dict(meta, version=None))
+    perplexities = [model.perplexity(hashes) for hashes in held_out]
+    return {str(q): float(value) for q, value in zip(SCALE_PERCENTILES, np.percentile(perplexities, SCALE_PERCENTILES))}
+
+
+def save_language_model(folder, tables, meta):
+    """Write a new model version and make it the current one"""
+    meta = dict(meta, version=datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, meta['version'])
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in tables.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), array)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+
+    # Readers follow this pointer, so switching versions is a single rename
+    pointer_tmp = os.path.join(folder, 'current.tmp')
+    with open(pointer_tmp, 'w') as f:
+        f.write(meta['version'])
+    os.replace(pointer_tmp, os.path.join(folder, 'current'))
+
+    # Keep the previous version around for workers still mapping it
+    versions = sorted(name for name in os.listdir(folder)
+                      if os.path.isdir(os.path.join(folder, name)) and not name.endswith('.tmp'))
+    for name in versions[:-2]:
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    return path
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_language_model():
+    """Return the current trained model, or None if none is available"""
+    global _model
+    from flask import current_app, has_app_context
+
+    if not has_app_context():
+        return None
+    folder = current_app.config['LANGUAGE_MODEL_FOLDER']
+    try:
+        with open(os.path.join(folder, 'current')) as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+
+    with _model_lock:
+        if _model is None or _model.path != os.path.join(folder, version):
+            _model = NgramLanguageModel.load(os.path.join(folder, version))
+        return _model
+
+
+def build_language_model(order=None, batch_size=200):
+    """Train the reference model on every stored human and AI Text.
+
+    Near-duplicates and texts submitted to /detect (those with an
+    AnalysisJob), which the model will score, are left out. Tokens come
+    from the persisted document features, so no text is tokenized twice.
+    """
+    from flask import current_app
+    from app import db
+    from app.feature_cache import document_features
+    from app.models import AnalysisJob, Text
+
+    order = order or current_app.config['LANGUAGE_MODEL_ORDER']
+    token_hash_arrays = []
+    query = (db.session.query(Text.content_hash)
+             .filter(Text.duplicate_of.is_(None), Text.content_length > 0,
+                     Text.id.notin_(db.session.query(AnalysisJob.text_id)))
+             .order_by(Text.id)
+             .yield_per(batch_size))
+    for (content_hash,) in query:
+        token_hash_arrays.append(document_features(content_hash)[0].token_hashes)
+
+    tables, meta = train_language_model(token_hash_arrays, order=order)
+    meta['perplexity_percentiles'] = perplexity_percentiles(token_hash_arrays, order)
+    return save_language_model(current_app.config['LANGUAGE_MODEL_FOLDER'], tables, meta)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        start = time.perf_counter()
+        path = build_language_model()
+        print(f"Language model written to {path} in {time.perf_counter() - start:.1f}s")
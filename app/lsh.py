@@ -0,0 +1,133 @@
+import numpy as np
+
+
+# Random-projection (SimHash) signatures: one bit per random hyperplane
+SIGNATURE_BITS = 512
+SIGNATURE_BYTES = SIGNATURE_BITS // 8
+
+# Bits per LSH band; narrower bands find more (and less similar) candidates
+DEFAULT_BAND_BITS = 16
+
+# Set bits in every byte value, for Hamming distances over packed signatures
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_SPLITMIX_MUL1 = np.uint64(0xBF58476D1CE4E5B9)
+_SPLITMIX_MUL2 = np.uint64(0x94D049BB133111EB)
+
+
+def _splitmix64(x):
+    # Unsigned overflow is the intended wrap-around of the mixer
+    z = x + _SPLITMIX_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * _SPLITMIX_MUL1
+    z = (z ^ (z >> np.uint64(27))) * _SPLITMIX_MUL2
+    return z ^ (z >> np.uint64(31))
+
+
+def projection_signs(term_ids, n_bits=SIGNATURE_BITS):
+    """±1 hyperplane coefficients of each term, derived from its id alone.
+
+    Hashing instead of storing a random matrix means a growing
+    vocabulary never invalidates the signatures already computed.
+    """
+    term_ids = np.asarray(term_ids, dtype=np.uint64)
+    cells = term_ids[:, None] * np.uint64(n_bits) + np.arange(n_bits, dtype=np.uint64)
+    return np.where(_splitmix64(cells) >> np.uint64(63), 1.0, -1.0).astype(np.float32)
+
+
+def signatures(matrix, n_bits=SIGNATURE_BITS):
+    """Packed SimHash signatures of the rows of a weighted CSR matrix"""
+    used, columns = np.unique(matrix.indices, return_inverse=True)
+    compact = matrix.__class__((matrix.data.astype(np.float32), columns.astype(np.int32), matrix.indptr),
+                               shape=(matrix.shape[0], len(used)))
+    projected = compact @ projection_signs(used, n_bits)
+    return np.packbits(projected > 0, axis=1)
+
+
+def band_keys(packed, band_bits=DEFAULT_BAND_BITS):
+    """Split packed signatures into one integer key per band"""
+    bits = np.unpackbits(packed, axis=1)
+    n_bands = bits.shape[1] // band_bits
+    bits = bits[:, :n_bands * band_bits].reshape(len(bits), n_bands, band_bits).astype(np.uint64)
+    return (bits << np.arange(band_bits, dtype=np.uint64)).sum(axis=2, dtype=np.uint64)
+
+
+def hamming_distances(packed, query):
+    """Hamming distance of one packed signature to every row of packed"""
+    return POPCOUNT[np.bitwise_xor(packed, query)].sum(axis=1, dtype=np.int64)
+
+
+class BandIndex:
+    """LSH buckets over signatures: per band, row numbers sorted by band key.
+
+    Rows are only ever appended, so new signatures are merged into the
+    sorted arrays instead of rebuilding them, and a lookup is one binary
+    search per band.
+    """
+
+    def __init__(self, band_bits=DEFAULT_BAND_BITS):
+        self.band_bits = band_bits
+        self.keys = None
+        self.rows = None
+        self.size = 0
+
+    def extend(self, packed):
+        """Add the signatures of rows size .. size + len(packed)"""
+        keys = band_keys(np.asarray(packed), self.band_bits)
+        if self.keys is None:
+            self.keys = [np.zeros(0, dtype=np.uint64) for _ in range(keys.shape[1])]
+            self.rows = [np.zeros(0, dtype=np.int64) for _ in range(keys.shape[1])]
+        new_rows = np.arange(self.size, self.size + len(keys), dtype=np.int64)
+        for band in range(keys.shape[1]):
+            order = np.argsort(keys[:, band], kind='stable')
+            positions = np.searchsorted(self.keys[band], keys[order, band], side='right')
+            self.keys[band] = np.insert(self.keys[band], positions, keys[order, band])
+            self.rows[band] = np.insert(self.rows[band], positions, new_rows[order])
+        self.size += len(keys)
+
+    def candidates(self, packed_query):
+        """Rows sharing at least one band with the query signature"""
+        if self.keys is None:
+            return np.zeros(0, dtype=np.int64)
+        keys = band_keys(np.asarray(packed_query).reshape(1, -1), self.band_bits)[0]
+        found = []
+        for band, key in enumerate(keys):
+            lo = np.searchsorted(self.keys[band], key, side='left')
+            hi = np.searchsorted(self.keys[band], key, side='right')
+            found.append(self.rows[band][lo:hi])
+        return np.unique(np.concatenate(found))
+
+
+# MinHash sketches of word shingles, for near-duplicate detection
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16  # 8 values per band: pairs above ~0.7 Jaccard share a band
+SHINGLE_SIZE = 5
+
+# Unique shingles hashed per step while building a sketch
+MINHASH_CHUNK = 8192
+
+_MINHASH_SEEDS = _splitmix64(np.arange(MINHASH_PERMUTATIONS, dtype=np.uint64))
+
+
+def minhash(shingle_hashes):
+    """MinHash sketch (uint32 per permutation) of a set of 64-bit shingle hashes"""
+    shingles = np.unique(np.asarray(shingle_hashes, dtype=np.uint64))
+    sketch = np.full(MINHASH_PERMUTATIONS, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(shingles), MINHASH_CHUNK):
+        hashed = _splitmix64(shingles[start:start + MINHASH_CHUNK, None] ^ _MINHASH_SEEDS)
+        np.minimum(sketch, hashed.min(axis=0), out=sketch)
+    return (sketch >> np.uint64(32)).astype(np.uint32)
+
+
+def minhash_band_keys(sketch):
+    """One signed 64-bit bucket key per band; the band number is folded in"""
+    bands = np.asarray(sketch, dtype=np.uint64).reshape(MINHASH_BANDS, -1)
+    keys = np.arange(MINHASH_BANDS, dtype=np.uint64)
+    for column in bands.T:
+        keys = _splitmix64(keys ^ column)
+    return keys.view(np.int64)
+
+
+def minhash_similarity(sketch, others):
+    """Estimated Jaccard similarity of sketch with each row of others"""
+    return (np.asarray(others) == sketch).mean(axis=-1)
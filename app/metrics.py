@@ -0,0 +1,222 @@
+"""Stage timers for the detection pipeline.
+
+Every stage (PDF extraction, tokenization, similarity scoring, database
+commits, ...) records its latency, and where it has one the size of its
+input, into per-process histograms served in the Prometheus text format
+at /metrics. Analysis jobs run in worker processes; their observations
+travel back with the job result and are merged into the serving
+process' histograms.
+
+The histograms live in process memory, so with several serving
+processes (gunicorn workers) a scrape only sees the one that answers it
+unless METRICS_FOLDER is set. Every process then also writes its
+histograms to a file of its own there, at most every FLUSH_SECONDS and
+on exit, and /metrics adds up the files of every process, past ones
+included, as counters must never go back. Clear the folder when the
+server is started again.
+
+With PROFILE_ANALYSIS set, each analysis also runs under cProfile and
+the stats are written to PROFILE_FOLDER, their path stored on the
+AnalysisResult.
+"""
+import atexit
+import cProfile
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+# How stale another process' histograms may be at a scrape
+FLUSH_SECONDS = 1.0
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per stage label"""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, stage, value):
+        counts, totals = self.series.setdefault(stage, ([0] * len(self.buckets), [0.0, 0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def render(self, others=()):
+        """Exposition lines of these series plus those of other processes"""
+        series = {stage: ([*counts], [*totals]) for stage, (counts, totals) in self.series.items()}
+        for other in others:
+            for stage, (counts, totals) in other.items():
+                merged_counts, merged_totals = series.setdefault(stage, ([0] * len(self.buckets), [0.0, 0]))
+                for i, bucket_count in enumerate(counts):
+                    merged_counts[i] += bucket_count
+                merged_totals[0] += totals[0]
+                merged_totals[1] += totals[1]
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for stage in sorted(series):
+            counts, (total, count) = series[stage]
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{stage="{stage}"}} {count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('detector_stage_seconds', 'Time spent in each stage of the detection pipeline.',
+                          LATENCY_BUCKETS)
+STAGE_BYTES = Histogram('detector_stage_input_bytes', 'Size of the input of each stage of the detection pipeline.',
+                        SIZE_BUCKETS)
+
+_lock = threading.Lock()
+_local = threading.local()
+_process_file = None
+_flushed_at = 0.0
+_folder = None
+
+
+def text_bytes(text):
+    return len(text.encode('utf-8')) if text else 0
+
+
+def observe(stage, seconds, size=None):
+    """Record one run of a stage"""
+    with _lock:
+        STAGE_SECONDS.observe(stage, seconds)
+        if size is not None:
+            STAGE_BYTES.observe(stage, size)
+    if time.monotonic() - _flushed_at > FLUSH_SECONDS:
+        flush()
+    recorded = getattr(_local, 'recorded', None)
+    if recorded is not None:
+        recorded.append((stage, seconds, size))
+
+
+@contextmanager
+def timed(stage, size=None):
+    """Time the enclosed block as one run of stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, size)
+
+
+@contextmanager
+def recording():
+    """Collect the observations made by this thread inside the block"""
+    _local.recorded = []
+    try:
+        yield _local.recorded
+    finally:
+        _local.recorded = None
+
+
+def merge(observations):
+    """Add observations collected in another process"""
+    for stage, seconds, size in observations:
+        observe(stage, seconds, size)
+
+
+def metrics_folder():
+    """METRICS_FOLDER of the running app, or None"""
+    from flask import current_app, has_app_context
+
+    return current_app.config['METRICS_FOLDER'] if has_app_context() else None
+
+
+def process_file():
+    """This process' file name in METRICS_FOLDER, never reused by a later or forked process"""
+    global _process_file
+    if _process_file is None or not _process_file.startswith(f'{os.getpid()}-'):
+        _process_file = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+    return _process_file
+
+
+def flush(folder=None):
+    """Write this process' histograms to its file in METRICS_FOLDER, if set"""
+    global _flushed_at, _folder
+    folder = folder or metrics_folder()
+    # Analysis worker processes send their stages back with each job instead
+    if not folder or multiprocessing.parent_process() is not None:
+        return
+    _folder = folder
+    with _lock:
+        _flushed_at = time.monotonic()
+        payload = json.dumps({'seconds': STAGE_SECONDS.series, 'bytes': STAGE_BYTES.series})
+    os.makedirs(folder, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(payload)
+    os.replace(temporary, os.path.join(folder, process_file()))
+
+
+@atexit.register
+def _flush_at_exit():
+    if _folder:
+        flush(_folder)
+
+
+def other_processes(folder):
+    """The histograms the other processes last wrote to folder"""
+    series = []
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else ():
+        if not name.endswith('.json') or name == process_file():
+            continue
+        try:
+            with open(os.path.join(folder, name)) as f:
+                series.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Removed meanwhile
+    return series
+
+
+def render():
+    """All histograms in the Prometheus text exposition format"""
+    folder = metrics_folder()
+    others = other_processes(folder) if folder else []
+    with _lock:
+        lines = (STAGE_SECONDS.render([other['seconds'] for other in others])
+                 + STAGE_BYTES.render([other['bytes'] for other in others]))
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profiled(name):
+    """Run the block under cProfile if PROFILE_ANALYSIS is set.
+
+    Yields a dict whose 'path' is the written stats file afterwards,
+    or None when profiling is off.
+    """
+    from flask import current_app
+
+    result = {'path': None}
+    if not current_app.config['PROFILE_ANALYSIS']:
+        yield result
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield result
+    finally:
+        profile.disable()
+        folder = current_app.config['PROFILE_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        # Concurrent analyses in this or other processes get files of their own
+        path = os.path.join(folder, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                    f'{uuid.uuid4().hex[:8]}.prof')
+        profile.dump_stats(path)
+        result['path'] = path
@@ -1,29 +1,117 @@
+import hashlib
 from app import db
+from app.content_store import load_content, store_content
 from datetime import datetime
 
+PREVIEW_LENGTH = 300  # Characters of content kept in Text.preview for listings
+
 class Text(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(db.Text, nullable=False)
-    source = db.Column(db.String(20), nullable=False)  # 'human' or 'ai'
+    source = db.Column(db.String(20), nullable=False, index=True)  # 'human' or 'ai'
     topic = db.Column(db.String(100), nullable=False)
-    file_path = db.Column(db.String(255))  # Path to uploaded file
-    is_ai = db.Column(db.Boolean, default=False)  # Flag for AI-generated content
+    file_path = db.Column(db.String(255), index=True)  # Path to uploaded file, named after its SHA-256
+    is_ai = db.Column(db.Boolean, default=False, index=True)  # Flag for AI-generated content
     acm_topic = db.Column(db.String(100))  # ACM topic classification
     created_at = db.Column(db.DateTime, default=datetime.utcnow)  # Add this line
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Validates cached pages
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of content: its key in the content store
+    preview = db.Column(db.String(PREVIEW_LENGTH))  # Start of content, shown in listings
+    content_length = db.Column(db.Integer)  # Characters in content
+    minhash = db.Column(db.LargeBinary)  # MinHash sketch of the word shingles (see app.dedupe)
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('text.id'), index=True)  # Kept text this one nearly duplicates
     analysis = db.relationship('AnalysisResult', backref='text', lazy=True, uselist=False)
 
+    # Bodies can be megabytes, so they live compressed in the content store
+    # (app.content_store) and are only read when a page needs the text
+    @property
+    def content(self):
+        if '_pending_content' in self.__dict__:
+            return self.__dict__['_pending_content']
+        loaded = self.__dict__.get('_loaded_content')
+        if loaded is None or loaded[0] != self.content_hash:
+            loaded = self.__dict__['_loaded_content'] = (self.content_hash, load_content(self.content_hash))
+        return loaded[1]
+
+    @content.setter
+    def content(self, value):
+        value = value or ''
+        for name, field in content_fields(value).items():
+            setattr(self, name, field)
+        self.__dict__['_pending_content'] = value
+
+def content_fields(content):
+    """Columns derived from a text's content"""
+    content = content or ''
+    return {
+        'content_hash': hashlib.sha256(content.encode('utf-8')).hexdigest(),
+        'preview': content[:PREVIEW_LENGTH],
+        'content_length': len(content),
+    }
+
+@db.event.listens_for(Text, 'before_insert')
+@db.event.listens_for(Text, 'before_update')
+def store_pending_content(mapper, connection, text):
+    if '_pending_content' in text.__dict__:
+        content = text.__dict__.pop('_pending_content')
+        store_content(text.content_hash, content)
+        text.__dict__['_loaded_content'] = (text.content_hash, content)
+
 class AnalysisResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), nullable=False)
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), nullable=False, index=True)
     perplexity = db.Column(db.Float)
     burstiness = db.Column(db.Float)
-    ai_proportion = db.Column(db.Float)
+    ai_proportion = db.Column(db.Float, index=True)
     ai_similarity = db.Column(db.Float)  # Similarity with AI documents
     human_similarity = db.Column(db.Float)  # Similarity with human documents
-    analyzed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    overall_score = db.Column(db.Float, index=True)  # Calibrated AI probability (see app.scoring)
+    score_version = db.Column(db.String(32))  # Score model that computed it; None for the default weights
+    analyzed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    profile_path = db.Column(db.String(255))  # cProfile stats of the run, with PROFILE_ANALYSIS
+
+class AnalysisWindow(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)  # Order of the window in the text
+    start_sentence = db.Column(db.Integer, nullable=False)
+    n_sentences = db.Column(db.Integer, nullable=False)
+    perplexity = db.Column(db.Float)
+    burstiness = db.Column(db.Float)
+    ai_proportion = db.Column(db.Float)
+    ai_similarity = db.Column(db.Float)
+    human_similarity = db.Column(db.Float)
+
+class MinHashBand(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), nullable=False, index=True)
+    key = db.Column(db.BigInteger, nullable=False, index=True)  # LSH bucket of one band of the sketch
 
 class ACMTopic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    keywords = db.Column(db.Text)  # Comma-separated keywords
\ No newline at end of file
+    keywords = db.Column(db.Text)  # Comma-separated keywords
+
+class FeatureCache(db.Model):
+    content_hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the text
+    features = db.Column(db.LargeBinary, nullable=False)  # Compressed .npz payload
+    size = db.Column(db.Integer, nullable=False)  # Payload size in bytes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class CorpusStat(db.Model):
+    # Running count kept up to date by app.corpus_stats, e.g. 'texts:ai',
+    # 'source:pdf', 'acm_topic:Networks', 'analyses', 'ai_score:7'
+    key = db.Column(db.String(150), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class AnalysisJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text_id = db.Column(db.Integer, db.ForeignKey('text.id'), nullable=False, index=True)
+    file_path = db.Column(db.String(255))  # PDF still to be extracted, if any
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)  # 'pending', 'running', 'done' or 'failed'
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
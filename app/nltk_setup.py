@@ -0,0 +1,27 @@
+"""Install the NLTK data the tokenizer needs into NLTK_DATA_FOLDER.
+
+Run once when deploying (the app itself never downloads anything):
+    python -m app.nltk_setup
+"""
+import argparse
+
+from config import Config
+
+RESOURCES = ['punkt']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download the NLTK tokenizer data the app uses.')
+    parser.add_argument('--folder', default=Config.NLTK_DATA_FOLDER, help='target folder (default: NLTK_DATA_FOLDER)')
+    args = parser.parse_args()
+
+    import nltk
+
+    for resource in RESOURCES:
+        if not nltk.download(resource, download_dir=args.folder, quiet=True):
+            raise SystemExit(f'Could not download NLTK resource {resource!r} into {args.folder}')
+        print(f'{resource} installed in {args.folder}')
+
+
+if __name__ == '__main__':
+    main()
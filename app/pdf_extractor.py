@@ -1,31 +1,223 @@
-import PyPDF2
+import hashlib
+import multiprocessing
 import os
-from werkzeug.utils import secure_filename
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 
 
-def extract_text_from_pdf(file_path):
-    """Extract text content from a PDF file"""
-    text = ""
+# Defaults, overridable through PDF_WORKERS / PDF_PAGE_TIMEOUT / PDF_PARALLEL_MIN_PAGES
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_PAGE_TIMEOUT = 30  # Seconds to wait for a single page
+DEFAULT_PARALLEL_MIN_PAGES = 8  # Smaller PDFs are faster to extract in-process, without a timeout
+
+# Pages queued ahead of the one being yielded, per worker
+PAGES_IN_FLIGHT_PER_WORKER = 4
+
+# Bytes of an uploaded file copied (and hashed) at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Per worker process: the reader of the file it extracted from last
+_worker_reader = None
+
+
+def _setting(name, default):
+    from flask import current_app, has_app_context
+
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return default
+
+
+def _extract_page(file_path, page_num):
+    """Extract one page inside a pool worker, reusing the parsed reader"""
+    global _worker_reader
+    import PyPDF2
+
+    stamp = (file_path, os.path.getmtime(file_path))
+    if _worker_reader is None or _worker_reader[0] != stamp:
+        _worker_reader = (stamp, PyPDF2.PdfReader(file_path))
+    return _worker_reader[1].pages[page_num].extract_text() or ''
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool(pool):
+    """Kill a pool whose worker is stuck on a page so the next call starts fresh"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    for process in list(getattr(pool, '_processes', {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_pages(file_path, workers=None, page_timeout=None, stream=None):
+    """Yield the text of each page of a PDF, in order, as soon as it is ready.
+
+    Pages are fanned out over a process pool; a page that takes longer
+    than page_timeout seconds is yielded as empty instead of holding up
+    the rest of the document. A page parsed in-process cannot be
+    stopped, so PDFs are only extracted inline (small ones, or all of
+    them with a single worker) when page_timeout is 0. stream, an open
+    binary file of file_path, is read instead of opening the file again;
+    pool workers still open it by path.
+    """
+    # Imported here: PyPDF2 is only needed once a PDF arrives
+    import PyPDF2
+
+    workers = workers or _setting('PDF_WORKERS', DEFAULT_WORKERS)
+    if page_timeout is None:
+        page_timeout = _setting('PDF_PAGE_TIMEOUT', DEFAULT_PAGE_TIMEOUT)
+
+    reader = PyPDF2.PdfReader(stream if stream is not None else file_path)
+    num_pages = len(reader.pages)
+
+    if not page_timeout and (workers <= 1 or num_pages < _setting('PDF_PARALLEL_MIN_PAGES', DEFAULT_PARALLEL_MIN_PAGES)):
+        for page in reader.pages:
+            yield page.extract_text() or ''
+        return
+
+    pool = _get_pool(workers)
+    pending = deque()
+    next_page = 0
+    stuck = False
     try:
-        with open(file_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            num_pages = len(reader.pages)
+        while next_page < num_pages or pending:
+            # Keep a bounded window of pages queued ahead of the consumer
+            while next_page < num_pages and len(pending) < workers * PAGES_IN_FLIGHT_PER_WORKER:
+                pending.append(pool.submit(_extract_page, file_path, next_page))
+                next_page += 1
+
+            future = pending.popleft()
+            try:
+                yield future.result(timeout=page_timeout or None)
+            except TimeoutError:
+                stuck = True
+                print(f"Timed out extracting a page of {file_path}")
+                yield ''
+            except BrokenProcessPool:
+                stuck = True
+                print(f"Extraction worker died on a page of {file_path}")
+                yield ''
+            except Exception as e:
+                print(f"Error extracting a page of {file_path}: {e}")
+                yield ''
+    finally:
+        for future in pending:
+            future.cancel()
+        if stuck:
+            _discard_pool(pool)
+
 
-            for page_num in range(num_pages):
-                page = reader.pages[page_num]
-                text += page.extract_text()
+def extract_text_from_pdf(file_path, workers=None, page_timeout=None, stream=None):
+    """Extract text content from a PDF file"""
+    try:
+        return ''.join(iter_pdf_pages(file_path, workers, page_timeout, stream))
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
 
-    return text
+
+class Upload:
+    """An uploaded file stored under its content hash"""
+
+    def __init__(self, path, sha256, size, stream, existed):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.stream = stream  # The received bytes, open at the start for extraction to read
+        self.existed = existed  # The same bytes had been uploaded before
+
+
+def _store_spooled(part_path, path):
+    """Give the spooled file, still open, the name path; False if that name is already taken.
+
+    A hard link leaves the open file untouched, so unlike a rename it
+    works on Windows too. On filesystems without hard links a closed
+    copy is renamed into place instead.
+    """
+    try:
+        os.link(part_path, path)
+        return True
+    except FileExistsError:
+        return False
+    except OSError:
+        pass
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False) as copy:
+        with open(part_path, 'rb') as part:
+            shutil.copyfileobj(part, copy, UPLOAD_CHUNK_SIZE)
+    try:
+        os.replace(copy.name, path)
+        return True
+    except OSError:
+        os.unlink(copy.name)
+        # On Windows, the same bytes stored and opened meanwhile by another request
+        if not os.path.exists(path):
+            raise
+        return False
+
+
+@contextmanager
+def receive_upload(file, upload_folder):
+    """Store an uploaded file as <sha256><extension> in upload_folder, yielding an Upload.
+
+    The request body is spooled to a temporary file UPLOAD_CHUNK_SIZE
+    bytes at a time and hashed on the way. That file is stored under its
+    hash (unless the name already exists) and, rewound, is the Upload's
+    stream, so the bytes are read from the request once and never read
+    back from the stored file. Two users uploading files with the same
+    name no longer overwrite each other, and a repeat upload is
+    recognised before any parsing. The stream stays open until the
+    block ends.
+    """
+    os.makedirs(upload_folder, exist_ok=True)
+    extension = os.path.splitext(file.filename or '')[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+    buffer = tempfile.NamedTemporaryFile(dir=upload_folder, suffix='.part', delete=False)
+    try:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+            size += len(chunk)
+        buffer.flush()
+
+        path = os.path.join(upload_folder, digest.hexdigest() + extension)
+        existed = os.path.exists(path) or not _store_spooled(buffer.name, path)
+        buffer.seek(0)
+        yield Upload(path, digest.hexdigest(), size, buffer, existed)
+    finally:
+        # Closed before it is deleted, which Windows requires; the stored
+        # name, if any, is a link of its own
+        buffer.close()
+        os.unlink(buffer.name)
 
 
 def save_uploaded_file(file, upload_folder):
-    """Save uploaded file to the specified folder"""
+    """Save uploaded file to the specified folder under its content hash; returns its path"""
     if file:
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(upload_folder, filename)
-        file.save(file_path)
-        return file_path
-    return None
\ No newline at end of file
+        with receive_upload(file, upload_folder) as upload:
+            return upload.path
+    return None
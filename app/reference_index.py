@@ -0,0 +1,700 @@
+import json
+import math
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from app.lsh import (DEFAULT_BAND_BITS, SIGNATURE_BITS, SIGNATURE_BYTES, BandIndex, hamming_distances,
+                     signatures)
+from app.tokenization import TokenizedDocument, iter_sentence_documents, tokenize_document
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+
+# Append-only files holding the index (see ReferenceIndex)
+ARRAY_FILES = {
+    'doc_ids': ('doc_ids.bin', np.int64),
+    'labels': ('labels.bin', np.uint8),
+    'indptr': ('indptr.bin', np.int64),
+    'indices': ('indices.bin', np.int32),
+    'data': ('data.bin', np.float32),
+}
+
+# Default working-set ceiling for one scored block of reference rows
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Rough cost of one stored non-zero while its block is scored: the mapped
+# count and column index plus the float64 temporaries derived from them
+BYTES_PER_NONZERO = 32
+
+# Signing a row costs a float32 coefficient and a projected value per bit for
+# each of its terms
+BYTES_PER_SIGNED_NONZERO = 8 * SIGNATURE_BITS
+
+# Documents per label pulled in by signature distance when the LSH buckets
+# hold fewer than k of them, as a multiple of k
+HAMMING_OVERSAMPLE = 5
+
+
+def iter_row_blocks(indptr, memory_limit, max_rows=None):
+    """Yield (start, stop) row ranges of a CSR matrix that fit in memory_limit"""
+    n_rows = len(indptr) - 1
+    budget = max(1, memory_limit // BYTES_PER_NONZERO)
+    max_rows = max_rows or n_rows
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + budget, side='right')) - 1
+        stop = min(max(stop, start + 1), start + max_rows, n_rows)
+        yield start, stop
+        start = stop
+
+
+def sparse_cosine_similarities(query, matrix, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Cosine similarity of an L2-normalised row with L2-normalised CSR rows.
+
+    The rows are scored block by block so the temporaries never exceed
+    memory_limit, and nothing is ever converted to a dense matrix.
+    """
+    query = csr_matrix(query)
+    similarities = np.zeros(matrix.shape[0])
+    for start, stop in iter_row_blocks(matrix.indptr, memory_limit):
+        similarities[start:stop] = (matrix[start:stop] @ query.T).toarray().ravel()
+    return similarities
+
+
+class ReferenceIndex:
+    """Persistent TF-IDF index over the stored reference documents.
+
+    Each document is stored once as a row of raw term counts in a CSR
+    matrix whose arrays live in append-only binary files, so adding a
+    document only appends its own row. Document frequencies are kept
+    next to the vocabulary and IDF weights are derived from them at
+    query time, which means existing rows never need to be rewritten
+    when the corpus grows.
+
+    The arrays are memory-mapped and scored in row blocks bounded by
+    memory_limit, so the reference set is streamed from disk rather
+    than held in memory.
+
+    Every row also gets a SimHash signature (signatures.bin) so the
+    nearest documents to a query can be found through LSH buckets and
+    re-scored exactly, without touching the rest of the corpus.
+    """
+
+    def __init__(self, folder, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.folder = folder
+        self.memory_limit = memory_limit
+        self._lock = threading.RLock()
+        self._version = None
+        self._norms_version = None
+        self._norms = None
+        self._signatures = None
+        self._band_indexes = {}
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'version': 0, 'n_docs': 0, 'nnz': 0, 'n_terms': 0, 'vocab_bytes': 0}
+
+    def _load(self):
+        """(Re)load the on-disk index, trusting only what meta.json covers"""
+        meta = self._read_meta()
+        sizes = {
+            'doc_ids': meta['n_docs'],
+            'labels': meta['n_docs'],
+            'indptr': meta['n_docs'] + 1,
+            'indices': meta['nnz'],
+            'data': meta['nnz'],
+        }
+        for key, (filename, dtype) in ARRAY_FILES.items():
+            path = self._path(filename)
+            count = sizes[key]
+            if count and os.path.exists(path):
+                array = np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+            else:
+                array = np.zeros(count, dtype=dtype)
+            setattr(self, key, array)
+        if meta['n_docs'] == 0:
+            self.indptr = np.zeros(1, dtype=np.int64)
+
+        self.terms = []
+        if meta['n_terms'] and os.path.exists(self._path('vocab.txt')):
+            with open(self._path('vocab.txt'), 'rb') as f:
+                vocab = f.read(meta['vocab_bytes']).decode('utf-8')
+            self.terms = vocab.split('\n')[:meta['n_terms']]
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+
+        if meta['n_terms'] and os.path.exists(self._path('df.npy')):
+            self.df = np.load(self._path('df.npy'))[:meta['n_terms']]
+        else:
+            self.df = np.zeros(meta['n_terms'], dtype=np.int64)
+
+        # Signatures are derived data and may lag behind the rows (e.g. an
+        # index built before they existed); missing ones are computed on use
+        path = self._path('signatures.bin')
+        n_signed = min(meta['n_docs'], os.path.getsize(path) // SIGNATURE_BYTES if os.path.exists(path) else 0)
+        if n_signed:
+            self.stored_signatures = np.memmap(path, dtype=np.uint8, mode='r', shape=(n_signed, SIGNATURE_BYTES))
+        else:
+            self.stored_signatures = np.zeros((0, SIGNATURE_BYTES), dtype=np.uint8)
+        if self._signatures is not None and len(self._signatures) > meta['n_docs']:
+            # The index was cleared and rebuilt
+            self._signatures = None
+            self._band_indexes = {}
+
+        self._version = meta['version']
+        self._vocab_bytes = meta['vocab_bytes']
+
+    def refresh(self):
+        """Pick up documents appended by other processes"""
+        with self._lock:
+            if self._read_meta()['version'] != self._version:
+                self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path('.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def n_docs(self):
+        return len(self.doc_ids)
+
+    @property
+    def last_doc_id(self):
+        return int(self.doc_ids[-1]) if self.n_docs else 0
+
+    def idf(self, n_terms=None):
+        """Smoothed IDF, identical to TfidfVectorizer(smooth_idf=True)"""
+        df = self.df if n_terms is None else self.df[:n_terms]
+        return np.log((1.0 + self.n_docs) / (1.0 + df)) + 1.0
+
+    def add_documents(self, documents):
+        """Append (doc_id, is_ai, text) tuples to the index.
+
+        text may be a raw string or an already tokenized document.
+        """
+        with self._write_lock():
+            # Another process may have appended since we last looked
+            self._load()
+            known = set(self.doc_ids.tolist())
+
+            rows = []
+            new_terms = []
+            for doc_id, is_ai, text in documents:
+                if doc_id in known:
+                    continue
+                known.add(doc_id)
+                counts = tokenize_document(text).term_counts
+                term_ids = []
+                for term in counts:
+                    term_id = self.vocabulary.get(term)
+                    if term_id is None:
+                        term_id = len(self.terms)
+                        self.vocabulary[term] = term_id
+                        self.terms.append(term)
+                        new_terms.append(term)
+                    term_ids.append(term_id)
+                order = np.argsort(term_ids)
+                rows.append((
+                    doc_id,
+                    bool(is_ai),
+                    np.asarray(term_ids, dtype=np.int32)[order],
+                    np.fromiter(counts.values(), dtype=np.float32, count=len(counts))[order],
+                ))
+
+            if not rows:
+                return 0
+
+            df = np.zeros(len(self.terms), dtype=np.int64)
+            df[:len(self.df)] = self.df
+            nnz = len(self.indices)
+            indptr = []
+            for _, _, term_ids, _ in rows:
+                df[term_ids] += 1
+                nnz += len(term_ids)
+                indptr.append(nnz)
+
+            # Drop bytes left behind by an interrupted write before appending
+            self._append('doc_ids', np.array([r[0] for r in rows], dtype=np.int64), self.n_docs)
+            self._append('labels', np.array([r[1] for r in rows], dtype=np.uint8), self.n_docs)
+            self._append('indptr', np.array(([0] if self.n_docs == 0 else []) + indptr, dtype=np.int64),
+                         self.n_docs + 1 if self.n_docs else 0)
+            self._append('indices', np.concatenate([r[2] for r in rows]), len(self.indices))
+            self._append('data', np.concatenate([r[3] for r in rows]), len(self.data))
+
+            vocab_chunk = ''.join(term + '\n' for term in new_terms).encode('utf-8')
+            with open(self._path('vocab.txt'), 'ab') as f:
+                f.truncate(self._vocab_bytes)
+                f.write(vocab_chunk)
+
+            tmp_path = self._path('df.tmp.npy')
+            np.save(tmp_path, df)
+            os.replace(tmp_path, self._path('df.npy'))
+
+            self._write_meta({
+                'version': self._version + 1,
+                'n_docs': self.n_docs + len(rows),
+                'nnz': nnz,
+                'n_terms': len(self.terms),
+                'vocab_bytes': self._vocab_bytes + len(vocab_chunk),
+            })
+
+            self._load()
+            self._store_signatures()
+            return len(rows)
+
+    def clear(self):
+        """Drop every document; the version keeps increasing so cached results expire"""
+        with self._write_lock():
+            self._load()
+            filenames = [filename for filename, _ in ARRAY_FILES.values()]
+            for filename in filenames + ['vocab.txt', 'df.npy', 'signatures.bin']:
+                if os.path.exists(self._path(filename)):
+                    os.remove(self._path(filename))
+            self._write_meta({'version': self._version + 1, 'n_docs': 0, 'nnz': 0, 'n_terms': 0, 'vocab_bytes': 0})
+            self._load()
+
+    def _write_meta(self, meta):
+        tmp_path = self._path('meta.tmp.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def _append(self, key, values, expected_length):
+        filename, dtype = ARRAY_FILES[key]
+        path = self._path(filename)
+        with open(path, 'ab') as f:
+            f.truncate(expected_length * np.dtype(dtype).itemsize)
+            values.astype(dtype).tofile(f)
+
+    def _store_signatures(self):
+        """Sign the rows not in signatures.bin yet and append them"""
+        n_signed = len(self.stored_signatures)
+        with open(self._path('signatures.bin'), 'ab') as f:
+            f.truncate(n_signed * SIGNATURE_BYTES)
+            self._sign_rows(n_signed, self.n_docs).tofile(f)
+        self._load()
+
+    def _sign_rows(self, start, stop):
+        """SimHash signatures of rows start:stop, weighted by TF-IDF like the scored rows"""
+        packed = np.zeros((stop - start, SIGNATURE_BYTES), dtype=np.uint8)
+        idf = self.idf()
+        memory_limit = self.memory_limit * BYTES_PER_NONZERO // BYTES_PER_SIGNED_NONZERO
+        for lo, hi in iter_row_blocks(self.indptr[start:stop + 1], memory_limit):
+            block = self._block(start + lo, start + hi)
+            block.data = block.data * idf[block.indices]
+            packed[lo:hi] = signatures(block)
+        return packed
+
+    def _document_signatures(self):
+        """Signatures of every row, computing any missing from signatures.bin"""
+        if self._signatures is None or len(self._signatures) < self.n_docs:
+            known = self._signatures if self._signatures is not None else self.stored_signatures
+            known = np.asarray(known[:self.n_docs])
+            self._signatures = np.concatenate([known, self._sign_rows(len(known), self.n_docs)])
+        return self._signatures
+
+    def _band_index(self, band_bits):
+        """LSH buckets over the signatures, extended as rows are appended"""
+        document_signatures = self._document_signatures()
+        bands = self._band_indexes.get(band_bits)
+        if bands is None:
+            bands = self._band_indexes[band_bits] = BandIndex(band_bits)
+        if bands.size < len(document_signatures):
+            bands.extend(document_signatures[bands.size:])
+        return bands
+
+    def _block(self, start, stop):
+        """Raw term-count rows start:stop as a CSR matrix over the mapped arrays"""
+        lo, hi = int(self.indptr[start]), int(self.indptr[stop])
+        return csr_matrix((self.data[lo:hi], self.indices[lo:hi], self.indptr[start:stop + 1] - lo),
+                          shape=(stop - start, len(self.terms)))
+
+    def _subset_indptr(self, rows):
+        """indptr of the CSR matrix made of rows, for splitting it into blocks"""
+        return np.concatenate([[0], np.cumsum(self.indptr[rows + 1] - self.indptr[rows])])
+
+    def _rows(self, rows):
+        """Raw term-count rows at arbitrary (sorted) positions as a CSR matrix"""
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = self._subset_indptr(rows)
+        positions = np.arange(indptr[-1]) + np.repeat(starts - indptr[:-1], lengths)
+        return csr_matrix((self.data[positions], self.indices[positions], indptr),
+                          shape=(len(rows), len(self.terms)))
+
+    def positions(self, doc_ids):
+        """Row of each doc id in the index, or -1 for ids (or None) it does not hold"""
+        doc_ids = np.asarray([-1 if doc_id is None else doc_id for doc_id in doc_ids], dtype=np.int64)
+        if not self.n_docs:
+            return np.full(len(doc_ids), -1, dtype=np.int64)
+        # Texts are indexed in id order, so doc_ids is sorted
+        rows = np.minimum(np.searchsorted(self.doc_ids, doc_ids), self.n_docs - 1)
+        return np.where(np.asarray(self.doc_ids[rows]) == doc_ids, rows, -1)
+
+    def _reference_rows(self, reference_ids):
+        """Sorted rows of the indexed documents among reference_ids, or None for every row"""
+        if reference_ids is None:
+            return None
+        rows = self.positions(reference_ids)
+        return np.unique(rows[rows >= 0])
+
+    def _document_norms(self):
+        """L2 norms of the TF-IDF rows for the current index version"""
+        if self._norms_version != self._version:
+            idf = self.idf()
+            norms = np.empty(self.n_docs)
+            for start, stop in iter_row_blocks(self.indptr, self.memory_limit):
+                lo, hi = int(self.indptr[start]), int(self.indptr[stop])
+                weights = self.data[lo:hi] * idf[self.indices[lo:hi]]
+                rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+                norms[start:stop] = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=stop - start))
+            norms[norms == 0] = 1.0
+            self._norms = norms
+            self._norms_version = self._version
+        return self._norms
+
+    def vectorize(self, text):
+        """L2-normalised TF-IDF row vector for text against the index vocabulary"""
+        counts = tokenize_document(text).term_counts
+        idf = self.idf()
+        unseen_idf = math.log(1.0 + self.n_docs) + 1.0
+
+        term_ids = []
+        values = []
+        norm = 0.0
+        for term, count in counts.items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                # Out-of-vocabulary terms cannot match anything but still
+                # count towards the length of the query vector
+                norm += (count * unseen_idf) ** 2
+                continue
+            weight = count * idf[term_id]
+            norm += weight ** 2
+            term_ids.append(term_id)
+            values.append(weight)
+
+        norm = math.sqrt(norm) or 1.0
+        return csr_matrix((np.asarray(values) / norm, (np.zeros(len(term_ids), dtype=np.int32), term_ids)),
+                          shape=(1, len(self.terms)))
+
+    def _query_signatures(self, texts):
+        """Signatures of texts, weighted like the indexed rows; unknown terms are left out"""
+        idf = self.idf()
+        term_ids = []
+        weights = []
+        indptr = [0]
+        for text in texts:
+            for term, count in tokenize_document(text).term_counts.items():
+                term_id = self.vocabulary.get(term)
+                if term_id is not None:
+                    term_ids.append(term_id)
+                    weights.append(count * idf[term_id])
+            indptr.append(len(term_ids))
+        rows = csr_matrix((np.asarray(weights, dtype=np.float32), np.asarray(term_ids, dtype=np.int32), indptr),
+                          shape=(len(texts), len(self.terms)))
+        return signatures(rows)
+
+    def _probe(self, texts):
+        """Query rows for texts with the document IDF folded in.
+
+        Keeping the stored rows as raw counts and dividing the scores by
+        the row norms afterwards makes every block of documents a single
+        sparse product with this matrix.
+        """
+        return vstack([self.vectorize(text) for text in texts]).multiply(self.idf()).tocsr()
+
+    def _stored_vectors(self, rows):
+        """L2-normalised TF-IDF vectors of the stored rows, as vectorize() gives for their text"""
+        vectors = self._rows(rows).multiply(self.idf()).multiply(1.0 / self._document_norms()[rows][:, None])
+        return vectors.tocsr()
+
+    def _stored_probe(self, rows):
+        """_probe of indexed documents, built from their stored rows instead of their text"""
+        return self._stored_vectors(rows).multiply(self.idf()).tocsr()
+
+    def tfidf_vectors(self, doc_ids):
+        """vectorize() of indexed documents, read from their stored rows"""
+        with self._lock:
+            rows = self.positions(doc_ids)
+            if (rows < 0).any():
+                raise KeyError(f'Not in the reference index: {np.asarray(doc_ids)[rows < 0].tolist()}')
+            return self._stored_vectors(rows)
+
+    def centroids(self, doc_ids, groups, n_groups):
+        """L2-normalised sum of the TF-IDF vectors of the indexed doc_ids in each group.
+
+        groups holds the group (0 to n_groups - 1) of each doc id; ids the
+        index does not hold are left out. The rows are read block by block.
+        """
+        with self._lock:
+            rows = self.positions(doc_ids)
+            groups = np.asarray(groups, dtype=np.int64)[rows >= 0]
+            rows = rows[rows >= 0]
+            sums = csr_matrix((n_groups, len(self.terms)))
+            for start, stop in iter_row_blocks(self._subset_indptr(rows), self.memory_limit):
+                membership = csr_matrix((np.ones(stop - start), (groups[start:stop], np.arange(stop - start))),
+                                        shape=(n_groups, stop - start))
+                sums = sums + membership @ self._stored_vectors(rows[start:stop])
+            norms = np.sqrt(np.asarray(sums.multiply(sums).sum(axis=1)).ravel())
+            norms[norms == 0] = 1.0
+            return sums.multiply(1.0 / norms[:, None]).tocsr()
+
+    def _scored_blocks(self, probe, reference_rows=None):
+        """Yield (rows, cosine scores) for consecutive blocks of documents.
+
+        With reference_rows (sorted) only those rows are scored.
+        """
+        norms = self._document_norms()
+        # The dense score block holds one float per (document, query) pair
+        max_rows = max(1, self.memory_limit // (8 * probe.shape[0]))
+        if reference_rows is None:
+            for start, stop in iter_row_blocks(self.indptr, self.memory_limit, max_rows):
+                scores = (self._block(start, stop) @ probe.T).toarray()
+                yield np.arange(start, stop), scores / norms[start:stop, None]
+            return
+        for start, stop in iter_row_blocks(self._subset_indptr(reference_rows), self.memory_limit, max_rows):
+            rows = reference_rows[start:stop]
+            scores = (self._rows(rows) @ probe.T).toarray()
+            yield rows, scores / norms[rows, None]
+
+    def mean_similarities_batch(self, texts, exclude_ids=None, reference_ids=None):
+        """(AI, human) mean cosine similarity of each text, in one pass over the index.
+
+        exclude_ids, one per text, names an indexed document (the text
+        itself, when it is stored) to leave out of that text's means.
+        reference_ids restricts the references to those documents.
+        """
+        with self._lock:
+            if not self.n_docs or not len(texts):
+                return [(0.0, 0.0)] * len(texts)
+            exclude = self.positions(exclude_ids if exclude_ids is not None else [None] * len(texts))
+            return self._mean_similarities(self._probe(texts), exclude, self._reference_rows(reference_ids))
+
+    def _mean_similarities(self, probe, exclude, reference_rows=None):
+        labels = np.asarray(self.labels, dtype=bool)
+        n_queries = probe.shape[0]
+        ai_sums = np.zeros(n_queries)
+        human_sums = np.zeros(n_queries)
+        excluded = np.flatnonzero(exclude >= 0)
+        for rows, scores in self._scored_blocks(probe, reference_rows):
+            at = np.searchsorted(rows, exclude[excluded])
+            inside = at < len(rows)
+            inside[inside] = rows[at[inside]] == exclude[excluded[inside]]
+            scores[at[inside], excluded[inside]] = 0.0
+            block_labels = labels[rows]
+            ai_sums += scores[block_labels].sum(axis=0)
+            human_sums += scores[~block_labels].sum(axis=0)
+
+        reference_labels = labels if reference_rows is None else labels[reference_rows]
+        n_ai = np.full(n_queries, int(reference_labels.sum()))
+        n_human = np.full(n_queries, len(reference_labels)) - n_ai
+        if reference_rows is not None:
+            excluded = excluded[np.isin(exclude[excluded], reference_rows)]
+        n_ai[excluded] -= labels[exclude[excluded]]
+        n_human[excluded] -= ~labels[exclude[excluded]]
+        ai_means = np.divide(ai_sums, n_ai, out=np.zeros(n_queries), where=n_ai > 0)
+        human_means = np.divide(human_sums, n_human, out=np.zeros(n_queries), where=n_human > 0)
+        return [(float(ai), float(human)) for ai, human in zip(ai_means, human_means)]
+
+    def nearest_documents(self, texts, k, band_bits=DEFAULT_BAND_BITS, exclude_ids=None, reference_ids=None):
+        """The k nearest AI and human documents of each text, as ((ids, scores), (ids, scores)).
+
+        Candidates come from the LSH buckets the query's signature falls
+        into and are scored exactly; only when the buckets hold fewer
+        than k documents of a label are that label's signatures ranked
+        by Hamming distance to make up the difference. exclude_ids and
+        reference_ids are as for mean_similarities_batch.
+        """
+        with self._lock:
+            if not self.n_docs or not len(texts):
+                empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+                return [(empty, empty)] * len(texts)
+            exclude = self.positions(exclude_ids if exclude_ids is not None else [None] * len(texts))
+            return self._nearest_documents(self._probe(texts), self._query_signatures(texts), k, band_bits,
+                                           exclude, self._reference_rows(reference_ids))
+
+    def _nearest_documents(self, probe, query_signatures, k, band_bits, exclude, reference_rows=None):
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        labels = np.asarray(self.labels, dtype=bool)
+        allowed = np.ones(self.n_docs, dtype=bool)
+        if reference_rows is not None:
+            allowed[:] = False
+            allowed[reference_rows] = True
+        label_rows = (np.flatnonzero(labels & allowed), np.flatnonzero(~labels & allowed))
+        document_signatures = self._document_signatures()
+        bands = self._band_index(band_bits)
+        norms = self._document_norms()
+
+        results = []
+        for i in range(probe.shape[0]):
+            candidates = bands.candidates(query_signatures[i])
+            candidates = candidates[(candidates != exclude[i]) & allowed[candidates]]
+            nearest = []
+            for is_ai, rows in zip((True, False), label_rows):
+                found = candidates[labels[candidates] == is_ai]
+                n_others = len(rows) - (exclude[i] >= 0 and allowed[exclude[i]] and labels[exclude[i]] == is_ai)
+                if len(found) < min(k, n_others):
+                    n_closest = min(len(rows), k * HAMMING_OVERSAMPLE + 1)
+                    distances = hamming_distances(document_signatures[rows], query_signatures[i])
+                    found = np.union1d(found, rows[np.argpartition(distances, n_closest - 1)[:n_closest]])
+                    found = found[found != exclude[i]]
+                if not len(found):
+                    nearest.append(empty)
+                    continue
+                scores = (self._rows(found) @ probe[i].T).toarray().ravel() / norms[found]
+                top = np.argsort(-scores, kind='stable')[:k]
+                nearest.append((np.asarray(self.doc_ids[found[top]]), scores[top]))
+            results.append(tuple(nearest))
+        return results
+
+    def nearest_similarities_batch(self, texts, k, band_bits=DEFAULT_BAND_BITS, exclude_ids=None,
+                                   reference_ids=None):
+        """(AI, human) mean cosine similarity of each text with its k nearest documents per label"""
+        return [_nearest_means(nearest)
+                for nearest in self.nearest_documents(texts, k, band_bits, exclude_ids, reference_ids)]
+
+    def stored_similarities_batch(self, doc_ids, k=None, band_bits=DEFAULT_BAND_BITS, reference_ids=None):
+        """(AI, human) similarity of indexed documents with every other indexed document.
+
+        The queries are the documents' own stored rows and signatures, so
+        nothing is tokenized or vectorized; with k the means are over the
+        k nearest documents per label, as in nearest_similarities_batch.
+        reference_ids restricts the other documents to those.
+        """
+        with self._lock:
+            rows = self.positions(doc_ids)
+            if (rows < 0).any():
+                raise KeyError(f'Not in the reference index: {np.asarray(doc_ids)[rows < 0].tolist()}')
+            if not len(rows):
+                return []
+            probe = self._stored_probe(rows)
+            reference_rows = self._reference_rows(reference_ids)
+            if k is None:
+                return self._mean_similarities(probe, rows, reference_rows)
+            query_signatures = self._document_signatures()[rows]
+            return [_nearest_means(nearest)
+                    for nearest in self._nearest_documents(probe, query_signatures, k, band_bits, rows,
+                                                           reference_rows)]
+
+
+def _nearest_means(nearest):
+    return tuple(float(scores.mean()) if len(scores) else 0.0 for _, scores in nearest)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_reference_index():
+    """Return the process-wide reference index for the current app"""
+    global _index
+    from flask import current_app
+
+    folder = current_app.config['INDEX_FOLDER']
+    with _index_lock:
+        if _index is None or _index.folder != folder:
+            _index = ReferenceIndex(folder, current_app.config['SIMILARITY_MEMORY_LIMIT'])
+    _index.refresh()
+    return _index
+
+
+def streamed_document(content_hash, matcher=None):
+    """(term counts as a document, keyword hits) of a long stored text, tokenized part by part"""
+    from flask import current_app
+    from app.content_store import load_content
+
+    term_counts = Counter()
+    hits = Counter()
+    for part in iter_sentence_documents(load_content(content_hash), current_app.config['ANALYSIS_WINDOW_SENTENCES']):
+        term_counts.update(part.term_counts)
+        if matcher is not None:
+            hits.update(matcher.hits(part))
+    return TokenizedDocument.from_parts(None, [], [], [], term_counts), hits
+
+
+def update_reference_index(batch_size=500):
+    """Index every Text row added since the index was last updated"""
+    from flask import current_app
+    from app import db
+    from app.feature_cache import document_features
+    from app.jobs import ACTIVE_STATUSES
+    from app.models import AnalysisJob, Text
+    from app.topics import keyword_matcher, tag_texts
+
+    index = get_reference_index()
+    matcher = keyword_matcher()
+    last_id = index.last_doc_id
+    streaming_min_chars = current_app.config['ANALYSIS_STREAMING_MIN_CHARS']
+
+    # Uploaded PDFs get their text from a queued job; stop short of the first
+    # one still waiting so it is indexed once its content is filled in
+    waiting_id = (db.session.query(db.func.min(AnalysisJob.text_id))
+                  .filter(AnalysisJob.status.in_(ACTIVE_STATUSES), AnalysisJob.file_path.isnot(None))
+                  .scalar())
+
+    added = 0
+    while True:
+        query = (db.session.query(Text.id, Text.is_ai, Text.content_hash, Text.content_length, Text.acm_topic)
+                 .filter(Text.id > last_id, Text.duplicate_of.is_(None), Text.content_length > 0))
+        if waiting_id is not None:
+            query = query.filter(Text.id < waiting_id)
+        rows = query.order_by(Text.id).limit(batch_size).all()
+        if not rows:
+            return added
+        # Each text is tokenized here once and its features kept for later
+        # analyses; texts whose extraction failed stay empty and are left out above.
+        # Texts without an ACM topic are tagged once their rows are in. Long
+        # texts are never tokenized whole, as in their analysis, and so
+        # have no persisted features
+        hits = {}
+
+        def documents():
+            for row in rows:
+                untagged = row.acm_topic is None
+                if row.content_length > streaming_min_chars:
+                    document, text_hits = streamed_document(row.content_hash, matcher if untagged else None)
+                else:
+                    document = document_features(row.content_hash)[0]
+                    text_hits = matcher.hits(document) if untagged else None
+                if untagged:
+                    hits[row.id] = text_hits
+                yield row.id, row.is_ai, document
+
+        added += index.add_documents(documents())
+        tag_texts(index, hits)
+        last_id = rows[-1].id
+
+
+def rebuild_reference_index():
+    """Re-index every stored text from scratch, e.g. after texts were flagged as duplicates"""
+    get_reference_index().clear()
+    return update_reference_index()
@@ -0,0 +1,95 @@
+"""Re-score stored texts against the rest of the reference corpus.
+
+Every text is scored from what indexing already stored: its similarities
+from its own row of the reference index, a batch of texts at a time and
+each left out of its own references, and its perplexity and burstiness
+from its persisted document features. Nothing is tokenized or
+vectorized again, so re-scoring after the references or the language
+model change is fast. As in stored_text_analysis, a text with an ACM
+topic is compared only with texts of its topic.
+
+Window scores are left as they are unless --windows is given: every
+window has to be vectorized to be scored, which is most of the work.
+
+Usage:
+    python -m app.rescore              # texts that already have an analysis
+    python -m app.rescore --all        # every stored text
+    python -m app.rescore --windows    # window scores too
+"""
+import argparse
+import time
+
+from app import app, db
+from app.feature_cache import document_features
+from app.jobs import save_analysis_result
+from app.language_model import get_language_model
+from app.models import AnalysisResult, Text
+from app.reference_index import get_reference_index, update_reference_index
+from app.text_analyzer import (analyze_text, combine_metrics, reference_similarities, score_document,
+                               stored_reference_similarities)
+from app.topics import same_topic_references
+
+
+def rescore_corpus(all_texts=False, windows=False, batch_size=200):
+    """Re-analyse stored texts, committing a batch at a time; returns counts"""
+    update_reference_index()
+    index = get_reference_index()
+    model = get_language_model()
+
+    query = db.session.query(Text.id, Text.content_hash, Text.acm_topic).filter(Text.content_length > 0)
+    if not all_texts:
+        query = query.filter(Text.id.in_(db.session.query(AnalysisResult.text_id)))
+
+    stats = {'texts': 0, 'from_index': 0}
+    references = {}
+    last_id = 0
+    while True:
+        rows = query.filter(Text.id > last_id).order_by(Text.id).limit(batch_size).all()
+        if not rows:
+            return stats
+        last_id = rows[-1].id
+
+        by_topic = {}
+        for row, position in zip(rows, index.positions([row.id for row in rows])):
+            if row.acm_topic not in references:
+                references[row.acm_topic] = same_topic_references(row.acm_topic)
+            if position >= 0:
+                by_topic.setdefault(row.acm_topic, []).append(row.id)
+        similarities = {}
+        for topic, ids in by_topic.items():
+            similarities.update(zip(ids, stored_reference_similarities(index, ids, references[topic])))
+        for row in rows:
+            document, _ = document_features(row.content_hash)
+            reference_ids = references[row.acm_topic]
+            if windows:
+                results, text_windows = score_document(document, index, model, row.id, reference_ids)
+            else:
+                if row.id not in similarities:
+                    # Flagged near-duplicates are kept out of the index
+                    similarities[row.id] = reference_similarities(index, [document], None, reference_ids)[0]
+                perplexity, burstiness, ai_proportion = analyze_text(document, model)
+                results = combine_metrics(perplexity, burstiness, ai_proportion, *similarities[row.id])
+                text_windows = None
+            save_analysis_result(row.id, results, text_windows)
+        db.session.commit()
+        stats['texts'] += len(rows)
+        stats['from_index'] += sum(len(ids) for ids in by_topic.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-score stored texts against the rest of the reference corpus.')
+    parser.add_argument('--all', dest='all_texts', action='store_true',
+                        help='score every stored text, not only those analysed before')
+    parser.add_argument('--windows', action='store_true', help='re-score the per-window metrics too')
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    with app.app_context():
+        start = time.perf_counter()
+        stats = rescore_corpus(args.all_texts, args.windows, args.batch_size)
+        print(f"Re-scored {stats['texts']} texts ({stats['from_index']} from their index rows) "
+              f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
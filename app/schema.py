@@ -0,0 +1,88 @@
+from sqlalchemy import inspect, text
+
+from app import db
+
+
+def add_missing_columns():
+    """ALTER existing tables to add columns that were added to the models"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def create_missing_indexes():
+    """Create model indexes that an older database does not have yet"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def migrate_content_to_store(batch_size=200):
+    """Move bodies stored inline in text.content into the content store.
+
+    Fills in the hash, preview and length of each row as it goes, then
+    drops the column and vacuums so the file actually shrinks. Returns
+    the number of rows moved.
+    """
+    from app.content_store import store_content
+    from app.models import Text, content_fields
+
+    if 'content' not in {column['name'] for column in inspect(db.engine).get_columns('text')}:
+        return 0
+
+    moved = last_id = 0
+    while True:
+        rows = db.session.execute(text('SELECT id, content FROM text WHERE id > :last_id ORDER BY id LIMIT :limit'),
+                                  {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            break
+        updates = []
+        for text_id, content in rows:
+            fields = content_fields(content)
+            store_content(fields['content_hash'], content or '')
+            updates.append(dict(fields, id=text_id))
+        db.session.execute(db.update(Text), updates)
+        db.session.commit()
+        moved += len(rows)
+        last_id = rows[-1][0]
+
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE text DROP COLUMN content'))
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM'))
+        if db.engine.dialect.name == 'sqlite':
+            # In WAL mode the vacuumed pages only reach the file at a checkpoint
+            connection.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+    return moved
+
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models"""
+    from app.corpus_stats import rebuild_corpus_stats
+    from app.models import CorpusStat
+
+    db.create_all()
+    added = add_missing_columns()
+    create_missing_indexes()
+    migrate_content_to_store()
+    if 'analysis_result.overall_score' in added:
+        # Score the existing analyses, then recount the score histogram from the stored scores
+        from app.scoring import rerank_analyses
+        rerank_analyses()
+        rebuild_corpus_stats()
+    elif CorpusStat.query.first() is None:
+        # Counters start from whatever an older database already holds
+        rebuild_corpus_stats()
+    return added
@@ -0,0 +1,278 @@
+"""Calibrated overall AI score.
+
+The overall score of an analysis is the probability, under a logistic
+regression, that a text with its metrics is AI-generated. The model is
+fitted on the labelled corpus: the uploaded, generated and ingested
+texts, whose Text.is_ai is known, as opposed to texts submitted to
+/detect. Perplexity enters on a log scale, and every input is
+standardised with constants saved alongside the coefficients.
+
+Each trained model is a small versioned JSON file under
+SCORE_MODEL_FOLDER, made current by rewriting the 'current' pointer as
+the language model is. Until one is trained, the score is the weighted
+sum the result pages have always shown.
+
+AnalysisResult keeps the score and the version that computed it, so
+re-ranking after retraining reads the metrics of every analysis and
+scores them in NumPy batches; nothing is analysed again.
+
+Usage:
+    python -m app.scoring train [--rescore]   # fit on the labelled texts, then re-rank
+    python -m app.scoring rerank              # re-score every analysis with the current model
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+FEATURES = ('perplexity', 'burstiness', 'ai_proportion', 'ai_similarity', 'human_similarity')
+
+# Perplexity of a text too short to have any n-gram is infinite
+MAX_PERPLEXITY = 1e12
+
+# Model versions are their training time
+VERSION_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def feature_matrix(metrics):
+    """Model inputs of an (n, len(FEATURES)) array of metrics, perplexity as a log"""
+    features = np.array(metrics, dtype=np.float64).reshape(-1, len(FEATURES))
+    perplexity = np.nan_to_num(features[:, 0], nan=MAX_PERPLEXITY, posinf=MAX_PERPLEXITY)
+    features[:, 0] = np.log(np.clip(perplexity, 1.0, MAX_PERPLEXITY))
+    return features
+
+
+def default_scores(metrics):
+    """The hand-weighted score used until a model is trained"""
+    metrics = np.asarray(metrics, dtype=np.float64).reshape(-1, len(FEATURES))
+    return metrics[:, 2] * 0.6 + metrics[:, 3] * 0.4
+
+
+def sigmoid(z):
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+class ScoreModel:
+    """Logistic regression over standardised features"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.version = meta['version']
+        self.mean = np.asarray(meta['mean'])
+        self.scale = np.asarray(meta['scale'])
+        self.coefficients = np.asarray(meta['coefficients'])
+        self.intercept = meta['intercept']
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(path, json.load(f))
+
+    def score(self, metrics):
+        """AI probability of each row of metrics"""
+        standardised = (feature_matrix(metrics) - self.mean) / self.scale
+        return sigmoid(standardised @ self.coefficients + self.intercept)
+
+
+def fit_logistic(features, labels, l2=1.0, iterations=100, tolerance=1e-9):
+    """(intercept, coefficients) of an L2-penalised logistic regression, by Newton's method"""
+    design = np.column_stack([np.ones(len(features)), features])
+    penalty = l2 * np.eye(design.shape[1])
+    penalty[0, 0] = 0.0  # The intercept is not shrunk
+    weights = np.zeros(design.shape[1])
+    for _ in range(iterations):
+        probabilities = sigmoid(design @ weights)
+        gradient = design.T @ (probabilities - labels) + penalty @ weights
+        hessian = (design.T * (probabilities * (1 - probabilities))) @ design + penalty
+        step = np.linalg.solve(hessian, gradient)
+        weights -= step
+        if np.abs(step).max() < tolerance:
+            break
+    return float(weights[0]), weights[1:]
+
+
+def calibration_report(probabilities, labels, bins=10):
+    """Log loss, Brier score, accuracy and expected calibration error of probabilities"""
+    clipped = np.clip(probabilities, 1e-12, 1 - 1e-12)
+    buckets = np.minimum((probabilities * bins).astype(int), bins - 1)
+    counts = np.bincount(buckets, minlength=bins)
+    gaps = np.abs(np.bincount(buckets, weights=probabilities - labels, minlength=bins))
+    return {
+        'log_loss': float(-np.mean(labels * np.log(clipped) + (1 - labels) * np.log(1 - clipped))),
+        'brier': float(np.mean((probabilities - labels) ** 2)),
+        'accuracy': float(np.mean((probabilities >= 0.5) == labels)),
+        'calibration_error': float(gaps.sum() / max(counts.sum(), 1)),
+    }
+
+
+def train_score_model(metrics, labels, l2=1.0, holdout=0.2, seed=0):
+    """Fit the model on metrics rows and 0/1 labels; returns its meta.
+
+    A seeded holdout share of the rows is scored by a model fitted on the
+    rest to report how well calibrated the scores are; the saved model
+    is then fitted on every row.
+    """
+    features = feature_matrix(metrics)
+    labels = np.asarray(labels, dtype=np.float64)
+    if len(set(labels.tolist())) < 2:
+        raise ValueError('Training needs analysed texts of both labels')
+
+    def fit(rows):
+        mean = features[rows].mean(axis=0)
+        scale = features[rows].std(axis=0)
+        scale[scale == 0] = 1.0
+        intercept, coefficients = fit_logistic((features[rows] - mean) / scale, labels[rows], l2)
+        return {'mean': mean.tolist(), 'scale': scale.tolist(),
+                'coefficients': coefficients.tolist(), 'intercept': intercept}
+
+    order = np.random.default_rng(seed).permutation(len(labels))
+    n_holdout = int(len(labels) * holdout)
+    report = None
+    if n_holdout and len(set(labels[order[n_holdout:]].tolist())) == 2:
+        held_out, rest = order[:n_holdout], order[n_holdout:]
+        model = ScoreModel(None, dict(fit(rest), version=None))
+        report = calibration_report(model.score(np.asarray(metrics, dtype=np.float64)[held_out]),
+                                    labels[held_out])
+
+    return dict(fit(np.arange(len(labels))), features=list(FEATURES), l2=l2, n_texts=len(labels),
+                n_ai=int(labels.sum()), holdout=report)
+
+
+def save_score_model(folder, meta):
+    """Write a new model version and make it the current one"""
+    meta = dict(meta, version=datetime.datetime.utcnow().strftime(VERSION_FORMAT))
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, meta['version'] + '.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+
+    pointer_tmp = os.path.join(folder, 'current.tmp')
+    with open(pointer_tmp, 'w') as f:
+        f.write(meta['version'])
+    os.replace(pointer_tmp, os.path.join(folder, 'current'))
+    return path
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_score_model():
+    """Return the current trained score model, or None if none is available"""
+    global _model
+    from flask import current_app, has_app_context
+
+    if not has_app_context():
+        return None
+    folder = current_app.config['SCORE_MODEL_FOLDER']
+    try:
+        with open(os.path.join(folder, 'current')) as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+
+    with _model_lock:
+        path = os.path.join(folder, version + '.json')
+        if _model is None or _model.path != path:
+            _model = ScoreModel.load(path)
+        return _model
+
+
+def version_time(version):
+    """When the model of a score version was trained; None for the default weights"""
+    return datetime.datetime.strptime(version, VERSION_FORMAT) if version else None
+
+
+def overall_scores(metrics, model=None):
+    """(scores, model version) of rows of metrics, under the current model by default"""
+    model = model or get_score_model()
+    if model is None:
+        return default_scores(metrics), None
+    return model.score(metrics), model.version
+
+
+def labelled_metrics():
+    """(metrics, labels) of the analysed texts of the labelled corpus"""
+    from app import db
+    from app.models import AnalysisJob, AnalysisResult, Text
+
+    columns = [getattr(AnalysisResult, name) for name in FEATURES]
+    rows = (db.session.query(*columns, Text.is_ai).join(Text)
+            .filter(~Text.id.in_(db.session.query(AnalysisJob.text_id)), Text.duplicate_of.is_(None),
+                    *[column.isnot(None) for column in columns])
+            .all())
+    if not rows:
+        return np.zeros((0, len(FEATURES))), np.zeros(0)
+    values = np.array([row[:-1] for row in rows], dtype=np.float64)
+    return values, np.array([bool(row[-1]) for row in rows], dtype=np.float64)
+
+
+def rerank_analyses(model=None, batch_size=50000):
+    """Re-score every AnalysisResult from its stored metrics; returns the number re-scored.
+
+    Each batch is scored as one array and written in one transaction,
+    together with the moves of the score histogram counters.
+    """
+    from app import db
+    from app.corpus_stats import apply_deltas, score_bucket
+    from app.models import AnalysisResult
+
+    model = model or get_score_model()
+    columns = [getattr(AnalysisResult, name) for name in FEATURES]
+    rescored = last_id = 0
+    while True:
+        rows = (db.session.query(AnalysisResult.id, AnalysisResult.overall_score, *columns)
+                .filter(AnalysisResult.id > last_id, *[column.isnot(None) for column in columns])
+                .order_by(AnalysisResult.id).limit(batch_size).all())
+        if not rows:
+            return rescored
+        last_id = rows[-1].id
+
+        scores, version = overall_scores(np.array([row[2:] for row in rows], dtype=np.float64), model)
+        deltas = Counter(f'ai_score:{score_bucket(score)}' for score in scores.tolist())
+        deltas.subtract(f'ai_score:{score_bucket(row.overall_score)}' for row in rows
+                        if row.overall_score is not None)
+        db.session.execute(db.update(AnalysisResult),
+                           [{'id': row.id, 'overall_score': score, 'score_version': version}
+                            for row, score in zip(rows, scores.tolist())])
+        apply_deltas(db.session.connection(), deltas)
+        db.session.commit()
+        rescored += len(rows)
+
+
+def main():
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Train the overall AI score and re-rank the stored analyses.')
+    parser.add_argument('command', choices=('train', 'rerank'))
+    parser.add_argument('--rescore', action='store_true',
+                        help='re-analyse every stored text first, so each labelled text has metrics')
+    parser.add_argument('--l2', type=float, default=1.0, help='L2 penalty on the standardised coefficients')
+    args = parser.parse_args()
+
+    with app.app_context():
+        start = time.perf_counter()
+        if args.command == 'train':
+            if args.rescore:
+                from app.rescore import rescore_corpus
+                rescore_corpus(all_texts=True)
+            metrics, labels = labelled_metrics()
+            meta = train_score_model(metrics, labels, l2=args.l2)
+            path = save_score_model(app.config['SCORE_MODEL_FOLDER'], meta)
+            print(f"Score model written to {path}, fitted on {meta['n_texts']} texts ({meta['n_ai']} AI)")
+            if meta['holdout']:
+                print('Holdout: ' + ', '.join(f'{name} {value:.3f}' for name, value in meta['holdout'].items()))
+        rescored = rerank_analyses()
+        print(f"Re-ranked {rescored} analyses in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
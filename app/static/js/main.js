@@ -88,6 +88,24 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Poll a queued analysis and reload the results page once it has finished
+    const jobStatus = document.getElementById('job-status');
+    if (jobStatus) {
+        const pollJob = () => {
+            fetch(jobStatus.dataset.statusUrl)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'done' || job.status === 'failed') {
+                        window.location.reload();
+                    } else {
+                        setTimeout(pollJob, 2000);
+                    }
+                })
+                .catch(() => setTimeout(pollJob, 5000));
+        };
+        setTimeout(pollJob, 2000);
+    }
+
     // Smooth scroll for anchor links
     document.querySelectorAll('a[href^="#"]').forEach(anchor => {
         anchor.addEventListener('click', function (e) {
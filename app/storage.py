@@ -0,0 +1,27 @@
+from sqlalchemy import event
+
+
+def configure_sqlite(engine, config):
+    """Apply the SQLITE_* settings to every connection the engine opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        # Negative sizes are in KiB rather than pages
+        f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        "PRAGMA temp_store = memory",
+    ]
+    if engine.url.database not in (None, '', ':memory:'):
+        # The journal mode is stored in the file; in-memory databases have none
+        pragmas.insert(0, f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
@@ -1,41 +1,37 @@
-import numpy as np
-from nltk.tokenize import word_tokenize, sent_tokenize
-from collections import Counter
+import hashlib
+import itertools
 import math
-import re
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import nltk
-
-nltk.download('punkt')
+from collections import Counter
 
+import numpy as np
+from flask import current_app
+from app.reference_index import DEFAULT_MEMORY_LIMIT, sparse_cosine_similarities
+from app.language_model import get_language_model, self_perplexity
+from app.metrics import text_bytes, timed
+from app.scoring import FEATURES, overall_scores
+from app.tokenization import TokenizedDocument, iter_sentences, iter_windows, splitter_name, tokenize_document
 
-def calculate_perplexity(text, n=2):
-    """Calculate perplexity using n-gram model"""
-    tokens = word_tokenize(text.lower())
-    ngrams = list(zip(*[tokens[i:] for i in range(n)]))
-    ngram_counts = Counter(ngrams)
-    total_ngrams = len(ngrams)
+# Windows whose similarities are computed in one pass over the reference index
+WINDOW_BATCH_SIZE = 32
 
-    if total_ngrams == 0:
-        return float('inf')
 
-    # Calculate log probability
-    log_prob = 0
-    for ngram in ngrams:
-        count = ngram_counts[ngram]
-        prob = count / total_ngrams
-        log_prob += math.log(prob) if prob > 0 else 0
+def calculate_perplexity(text, n=2, model=None):
+    """Calculate perplexity using n-gram model
 
-    # Calculate perplexity
-    perplexity = math.exp(-log_prob / total_ngrams)
-    return perplexity
+    Uses the trained reference language model when one is available and
+    falls back to the text's own n-gram frequencies otherwise.
+    """
+    token_hashes = tokenize_document(text).token_hashes
+    if model is None:
+        model = get_language_model()
+    if model is not None:
+        return model.perplexity(token_hashes)
+    return self_perplexity(token_hashes, n)
 
 
 def calculate_burstiness(text):
     """Calculate burstiness as variance of sentence lengths"""
-    sentences = sent_tokenize(text)
-    sentence_lengths = [len(word_tokenize(sent)) for sent in sentences]
+    sentence_lengths = tokenize_document(text).sentence_lengths
 
     if len(sentence_lengths) < 2:
         return 0.0
@@ -48,74 +44,338 @@ def calculate_burstiness(text):
     return burstiness
 
 
-def analyze_text(text):
+def analyze_text(text, model=None):
     """Analyze text for AI-generated content indicators"""
-    perplexity = calculate_perplexity(text)
-    burstiness = calculate_burstiness(text)
+    document = tokenize_document(text)
+    perplexity = calculate_perplexity(document, model=model)
+    burstiness = calculate_burstiness(document)
+    return perplexity, burstiness, estimate_ai_proportion(perplexity, burstiness, model)
 
-    # Calculate AI proportion based on metrics
-    normalized_perplexity = min(perplexity / 100, 1.0)  # Normalize to 0-1
+
+def estimate_ai_proportion(perplexity, burstiness, model=None):
+    """Share of AI-like content implied by perplexity and burstiness"""
+    # Normalize to 0-1, on the scale of the language model's perplexities if there is one
+    if model is not None:
+        normalized_perplexity = model.normalized_perplexity(perplexity)
+    else:
+        normalized_perplexity = min(perplexity / 100, 1.0)
     normalized_burstiness = min(burstiness / 2, 1.0)  # Normalize to 0-1
 
     # AI text tends to have lower perplexity and burstiness
     ai_proportion = 0.6 * (1 - normalized_perplexity) + 0.4 * (1 - normalized_burstiness)
-    ai_proportion = max(0, min(1, ai_proportion))  # Clamp between 0 and 1
-
-    return perplexity, burstiness, ai_proportion
+    return max(0, min(1, ai_proportion))  # Clamp between 0 and 1
 
 
-def compare_with_documents(text, documents):
+def compare_with_documents(text, documents, memory_limit=DEFAULT_MEMORY_LIMIT):
     """Compare text with a list of documents using TF-IDF and cosine similarity"""
+    # sklearn takes longer to import than the whole app; only this legacy path needs it
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
     if not documents:
         return 0.0
 
     # Create a list with the input text and all comparison documents
     all_texts = [text] + [doc.content for doc in documents]
 
-    # Create TF-IDF vectors
-    vectorizer = TfidfVectorizer().fit_transform(all_texts)
-
-    # Calculate cosine similarity between input text and each document
-    vectors = vectorizer.toarray()
-    text_vector = vectors[0:1]
-    doc_vectors = vectors[1:]
-
-    similarities = cosine_similarity(text_vector, doc_vectors)[0]
+    # TF-IDF rows come out L2-normalised, so cosine similarity is a sparse
+    # dot product and the matrix never has to be made dense
+    vectors = TfidfVectorizer().fit_transform(all_texts).tocsr()
+    similarities = sparse_cosine_similarities(vectors[0], vectors[1:], memory_limit)
 
     # Return average similarity
     return np.mean(similarities)
 
 
+def reference_similarities(index, documents, exclude_ids=None, reference_ids=None):
+    """(AI, human) similarity of each document with the reference corpus, per SIMILARITY_MODE.
+
+    exclude_ids holds, per document, the id of a stored text to leave out
+    of the references: the document's own, so it is not compared with itself.
+    reference_ids, when given, are the only stored texts compared with.
+    """
+    if current_app.config['SIMILARITY_MODE'] == 'top_k':
+        return index.nearest_similarities_batch(documents, current_app.config['SIMILARITY_TOP_K'],
+                                                current_app.config['SIMILARITY_LSH_BAND_BITS'], exclude_ids,
+                                                reference_ids)
+    return index.mean_similarities_batch(documents, exclude_ids, reference_ids)
+
+
+def stored_reference_similarities(index, doc_ids, reference_ids=None):
+    """reference_similarities of indexed texts, scored from their stored index rows"""
+    if current_app.config['SIMILARITY_MODE'] == 'top_k':
+        return index.stored_similarities_batch(doc_ids, current_app.config['SIMILARITY_TOP_K'],
+                                               current_app.config['SIMILARITY_LSH_BAND_BITS'], reference_ids)
+    return index.stored_similarities_batch(doc_ids, reference_ids=reference_ids)
+
+
+def metrics_result(perplexity, burstiness, ai_proportion, ai_similarity, human_similarity):
+    return {
+        'perplexity': float(perplexity),
+        'burstiness': float(burstiness),
+        'ai_proportion': float(ai_proportion),
+        'ai_similarity': float(ai_similarity),
+        'human_similarity': float(human_similarity),
+    }
+
+
+def add_overall_scores(results):
+    """Fill in the overall AI score of metrics result dicts, scored as one batch (see app.scoring)"""
+    scores, version = overall_scores([[result[name] for name in FEATURES] for result in results])
+    for result, score in zip(results, scores.tolist()):
+        result['overall_ai_score'] = score
+        result['score_version'] = version
+    return results
+
+
+def combine_metrics(perplexity, burstiness, ai_proportion, ai_similarity, human_similarity):
+    """Assemble the analysis result dict, including the overall AI score"""
+    return add_overall_scores([metrics_result(perplexity, burstiness, ai_proportion, ai_similarity,
+                                              human_similarity)])[0]
+
+
+def window_result(position, start_sentence, n_sentences, perplexity, burstiness, ai_proportion,
+                  ai_similarity, human_similarity):
+    return {
+        'position': position,
+        'start_sentence': start_sentence,
+        'n_sentences': n_sentences,
+        'perplexity': float(perplexity),
+        'burstiness': float(burstiness),
+        'ai_proportion': float(ai_proportion),
+        'ai_similarity': float(ai_similarity),
+        'human_similarity': float(human_similarity),
+    }
+
+
+def analyze_windows(index, windows, model=None, exclude_id=None, reference_ids=None):
+    """Metrics of each (start sentence, tokenized document) window.
+
+    windows may be a generator; it is consumed WINDOW_BATCH_SIZE windows
+    at a time, each batch scored against the references in one pass.
+    """
+    windows = iter(windows)
+    results = []
+    while True:
+        batch = list(itertools.islice(windows, WINDOW_BATCH_SIZE))
+        if not batch:
+            return results
+        similarities = reference_similarities(index, [document for _, document in batch],
+                                              [exclude_id] * len(batch), reference_ids)
+        for (start, document), (ai_similarity, human_similarity) in zip(batch, similarities):
+            perplexity, burstiness, ai_proportion = analyze_text(document, model)
+            results.append(window_result(len(results), start, len(document.sentence_lengths), perplexity,
+                                         burstiness, ai_proportion, ai_similarity, human_similarity))
+
+
+def streaming_text_analysis(text, index, model=None, exclude_id=None, reference_ids=None):
+    """Metrics of a long text computed window by window, as (results, windows).
+
+    The text is split into sentences block by block and only one batch
+    of windows is tokenized at a time. Document-level values are built
+    from the sentences each window adds: perplexity from the summed
+    token log-probabilities (a token-weighted mean of window
+    perplexities without a trained model), burstiness from running sums
+    of sentence lengths and similarity from term counts accumulated
+    over the whole text.
+    """
+    size = current_app.config['ANALYSIS_WINDOW_SENTENCES']
+    stride = current_app.config['ANALYSIS_WINDOW_STRIDE']
+    totals = {'log_perplexity': 0.0, 'tokens': 0, 'sentences': 0, 'length': 0, 'squared_length': 0}
+    term_counts = Counter()
+
+    def windows():
+        covered = 0
+        for start, sentences in iter_windows(iter_sentences(text), size, stride):
+            document = TokenizedDocument(' '.join(sentences), sentences=sentences)
+            # Only count the sentences no earlier window has counted
+            added = document if covered <= start else document.window(covered - start, len(sentences))
+            covered = start + len(sentences)
+
+            if model is not None:
+                log_probs = model.token_log_probs(added.token_hashes)
+                totals['log_perplexity'] -= float(log_probs.sum())
+                totals['tokens'] += len(log_probs)
+            elif len(added):
+                totals['log_perplexity'] += math.log(self_perplexity(added.token_hashes)) * len(added)
+                totals['tokens'] += len(added)
+            lengths = added.sentence_lengths
+            totals['sentences'] += len(lengths)
+            totals['length'] += int(lengths.sum())
+            totals['squared_length'] += int((lengths ** 2).sum())
+            term_counts.update(added.term_counts)
+            yield start, document
+
+    window_results = analyze_windows(index, windows(), model, exclude_id, reference_ids)
+
+    perplexity = math.exp(totals['log_perplexity'] / totals['tokens']) if totals['tokens'] else float('inf')
+    burstiness = 0.0
+    if totals['sentences'] >= 2 and totals['length']:
+        mean_length = totals['length'] / totals['sentences']
+        burstiness = (totals['squared_length'] / totals['sentences'] - mean_length ** 2) / mean_length ** 2
+    whole = TokenizedDocument.from_parts(None, [], [], [], term_counts)
+    ai_similarity, human_similarity = reference_similarities(index, [whole], [exclude_id], reference_ids)[0]
+    results = combine_metrics(perplexity, burstiness, estimate_ai_proportion(perplexity, burstiness, model),
+                              ai_similarity, human_similarity)
+    return results, window_results
+
+
 def comprehensive_text_analysis(text):
     """Comprehensive analysis comparing with stored AI and human documents"""
-    from app.models import Text
+    return comprehensive_text_analysis_with_windows(text)[0]
+
+
+def comprehensive_text_analysis_with_windows(text):
+    """comprehensive_text_analysis plus per-window metrics, as (results, windows)"""
+    from app.feature_cache import cached_document
+    from app.reference_index import get_reference_index, update_reference_index
+
+    # Make sure the reference index covers every stored document
+    with timed('reference_index.update'):
+        update_reference_index()
+    with timed('reference_index.load'):
+        index = get_reference_index()
+        model = get_language_model()
+
+    if len(text) > current_app.config['ANALYSIS_STREAMING_MIN_CHARS']:
+        # Never tokenized whole, so never cached whole either
+        with timed('analysis.streaming', text_bytes(text)):
+            return streaming_text_analysis(text, index, model)
+
+    # Tokens come from the content-hash cache when this exact text has been
+    # seen before; cached metric values are only reused while the language
+    # model, the reference corpus and the analysis settings are unchanged
+    with timed('analysis.tokenize', text_bytes(text)):
+        key, document, features = cached_document(text)
+    return cached_scores(key, features, metrics_version(index, model),
+                         lambda: score_document(document, index, model))
+
+
+def metrics_version(index, model, exclude_id=None, reference_ids=None):
+    """What the metrics of a text depend on besides its content, as a cache version"""
+    config = current_app.config
+    version = (f"{model.version if model else 'self'}:{index.version}:{config['SIMILARITY_MODE']}:"
+               f"{config['ANALYSIS_WINDOW_SENTENCES']}/{config['ANALYSIS_WINDOW_STRIDE']}:{splitter_name()}")
+    if exclude_id is not None:
+        version += f':without {exclude_id}'
+    if reference_ids is not None:
+        # The texts of its topic, which change as texts are tagged
+        ids = np.asarray(sorted(reference_ids), dtype=np.int64)
+        version += ':topic ' + hashlib.sha1(ids.tobytes()).hexdigest()[:16]
+    return version
+
+
+def cached_scores(key, features, version, score):
+    """(results, windows) cached in features under key, or score() stored there on a version mismatch"""
+    from app.feature_cache import save_features
+
+    cached_metrics = features['metrics']
+    if cached_metrics and cached_metrics['version'] == version:
+        return cached_metrics['values'], cached_metrics['windows']
+
+    results, windows = score()
+
+    features['metrics'] = {'version': version, 'values': results, 'windows': windows}
+    with timed('feature_cache.save'):
+        save_features(key, features)
+    return results, windows
+
+
+def score_document(document, index, model=None, exclude_id=None, reference_ids=None):
+    """Metrics and per-window metrics of a tokenized document, as (results, windows)"""
+    size = current_app.config['ANALYSIS_WINDOW_SENTENCES']
+    stride = current_app.config['ANALYSIS_WINDOW_STRIDE']
 
     # Basic metrics
-    perplexity, burstiness, ai_proportion = analyze_text(text)
-
-    # Get AI and human documents from database
-    ai_docs = Text.query.filter_by(is_ai=True).all()
-    human_docs = Text.query.filter_by(is_ai=False).all()
-
-    # Calculate similarities
-    ai_similarity = compare_with_documents(text, ai_docs)
-    human_similarity = compare_with_documents(text, human_docs)
-
-    # Calculate overall AI score based on all metrics
-    # Weighted combination of all indicators
-    overall_ai_score = (
-            0.3 * ai_proportion +
-            0.3 * ai_similarity +
-            0.2 * (1 - human_similarity) +
-            0.1 * (1 - perplexity) +
-            0.1 * (1 - burstiness)
-    )
+    with timed('analysis.statistics'):
+        perplexity, burstiness, ai_proportion = analyze_text(document, model)
 
-    return {
-        'perplexity': perplexity,
-        'burstiness': burstiness,
-        'ai_proportion': ai_proportion,
-        'ai_similarity': ai_similarity,
-        'human_similarity': human_similarity,
-        'overall_ai_score': overall_ai_score
-    }
\ No newline at end of file
+    # Compare against the persistent reference index instead of refitting
+    # TF-IDF over every stored document
+    with timed('analysis.similarity'):
+        ai_similarity, human_similarity = reference_similarities(index, [document], [exclude_id],
+                                                                 reference_ids)[0]
+
+    results = combine_metrics(perplexity, burstiness, ai_proportion, ai_similarity, human_similarity)
+
+    n_sentences = len(document.sentence_lengths)
+    if n_sentences <= size:
+        windows = [window_result(0, 0, n_sentences, perplexity, burstiness, ai_proportion,
+                                 ai_similarity, human_similarity)]
+    else:
+        with timed('analysis.windows'):
+            windows = analyze_windows(index, ((start, document.window(start, start + len(sentences)))
+                                              for start, sentences in iter_windows(range(n_sentences), size, stride)),
+                                      model, exclude_id, reference_ids)
+    return results, windows
+
+
+def stored_text_analysis(text):
+    """comprehensive_text_analysis_with_windows of a stored Text, leaving it out of its references.
+
+    A text without an ACM topic is tagged first, and is then compared
+    only with texts of its topic (see app.topics.same_topic_references).
+    As for any text, metrics are reused from the content-hash cache while
+    the references are unchanged, and long texts are scored window by
+    window; otherwise the tokens come from the text's persisted document
+    features, so analysing it again does not tokenize it again.
+    """
+    from app.feature_cache import document_features, features_document, load_features
+    from app.reference_index import get_reference_index, update_reference_index
+    from app.topics import classify_document, same_topic_references
+
+    # Indexing the text also tags it, unless it is a flagged near-duplicate
+    with timed('reference_index.update'):
+        update_reference_index()
+    with timed('reference_index.load'):
+        index = get_reference_index()
+        model = get_language_model()
+
+    if text.content_length > current_app.config['ANALYSIS_STREAMING_MIN_CHARS']:
+        # Never tokenized whole; an untagged one is compared with every reference
+        with timed('analysis.streaming', text.content_length):
+            return streaming_text_analysis(text.content, index, model, text.id,
+                                           same_topic_references(text.acm_topic))
+
+    # The cache entry holds the metrics of its last analysis
+    with timed('analysis.load_features'):
+        features = load_features(text.content_hash)
+        if features is None:
+            document, features = document_features(text.content_hash)
+        else:
+            document = features_document(features)
+    if text.acm_topic is None:
+        # Saved with the results
+        with timed('analysis.classify_topic'):
+            text.acm_topic = classify_document(index, document)
+    reference_ids = same_topic_references(text.acm_topic)
+
+    return cached_scores(text.content_hash, features, metrics_version(index, model, text.id, reference_ids),
+                         lambda: score_document(document, index, model, text.id, reference_ids))
+
+
+def batch_text_analysis(texts):
+    """comprehensive_text_analysis for many texts against one load of the references
+
+    The similarities of all texts are computed together as one blocked
+    sparse matrix product against the reference index.
+    """
+    from app.reference_index import get_reference_index, update_reference_index
+
+    with timed('reference_index.update'):
+        update_reference_index()
+    with timed('reference_index.load'):
+        index = get_reference_index()
+        model = get_language_model()
+
+    with timed('batch.tokenize', sum(text_bytes(text) for text in texts)):
+        documents = [tokenize_document(text) for text in texts]
+    with timed('batch.similarity'):
+        similarities = reference_similarities(index, documents)
+
+    results = []
+    with timed('batch.statistics'):
+        for document, (ai_similarity, human_similarity) in zip(documents, similarities):
+            perplexity, burstiness, ai_proportion = analyze_text(document, model)
+            results.append(metrics_result(perplexity, burstiness, ai_proportion, ai_similarity, human_similarity))
+    with timed('batch.score'):
+        return add_overall_scores(results)
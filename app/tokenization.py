@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import re
+from collections import Counter
+
+import numpy as np
+
+from config import Config
+
+
+# Same token pattern as sklearn's TfidfVectorizer defaults
+TERM_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Characters handed to the sentence splitter at a time when streaming
+SENTENCE_BLOCK_CHARS = 64 * 1024
+
+# Sentence boundaries for when the punkt model is not installed
+FALLBACK_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# NLTK loads on first use; see sentence_splitter()
+_sent_tokenize = None
+_word_tokenize = None
+
+
+def _fallback_sent_tokenize(text):
+    return [sentence for sentence in FALLBACK_SENTENCE_END.split(text.strip()) if sentence]
+
+
+def sentence_splitter():
+    """NLTK's sent_tokenize, imported on first use.
+
+    The punkt model is looked up once per process in NLTK_DATA_FOLDER
+    and NLTK's usual locations. It is never downloaded here (run
+    python -m app.nltk_setup when deploying); without it sentences are
+    split at end punctuation instead.
+    """
+    global _sent_tokenize
+    if _sent_tokenize is None:
+        import nltk
+
+        if Config.NLTK_DATA_FOLDER not in nltk.data.path:
+            nltk.data.path.insert(0, Config.NLTK_DATA_FOLDER)
+        try:
+            nltk.data.find('tokenizers/punkt')
+            from nltk.tokenize import sent_tokenize
+            _sent_tokenize = sent_tokenize
+        except LookupError:
+            logging.getLogger(__name__).warning(
+                'NLTK punkt model not found; splitting sentences at punctuation. '
+                'Install it with: python -m app.nltk_setup')
+            _sent_tokenize = _fallback_sent_tokenize
+    return _sent_tokenize
+
+
+def splitter_name():
+    """'punkt' or 'fallback', whichever sentence_splitter() splits with.
+
+    Sentence lengths and windows depend on it, so it is part of the
+    version of anything derived from them.
+    """
+    return 'fallback' if sentence_splitter() is _fallback_sent_tokenize else 'punkt'
+
+
+def word_tokenizer():
+    """NLTK's word_tokenize, imported on first use"""
+    global _word_tokenize
+    if _word_tokenize is None:
+        from nltk.tokenize import word_tokenize
+        _word_tokenize = word_tokenize
+    return _word_tokenize
+
+
+class TokenizedDocument:
+    """Sentences, tokens and token IDs of one text, produced in a single pass.
+
+    Sentences are split once and every sentence is word-tokenized once;
+    perplexity, burstiness and TF-IDF similarity all read from the result
+    instead of re-tokenizing the raw text.
+    """
+
+    def __init__(self, text, sentences=None):
+        self.text = text
+        self._sentences = sentence_splitter()(text) if sentences is None else sentences
+
+        word_tokenize = word_tokenizer()
+        sentence_lengths = []
+        tokens = []
+        for sentence in self._sentences:
+            # preserve_line skips the sentence split word_tokenize would redo
+            sentence_tokens = word_tokenize(sentence, preserve_line=True)
+            sentence_lengths.append(len(sentence_tokens))
+            tokens.extend(token.lower() for token in sentence_tokens)
+
+        ids = {}
+        self.token_ids = np.fromiter((ids.setdefault(token, len(ids)) for token in tokens),
+                                     dtype=np.int32, count=len(tokens))
+        self.vocabulary = list(ids)
+        self.tokens = tokens
+        self.sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+        self._term_counts = None
+        self._token_hashes = None
+
+    @classmethod
+    def from_parts(cls, text, vocabulary, token_ids, sentence_lengths, term_counts=None):
+        """Rebuild a tokenized document from stored parts without re-tokenizing"""
+        document = cls.__new__(cls)
+        document.text = text
+        document._sentences = None
+        document.vocabulary = list(vocabulary)
+        document.token_ids = np.asarray(token_ids, dtype=np.int32)
+        document.tokens = [document.vocabulary[i] for i in document.token_ids.tolist()]
+        document.sentence_lengths = np.asarray(sentence_lengths, dtype=np.int64)
+        document._term_counts = term_counts
+        document._token_hashes = None
+        return document
+
+    def window(self, start, stop):
+        """Sentences start:stop as a document of their own, sliced from the token arrays"""
+        offsets = np.concatenate([[0], np.cumsum(self.sentence_lengths)])
+        lo, hi = int(offsets[start]), int(offsets[stop])
+        used, token_ids = np.unique(self.token_ids[lo:hi], return_inverse=True)
+        document = TokenizedDocument.from_parts(None, [self.vocabulary[i] for i in used.tolist()], token_ids,
+                                                self.sentence_lengths[start:stop])
+        document._token_hashes = self.token_hashes[lo:hi]
+        return document
+
+    @property
+    def sentences(self):
+        if self._sentences is None:
+            self._sentences = sentence_splitter()(self.text)
+        return self._sentences
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def term_counts(self):
+        """TF-IDF term counts, derived from the token counts rather than the raw text"""
+        if self._term_counts is None:
+            token_counts = np.bincount(self.token_ids, minlength=len(self.vocabulary))
+            counts = Counter()
+            for token, count in zip(self.vocabulary, token_counts.tolist()):
+                for term in TERM_PATTERN.findall(token):
+                    counts[term] += count
+            self._term_counts = counts
+        return self._term_counts
+
+    @property
+    def token_hashes(self):
+        """Stable 64-bit hash of every token, hashing each distinct token once"""
+        if self._token_hashes is None:
+            self._token_hashes = hash_tokens(self.vocabulary)[self.token_ids]
+        return self._token_hashes
+
+
+def hash_tokens(tokens):
+    """Stable (process-independent) 64-bit hashes of a list of tokens"""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+         for token in tokens),
+        dtype=np.uint64, count=len(tokens))
+
+
+def iter_sentences(text, block_chars=SENTENCE_BLOCK_CHARS):
+    """Yield the sentences of text, splitting it one block at a time.
+
+    The last sentence of each block may be cut off, so it is carried
+    over and split again together with the next block. A carry longer
+    than a block (text without sentence boundaries) is cut at its last
+    space within the block and yielded as a sentence, so no split ever
+    sees more than two blocks.
+    """
+    sent_tokenize = sentence_splitter()
+    position = 0
+    carry = ''
+    while position < len(text):
+        block = carry + text[position:position + block_chars]
+        position += block_chars
+        sentences = sent_tokenize(block)
+        if position < len(text) and sentences:
+            carry = block[block.rindex(sentences.pop()):]
+            if len(carry) > block_chars:
+                cut = carry.rfind(' ', 0, block_chars)
+                cut = cut if cut > 0 else block_chars
+                sentences.append(carry[:cut])
+                carry = carry[cut:]
+        else:
+            carry = ''
+        yield from sentences
+
+
+def iter_windows(items, size, stride):
+    """Yield (start, items) windows of size items every stride items.
+
+    Only the current window is held in memory; a shorter final window
+    covers whatever the full windows left out. stride may not exceed
+    size, or the items between windows would never be covered.
+    """
+    if not 0 < stride <= size:
+        raise ValueError(f'Window stride must be between 1 and the window size, got size {size}, stride {stride}')
+    return _iter_windows(items, size, stride)
+
+
+def _iter_windows(items, size, stride):
+    buffer = []
+    start = 0
+    covered = 0
+    for item in items:
+        buffer.append(item)
+        if len(buffer) == size:
+            yield start, list(buffer)
+            covered = start + size
+            buffer = buffer[stride:]
+            start += stride
+    if buffer and start + len(buffer) > covered:
+        yield start, buffer
+
+
+def iter_sentence_documents(text, size):
+    """Yield text as tokenized documents of size sentences each, never tokenizing it whole"""
+    for _, sentences in iter_windows(iter_sentences(text), size, size):
+        yield TokenizedDocument(' '.join(sentences), sentences=sentences)
+
+
+def tokenize_document(text):
+    """Tokenize text once for all downstream metrics"""
+    if isinstance(text, TokenizedDocument):
+        return text
+    return TokenizedDocument(text or '')
@@ -0,0 +1,235 @@
+"""Automatic ACM topic tagging of stored texts.
+
+A text's topic is read off two signals:
+
+  * keyword hits: the phrases of every ACMTopic.keywords list are
+    compiled into one Aho-Corasick automaton over words, so a single
+    left-to-right pass over the text's tokens finds every phrase of
+    every topic, overlapping ones included,
+  * centroid similarity: the cosine similarity of the text's TF-IDF
+    vector in the reference index with the centroid of the indexed
+    texts already tagged with each topic.
+
+Each topic scores KEYWORD_WEIGHT times its share of the keyword hits
+plus the rest times its centroid similarity; the best topic is taken
+when it reaches MIN_TOPIC_SCORE, and the text stays untagged otherwise.
+
+Texts are tagged as they are indexed (update_reference_index), and a
+text being analysed is tagged by stored_text_analysis if it is not
+indexed yet. same_topic_references() then narrows its references to
+texts of the same topic.
+
+Usage:
+    python -m app.topics    # tag every stored text that has no topic yet
+"""
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from flask import current_app
+
+from app import app, db
+from app.corpus_stats import apply_deltas
+from app.models import ACMTopic, Text
+
+KEYWORD_WEIGHT = 0.5
+MIN_TOPIC_SCORE = 0.15
+# Centroids are recomputed after the index changes, but at most this often
+CENTROID_REFRESH_SECONDS = 300
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over word sequences, reporting the topic of each match"""
+
+    def __init__(self, keywords):
+        # keywords: (topic, phrase) pairs; a phrase is matched word by word
+        self.words = {}
+        self.goto = [{}]
+        self.topics = [[]]
+        for topic, phrase in keywords:
+            state = 0
+            for word in phrase.lower().split():
+                word_id = self.words.setdefault(word, len(self.words))
+                if word_id not in self.goto[state]:
+                    self.goto[state][word_id] = len(self.goto)
+                    self.goto.append({})
+                    self.topics.append([])
+                state = self.goto[state][word_id]
+            if state and topic not in self.topics[state]:
+                self.topics[state].append(topic)
+
+        # Failure links, breadth first; every state also reports the matches
+        # of its longest proper suffix
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word_id, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word_id not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word_id, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.topics[child] = self.topics[child] + [topic for topic in self.topics[self.fail[child]]
+                                                           if topic not in self.topics[child]]
+
+    def hits(self, document):
+        """Keyword matches per topic in a tokenized document, as a Counter"""
+        # Only tokens that occur in some phrase can advance the automaton, so
+        # the pass skips from one of them to the next, starting over at a gap
+        word_ids = np.fromiter((self.words.get(token, -1) for token in document.vocabulary),
+                               dtype=np.int64, count=len(document.vocabulary))[document.token_ids]
+        positions = np.flatnonzero(word_ids >= 0)
+        hits = Counter()
+        state = 0
+        previous = -2
+        for position, word_id in zip(positions.tolist(), word_ids[positions].tolist()):
+            if position != previous + 1:
+                state = 0
+            previous = position
+            while state and word_id not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word_id, 0)
+            hits.update(self.topics[state])
+        return hits
+
+
+_matcher = None
+
+
+def keyword_matcher():
+    """The automaton over the keywords of every ACMTopic, rebuilt when they change"""
+    global _matcher
+    keywords = tuple((name, keyword.strip())
+                     for name, keywords in db.session.query(ACMTopic.name, ACMTopic.keywords).order_by(ACMTopic.id)
+                     for keyword in (keywords or '').split(',') if keyword.strip())
+    if _matcher is None or _matcher[0] != keywords:
+        _matcher = (keywords, KeywordMatcher(keywords))
+    return _matcher[1]
+
+
+_centroids = None
+
+
+def topic_centroids(index):
+    """(topic names, L2-normalised TF-IDF centroid rows) of the tagged texts in the index"""
+    global _centroids
+    now = time.monotonic()
+    if _centroids is not None:
+        version, computed_at, names, centroids = _centroids
+        if version == index.version or (now - computed_at < CENTROID_REFRESH_SECONDS
+                                        and centroids.shape[1] <= len(index.terms)):
+            return names, centroids
+
+    rows = (db.session.query(Text.id, Text.acm_topic)
+            .filter(Text.acm_topic.isnot(None), Text.duplicate_of.is_(None))
+            .order_by(Text.id).all())
+    names = sorted({row.acm_topic for row in rows})
+    numbers = {name: i for i, name in enumerate(names)}
+    centroids = index.centroids([row.id for row in rows], [numbers[row.acm_topic] for row in rows], len(names))
+    _centroids = (index.version, now, names, centroids)
+    return names, centroids
+
+
+def classify(index, hits, vectors):
+    """Topic (or None) of each text, from its keyword hits and its TF-IDF row in vectors"""
+    names, centroids = topic_centroids(index)
+    if names:
+        similarities = (vectors[:, :centroids.shape[1]] @ centroids.T).toarray()
+    else:
+        similarities = np.zeros((len(hits), 0))
+
+    topics = []
+    for text_hits, text_similarities in zip(hits, similarities):
+        scores = Counter()
+        total = sum(text_hits.values())
+        for topic, count in text_hits.items():
+            scores[topic] += KEYWORD_WEIGHT * count / total
+        for topic, similarity in zip(names, text_similarities.tolist()):
+            scores[topic] += (1 - KEYWORD_WEIGHT) * similarity
+        best = max(scores.items(), key=lambda item: (item[1], item[0]), default=(None, 0.0))
+        topics.append(best[0] if best[1] >= MIN_TOPIC_SCORE else None)
+    return topics
+
+
+def classify_document(index, document):
+    """Topic (or None) of a tokenized document that need not be indexed"""
+    return classify(index, [keyword_matcher().hits(document)], index.vectorize(document))[0]
+
+
+def tag_texts(index, hits):
+    """Store the topic of indexed texts without one; hits maps their ids to their keyword hits.
+
+    Only rows still untagged are written, so two processes tagging the
+    same text count it once. Returns the number of texts tagged.
+    """
+    if not hits:
+        return 0
+    ids = sorted(hits)
+    by_topic = defaultdict(list)
+    for text_id, topic in zip(ids, classify(index, [hits[text_id] for text_id in ids], index.tfidf_vectors(ids))):
+        if topic is not None:
+            by_topic[topic].append(text_id)
+
+    table = Text.__table__
+    connection = db.session.connection()
+    deltas = Counter()
+    for topic, topic_ids in sorted(by_topic.items()):
+        updated = connection.execute(table.update()
+                                     .where(table.c.id.in_(topic_ids), table.c.acm_topic.is_(None))
+                                     .values(acm_topic=topic))
+        deltas[f'acm_topic:{topic}'] += updated.rowcount
+    apply_deltas(connection, deltas)
+    db.session.commit()
+    return sum(deltas.values())
+
+
+def same_topic_references(topic):
+    """Ids of the stored texts of topic, to compare a text of that topic with.
+
+    None, meaning every text, when SIMILARITY_SAME_TOPIC is off, the text
+    has no topic, or the topic has fewer than SIMILARITY_TOPIC_MIN_REFERENCES
+    texts of either label to compare with.
+    """
+    if not current_app.config['SIMILARITY_SAME_TOPIC'] or topic is None:
+        return None
+    rows = db.session.query(Text.id, Text.is_ai).filter(Text.acm_topic == topic, Text.duplicate_of.is_(None)).all()
+    n_ai = sum(1 for row in rows if row.is_ai)
+    if min(n_ai, len(rows) - n_ai) < current_app.config['SIMILARITY_TOPIC_MIN_REFERENCES']:
+        return None
+    return [row.id for row in rows]
+
+
+def tag_corpus(batch_size=500):
+    """Tag every indexed text without a topic; returns the number tagged"""
+    from app.feature_cache import document_features
+    from app.reference_index import get_reference_index, update_reference_index
+
+    update_reference_index()
+    index = get_reference_index()
+    matcher = keyword_matcher()
+    tagged = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(Text.id, Text.content_hash)
+                .filter(Text.id > last_id, Text.acm_topic.is_(None), Text.duplicate_of.is_(None),
+                        Text.content_length > 0, Text.id <= index.last_doc_id)
+                .order_by(Text.id).limit(batch_size).all())
+        if not rows:
+            return tagged
+        last_id = rows[-1].id
+        indexed = [row for row, position in zip(rows, index.positions([row.id for row in rows])) if position >= 0]
+        tagged += tag_texts(index, {row.id: matcher.hits(document_features(row.content_hash)[0])
+                                    for row in indexed})
+
+
+def main():
+    with app.app_context():
+        start = time.perf_counter()
+        tagged = tag_corpus()
+        print(f"Tagged {tagged} texts in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
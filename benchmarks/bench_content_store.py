@@ -0,0 +1,143 @@
+"""Database size and scan speed with bodies inline versus in the content store.
+
+Builds a scratch database in the old layout, with every body in the
+text.content column, from the text of the PDFs in uploads/ (or seeded
+synthetic documents), measures it, runs the content-store migration of
+upgrade_schema() and measures again:
+
+  * database file size, and the size of the content store,
+  * a listing scan (id, source, topic, is_ai, created_at of every row),
+  * an unindexed filter (count of rows of one topic),
+  * reading every body back (SELECT content before, load_content after).
+
+Scans run on a fresh connection and report the best of --repeat passes.
+--copies loads each text that many times, each copy made distinct so
+that the store cannot share its file, to see how the numbers scale.
+
+Usage: python -m benchmarks.bench_content_store [--limit N] [--copies K] [--synthetic N] [--repeat R]
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.common import upload_texts
+
+# Text as created before content moved out of the row, column order included:
+# a row's columns after a large body sit in its overflow pages
+OLD_TEXT_TABLE = '''
+CREATE TABLE text (
+    id INTEGER NOT NULL PRIMARY KEY,
+    content TEXT NOT NULL,
+    source VARCHAR(20) NOT NULL,
+    topic VARCHAR(100) NOT NULL,
+    file_path VARCHAR(255),
+    is_ai BOOLEAN,
+    acm_topic VARCHAR(100),
+    created_at DATETIME,
+    content_hash VARCHAR(64),
+    preview VARCHAR(300),
+    content_length INTEGER,
+    minhash BLOB,
+    duplicate_of INTEGER
+)
+'''
+
+
+def best_of(repeat, run):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(folder) for name in names)
+
+
+def scan_timings(database, repeat, read_bodies):
+    """Seconds of the listing scan, the unindexed filter and reading every body"""
+    def query(sql, *parameters):
+        connection = sqlite3.connect(database)
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    listing = best_of(repeat, lambda: query('SELECT id, source, topic, is_ai, created_at FROM text'))
+    filtered = best_of(repeat, lambda: query('SELECT count(*) FROM text WHERE topic = ?', 'topic-0'))
+    bodies = best_of(repeat, lambda: read_bodies(query))
+    return listing, filtered, bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, help='PDFs taken from uploads/')
+    parser.add_argument('--copies', type=int, default=1, help='times each text is loaded')
+    parser.add_argument('--synthetic', type=int, help='use N seeded synthetic documents instead of uploads/')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    database = os.path.join(scratch, 'bench.db')
+    content_folder = os.path.join(scratch, 'content')
+    os.environ.update(DATABASE_URL='sqlite:///' + database, CONTENT_FOLDER=content_folder,
+                      INDEX_FOLDER=os.path.join(scratch, 'index'))
+    try:
+        if args.synthetic:
+            from benchmarks.suite import synthetic_documents
+            texts = list(synthetic_documents(args.synthetic, 0))
+        else:
+            texts = [text for _, text in upload_texts(args.limit)]
+
+        connection = sqlite3.connect(database)
+        connection.execute(OLD_TEXT_TABLE)
+        connection.executemany('INSERT INTO text (content, source, topic, is_ai) VALUES (?, ?, ?, ?)',
+                               ((text if copy == 0 else f'{text}\n[copy {copy}]', 'benchmark',
+                                 f'topic-{i % 10}', i % 2 == 0)
+                                for copy in range(args.copies) for i, text in enumerate(texts)))
+        connection.commit()
+        connection.execute('VACUUM')
+        connection.close()
+        documents = len(texts) * args.copies
+        characters = sum(len(text) for text in texts) * args.copies
+
+        inline_size = os.path.getsize(database)
+        inline = scan_timings(database, args.repeat,
+                              lambda query: query('SELECT content FROM text'))
+
+        from app import app, db
+        from app.content_store import load_content
+        from app.schema import upgrade_schema
+
+        with app.app_context():
+            start = time.perf_counter()
+            upgrade_schema()
+            migration = time.perf_counter() - start
+            db.engine.dispose()
+
+            def read_stored(query):
+                for (content_hash,) in query('SELECT content_hash FROM text'):
+                    load_content(content_hash)
+
+            stored_size = os.path.getsize(database)
+            store_size = folder_size(content_folder)
+            stored = scan_timings(database, args.repeat, read_stored)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"{documents} documents, {characters / 1e6:.1f} M characters; migration took {migration:.2f}s\n")
+    print(f"{'':<28}{'inline':>12}{'store':>12}")
+    print(f"{'database file':<28}{inline_size / 1e6:>10.2f}MB{stored_size / 1e6:>10.2f}MB")
+    print(f"{'content store':<28}{'-':>12}{store_size / 1e6:>10.2f}MB")
+    for name, before, after in zip(('listing scan', 'unindexed filter', 'read every body'), inline, stored):
+        print(f"{name:<28}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""How MinHash near-duplicate lookup scales with the number of stored texts.
+
+Fills a throwaway SQLite database with sketches (a few hundred real
+chunks of the PDFs in uploads/ plus random filler sketches up to each
+corpus size), then times per query:
+
+  * the LSH lookup through the MinHashBand table (app.dedupe),
+  * a brute-force comparison with every stored sketch,
+
+for edited copies of stored chunks (which should be found) and for
+unrelated chunks (which should not).
+
+Usage: python -m benchmarks.bench_near_duplicates [--limit N] [--sizes 1000 10000 50000]
+       [--queries Q] [--edit-rate R]
+"""
+import os
+import tempfile
+
+# The app binds its database at import time, so point it at a scratch file first
+_scratch = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_scratch, 'bench.db')
+
+import argparse
+import random
+import shutil
+import time
+
+import numpy as np
+
+from app import app, db
+from app.dedupe import band_rows, load_sketch, minhash_sketch, shingle_hashes, stored_near_duplicates
+from app.lsh import minhash, minhash_similarity
+from app.models import MinHashBand, Text
+from benchmarks.common import upload_texts
+
+
+def edited(text, rate, rng):
+    """text with a fraction of its words replaced or dropped"""
+    words = text.split()
+    kept = []
+    for word in words:
+        roll = rng.random()
+        if roll < rate / 2:
+            continue
+        kept.append('edited' if roll < rate else word)
+    return ' '.join(kept)
+
+
+def jaccard(a, b):
+    a, b = set(shingle_hashes(a).tolist()), set(shingle_hashes(b).tolist())
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def store(entries):
+    """Bulk-insert (content, sketch) pairs as kept texts with their bands"""
+    rows = [{'content': content, 'content_hash': str(i), 'source': 'txt', 'topic': 'bench', 'is_ai': False,
+             'minhash': sketch.tobytes()} for i, (content, sketch) in enumerate(entries)]
+    ids = db.session.execute(db.insert(Text).returning(Text.id, sort_by_parameter_order=True), rows).scalars().all()
+    db.session.execute(db.insert(MinHashBand), [entry for text_id, (_, sketch) in zip(ids, entries)
+                                                 for entry in band_rows(text_id, sketch)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, default=10, help='PDFs to take real chunks from')
+    parser.add_argument('--chunk-chars', type=int, default=5000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--edit-rate', type=float, default=0.02, help='fraction of words edited in copies')
+    args = parser.parse_args()
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    threshold = app.config['NEAR_DUPLICATE_THRESHOLD']
+
+    # uploads/ holds copies of the same thesis; identical chunks would make
+    # "unrelated" queries real duplicates
+    chunks = sorted({text[i:i + args.chunk_chars]
+                     for _, text in upload_texts(args.limit)
+                     for i in range(0, len(text), args.chunk_chars)})
+    rng.shuffle(chunks)
+    n_queries = min(args.queries, len(chunks) // 3)
+    stored_chunks, unrelated = chunks[n_queries:], chunks[:n_queries]
+
+    start = time.perf_counter()
+    real = [(chunk, minhash_sketch(chunk)) for chunk in stored_chunks]
+    sketch_ms = (time.perf_counter() - start) * 1000 / len(real)
+    copies = [edited(chunk, args.edit_rate, rng) for chunk, _ in real[:n_queries]]
+    print(f"{len(real)} real chunks, {n_queries} edited copies (mean true Jaccard "
+          f"{np.mean([jaccard(copy, chunk) for copy, (chunk, _) in zip(copies, real)]):.2f}) "
+          f"and {n_queries} unrelated queries; sketching: {sketch_ms:.1f} ms/text")
+
+    queries = [(minhash_sketch(text), True) for text in copies] + [(minhash_sketch(text), False) for text in unrelated]
+    print(f"{'stored':>8}{'lsh ms':>10}{'brute ms':>10}{'recall':>9}{'false +':>9}")
+    try:
+        with app.app_context():
+            db.create_all()
+            store(real)
+            n_stored = len(real)
+            for size in sorted(args.sizes):
+                if size > n_stored:
+                    # Filler: sketches of random shingle sets, unrelated to everything
+                    filler = [('', minhash(np_rng.integers(0, 2 ** 63, 400, dtype=np.uint64)))
+                              for _ in range(size - n_stored)]
+                    store(filler)
+                    n_stored = size
+
+                start = time.perf_counter()
+                matches = [stored_near_duplicates([sketch], False, threshold)[0] for sketch, _ in queries]
+                lsh_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+                start = time.perf_counter()
+                for sketch, _ in queries:
+                    all_sketches = np.stack([load_sketch(payload) for (payload,) in
+                                             db.session.query(Text.minhash).filter(Text.is_ai.is_(False))])
+                    minhash_similarity(sketch, all_sketches).max()
+                brute_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+                found = [match is not None for match in matches]
+                recall = np.mean([f for f, (_, is_copy) in zip(found, queries) if is_copy])
+                false_positives = np.mean([f for f, (_, is_copy) in zip(found, queries) if not is_copy])
+                print(f"{n_stored:>8}{lsh_ms:>10.2f}{brute_ms:>10.2f}{recall:>9.2f}{false_positives:>9.2f}")
+    finally:
+        shutil.rmtree(_scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
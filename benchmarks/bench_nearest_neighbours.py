@@ -0,0 +1,103 @@
+"""Recall and latency of LSH top-k similarity against exact scoring.
+
+Splits the PDFs in uploads/ into fixed-size chunks, indexes all but a
+held-out set of query chunks in a temporary reference index (every
+third chunk labelled AI), then compares, per query:
+
+  * exact mean similarity over every document (today's metric),
+  * exact top-k: every document scored, the k best kept per label,
+  * LSH top-k for several band widths: recall of the exact top-k
+    documents and error of the top-k mean similarity.
+
+The index is grown in --steps increments so the table shows how each
+method's latency scales with the corpus.
+
+Usage: python -m benchmarks.bench_nearest_neighbours [--limit N] [--chunk-chars C]
+       [--queries Q] [--k K] [--band-bits 8 16 32] [--steps S]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from app.reference_index import ReferenceIndex
+from app.tokenization import tokenize_document
+from benchmarks.common import upload_texts
+
+
+def exact_top_k(index, vectors, text, k):
+    """Exact k nearest document ids and scores per label; vectors are the index's TF-IDF rows"""
+    similarities = (vectors @ index.vectorize(text).T).toarray().ravel()
+    labels = np.asarray(index.labels, dtype=bool)
+    nearest = []
+    for is_ai in (True, False):
+        rows = np.flatnonzero(labels == is_ai)
+        top = rows[np.argsort(-similarities[rows], kind='stable')[:k]]
+        nearest.append((np.asarray(index.doc_ids[top]), similarities[top]))
+    return nearest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, help='only use the first N PDFs')
+    parser.add_argument('--chunk-chars', type=int, default=3000, help='characters per reference document')
+    parser.add_argument('--queries', type=int, default=50, help='held-out chunks used as queries')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--band-bits', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--steps', type=int, default=3, help='corpus sizes measured, growing to the full set')
+    args = parser.parse_args()
+
+    chunks = [text[i:i + args.chunk_chars]
+              for _, text in upload_texts(args.limit)
+              for i in range(0, len(text), args.chunk_chars)]
+    # Spread the queries over the corpus rather than taking one document's tail
+    is_query = np.zeros(len(chunks), dtype=bool)
+    is_query[np.linspace(0, len(chunks) - 1, min(args.queries, len(chunks) // 2)).astype(int)] = True
+    queries = [tokenize_document(chunk) for chunk, q in zip(chunks, is_query) if q]
+    references = [chunk for chunk, q in zip(chunks, is_query) if not q]
+
+    print(f"{len(references)} reference documents, {len(queries)} queries, k={args.k}")
+    print(f"{'documents':>10}  {'method':<18}{'ms/query':>10}{'recall':>10}{'mean err':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        index = ReferenceIndex(folder)
+        for step in range(1, args.steps + 1):
+            # Grow the same append-only index, as production does
+            stop = len(references) * step // args.steps
+            index.add_documents((i + 1, i % 3 == 0, references[i]) for i in range(index.n_docs, stop))
+            run_step(index, queries, args)
+
+
+def timed(function, queries):
+    """Results of function per query and the mean milliseconds per query"""
+    function(queries[0])  # Warm up cached norms, signatures and mapped pages
+    start = time.perf_counter()
+    results = [function(query) for query in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def run_step(index, queries, args):
+    def report(method, ms, recall='-', error='-'):
+        recall = recall if isinstance(recall, str) else f'{recall:.3f}'
+        error = error if isinstance(error, str) else f'{error:.4f}'
+        print(f"{index.n_docs:>10}  {method:<18}{ms:>10.2f}{recall:>10}{error:>10}")
+
+    _, mean_ms = timed(lambda query: index.mean_similarities_batch([query])[0], queries)
+    report('exact mean', mean_ms)
+    vectors = index.tfidf_vectors(index.doc_ids)
+    exact, exact_ms = timed(lambda query: exact_top_k(index, vectors, query, args.k), queries)
+    report('exact top-k', exact_ms, 1.0, 0.0)
+
+    for band_bits in args.band_bits:
+        approximate, lsh_ms = timed(lambda query: index.nearest_documents([query], args.k, band_bits)[0], queries)
+        recalls = []
+        errors = []
+        for exact_nearest, approximate_nearest in zip(exact, approximate):
+            for (exact_ids, exact_scores), (ids, scores) in zip(exact_nearest, approximate_nearest):
+                if len(exact_ids):
+                    recalls.append(len(np.intersect1d(exact_ids, ids)) / len(exact_ids))
+                    errors.append(exact_scores.mean() - (scores.mean() if len(scores) else 0.0))
+        report(f'lsh {band_bits}-bit bands', lsh_ms, np.mean(recalls), np.mean(errors))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Pages per second of PDF extraction over uploads/ at different worker counts.
+
+Usage: python -m benchmarks.bench_pdf_extraction [--workers 1 2 4 8] [--limit N]
+"""
+import argparse
+import os
+import time
+
+import PyPDF2
+
+from app.pdf_extractor import iter_pdf_pages
+from benchmarks.common import upload_pdfs
+
+
+def count_pages(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += len(PyPDF2.PdfReader(path).pages)
+        except Exception:
+            pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--limit', type=int, help='only use the first N PDFs')
+    args = parser.parse_args()
+
+    paths = upload_pdfs(args.limit)
+    pages = count_pages(paths)
+    print(f"{len(paths)} PDFs, {pages} pages")
+
+    for workers in sorted(set(args.workers)):
+        # Warm the pool up so process start-up is not counted as extraction time
+        for _ in iter_pdf_pages(paths[0], workers=workers):
+            pass
+
+        start = time.perf_counter()
+        for path in paths:
+            try:
+                for _ in iter_pdf_pages(path, workers=workers):
+                    pass
+            except Exception as e:
+                print(f"  skipped {os.path.basename(path)}: {e}")
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers:<3} {elapsed:8.1f}s {pages / elapsed:8.1f} pages/s")
+
+
+if __name__ == '__main__':
+    main()
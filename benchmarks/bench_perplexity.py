@@ -0,0 +1,54 @@
+"""Load time and scoring throughput of the hashed n-gram language model.
+
+Trains a model on the PDFs in uploads/, saves it to a temporary folder,
+then times loading it and scoring every document with it.
+
+Usage: python -m benchmarks.bench_perplexity [--limit N] [--order K]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from app.language_model import NgramLanguageModel, save_language_model, train_language_model
+from app.tokenization import tokenize_document
+from benchmarks.common import upload_texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, help='only use the first N PDFs')
+    parser.add_argument('--order', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=5, help='scoring passes over the corpus')
+    args = parser.parse_args()
+
+    token_hash_arrays = [tokenize_document(text).token_hashes for _, text in upload_texts(args.limit)]
+    n_tokens = sum(len(h) for h in token_hash_arrays)
+    print(f"{len(token_hash_arrays)} documents, {n_tokens} tokens")
+
+    start = time.perf_counter()
+    tables, meta = train_language_model(token_hash_arrays, order=args.order)
+    print(f"train: {time.perf_counter() - start:.2f}s, "
+          f"{sum(len(t) for name, t in tables.items() if name.endswith('keys'))} table entries")
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = save_language_model(folder, tables, meta)
+
+        start = time.perf_counter()
+        model = NgramLanguageModel.load(path)
+        print(f"load: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        # Touch the mapped tables once so the timing measures scoring, not page faults
+        model.token_log_probs(np.concatenate(token_hash_arrays))
+
+        start = time.process_time()
+        for _ in range(args.repeat):
+            for token_hashes in token_hash_arrays:
+                model.perplexity(token_hashes)
+        elapsed = time.process_time() - start
+        print(f"score: {n_tokens * args.repeat / elapsed / 1e6:.2f} M tokens/s (one core)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Time from a cold interpreter to the first served request, against a budget.
+
+Each run starts a fresh Python process that imports the app, as a
+gunicorn worker would, and serves / once through the test client
+against a scratch database. The median over --runs must stay under
+--budget seconds, or the script exits non-zero. It also prints the
+slowest imports (python -X importtime) so a new heavy top-level import
+is easy to spot.
+
+Usage: python -m benchmarks.bench_startup [--runs N] [--budget SECONDS] [--top K]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import basedir
+
+WORKER = '''
+import time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+response = app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+print(imported - start, time.perf_counter() - imported)
+'''
+
+SETUP = '''
+from app import app, db
+with app.app_context():
+    db.create_all()
+'''
+
+
+def slowest_imports(environment, top):
+    """(cumulative microseconds, module) of the slowest imports of the app"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=basedir,
+                            env=environment, capture_output=True, text=True, check=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), module.rstrip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds allowed for the median run')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports listed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        environment = dict(os.environ,
+                           DATABASE_URL='sqlite:///' + os.path.join(scratch, 'startup.db'),
+                           INDEX_FOLDER=os.path.join(scratch, 'index'),
+                           PYTHONPATH=basedir)
+        subprocess.run([sys.executable, '-c', SETUP], cwd=basedir, env=environment, check=True)
+
+        totals, imports, requests = [], [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, '-c', WORKER], cwd=basedir, env=environment,
+                                    capture_output=True, text=True, check=True)
+            totals.append(time.perf_counter() - start)
+            import_seconds, request_seconds = map(float, result.stdout.split())
+            imports.append(import_seconds)
+            requests.append(request_seconds)
+
+        print(f"{'':<22}{'median':>10}{'max':>10}")
+        for name, values in (('process total', totals), ('import app', imports), ('first GET /', requests)):
+            print(f"{name:<22}{statistics.median(values):>9.3f}s{max(values):>9.3f}s")
+
+        print("\nSlowest imports (cumulative):")
+        for microseconds, module in slowest_imports(environment, args.top):
+            print(f"{microseconds / 1000:>10.1f} ms  {module}")
+
+    median = statistics.median(totals)
+    if median > args.budget:
+        print(f"\nOver budget: {median:.3f}s > {args.budget:.3f}s")
+        sys.exit(1)
+    print(f"\nWithin budget: {median:.3f}s <= {args.budget:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
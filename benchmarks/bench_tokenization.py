@@ -0,0 +1,59 @@
+"""Per-document CPU cost of tokenization: separate passes vs the shared pipeline.
+
+Usage: python -m benchmarks.bench_tokenization [--limit N]
+"""
+import argparse
+import time
+
+from nltk.tokenize import sent_tokenize, word_tokenize
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from app.tokenization import TokenizedDocument
+from benchmarks.common import upload_texts
+
+
+def separate_passes(text, analyzer):
+    """What the metrics did before: three independent tokenizations"""
+    word_tokenize(text.lower())
+    [len(word_tokenize(sentence)) for sentence in sent_tokenize(text)]
+    analyzer(text)
+
+
+def shared_pass(text):
+    document = TokenizedDocument(text)
+    document.term_counts
+
+
+def cpu_time(func, *args):
+    start = time.process_time()
+    func(*args)
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--limit', type=int, help='only use the first N PDFs')
+    args = parser.parse_args()
+
+    analyzer = TfidfVectorizer().build_analyzer()
+    total_before = total_after = 0.0
+    count = 0
+
+    print(f"{'document':<60} {'chars':>9} {'before ms':>10} {'after ms':>10} {'saving':>7}")
+    for name, text in upload_texts(args.limit):
+        before = cpu_time(separate_passes, text, analyzer)
+        after = cpu_time(shared_pass, text)
+        total_before += before
+        total_after += after
+        count += 1
+        saving = 1 - after / before if before else 0.0
+        print(f"{name[:60]:<60} {len(text):>9} {before * 1000:>10.1f} {after * 1000:>10.1f} {saving:>7.0%}")
+
+    if count:
+        print(f"\n{count} documents: {total_before / count * 1000:.1f} ms -> "
+              f"{total_after / count * 1000:.1f} ms per document "
+              f"({1 - total_after / total_before:.0%} less CPU)")
+
+
+if __name__ == '__main__':
+    main()
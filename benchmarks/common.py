@@ -0,0 +1,21 @@
+import glob
+import os
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
+
+
+def upload_pdfs(limit=None):
+    """Paths of the PDFs in uploads/, in a stable order"""
+    paths = sorted(glob.glob(os.path.join(UPLOAD_FOLDER, '*.pdf')))
+    return paths[:limit] if limit else paths
+
+
+def upload_texts(limit=None):
+    """Yield (name, text) for every PDF in uploads/ that extracts to text"""
+    from app.pdf_extractor import extract_text_from_pdf
+
+    for path in upload_pdfs(limit):
+        text = extract_text_from_pdf(path)
+        if text:
+            yield os.path.basename(path), text
@@ -0,0 +1,189 @@
+"""Concurrency stress test: many parallel detect and upload clients.
+
+Starts --servers app processes on a scratch database (each one a
+separate process with its own connection pool, like gunicorn workers)
+or targets a running instance with --url, then runs --clients threads
+that each loop over POST /detect, POST /upload_human and GET / for
+--seconds. Every upload is a fresh random text so none is rejected as
+a near-duplicate.
+
+Reports throughput and latency percentiles per endpoint. Exits non-zero
+if any request failed: a 5xx, a connection error or a "database is
+locked" page.
+
+Usage: python -m benchmarks.stress_concurrency [--servers 4] [--clients 16] [--seconds 30]
+       [--async-analysis] [--url http://127.0.0.1:5000]
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from benchmarks.common import basedir
+
+BASE_PORT = 5850
+
+SERVER = '''
+import sys
+from werkzeug.serving import run_simple
+from app import app
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+'''
+
+SETUP = '''
+from app import app
+from app.routes import initialize_app
+from app.schema import upgrade_schema
+with app.app_context():
+    upgrade_schema()
+initialize_app()
+'''
+
+WORDS = ('analysis model data system network learning design method result process language '
+         'structure theory computer memory query index storage protocol signal layer graph '
+         'sample measure error value function program security user interface evaluation').split()
+
+
+def random_text(rng, sentences=12):
+    return ' '.join(' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + '.'
+                    for _ in range(sentences))
+
+
+def request(url, data=None):
+    """(status, body) of a GET, or of a form POST when data is given"""
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    try:
+        with urllib.request.urlopen(url, data=body, timeout=120) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Count the POST itself; following the redirect would also time the results page
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def client(urls, deadline, seed, samples, failures, lock):
+    rng = random.Random(seed)
+    operations = [
+        ('POST /detect', '/detect', lambda: {'text': random_text(rng)}),
+        ('POST /upload_human', '/upload_human', lambda: {'text': random_text(rng)}),
+        ('GET /', '/', None),
+    ]
+    while time.perf_counter() < deadline:
+        name, path, make_data = rng.choice(operations)
+        url = rng.choice(urls) + path
+        start = time.perf_counter()
+        try:
+            status, body = request(url, make_data() if make_data else None)
+            failed = status >= 500 or b'database is locked' in body
+            reason = f'HTTP {status}' if status >= 500 else 'database is locked'
+        except Exception as e:
+            failed, reason = True, f'{type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[name].append(elapsed)
+            if failed:
+                failures[name].append(reason)
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            request(url + '/metrics')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'{url} did not come up')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=4, help='app processes to start')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client threads')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--async-analysis', action='store_true',
+                        help='queue /detect analyses instead of running them inline')
+    parser.add_argument('--url', help='test a running instance instead of starting servers')
+    args = parser.parse_args()
+
+    urllib.request.install_opener(urllib.request.build_opener(NoRedirect))
+    servers = []
+    scratch = tempfile.TemporaryDirectory()
+    try:
+        if args.url:
+            urls = [args.url.rstrip('/')]
+        else:
+            environment = dict(os.environ,
+                               PYTHONPATH=basedir,
+                               DATABASE_URL='sqlite:///' + os.path.join(scratch.name, 'stress.db'),
+                               INDEX_FOLDER=os.path.join(scratch.name, 'index'),
+                               CONTENT_FOLDER=os.path.join(scratch.name, 'content'),
+                               LANGUAGE_MODEL_FOLDER=os.path.join(scratch.name, 'ngram'),
+                               ANALYSIS_ASYNC='1' if args.async_analysis else '0')
+            subprocess.run([sys.executable, '-c', SETUP], cwd=basedir, env=environment, check=True)
+            urls = []
+            for i in range(args.servers):
+                port = BASE_PORT + i
+                servers.append(subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=basedir,
+                                                env=environment, stdout=subprocess.DEVNULL,
+                                                stderr=subprocess.DEVNULL))
+                urls.append(f'http://127.0.0.1:{port}')
+            for url in urls:
+                wait_until_up(url)
+
+        samples, failures = defaultdict(list), defaultdict(list)
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=client, args=(urls, deadline, seed, samples, failures, lock))
+                   for seed in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.wait()
+        scratch.cleanup()
+
+    print(f"{len(urls)} server(s), {args.clients} clients, {elapsed:.1f}s")
+    print(f"{'endpoint':<22}{'requests':>10}{'req/s':>8}{'failed':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name in sorted(samples):
+        values = samples[name]
+        print(f"{name:<22}{len(values):>10}{len(values) / elapsed:>8.1f}{len(failures[name]):>8}"
+              f"{statistics.median(values) * 1000:>9.0f}{percentile(values, 0.95) * 1000:>9.0f}"
+              f"{percentile(values, 0.99) * 1000:>9.0f}")
+
+    reasons = defaultdict(int)
+    for name in failures:
+        for reason in failures[name]:
+            reasons[reason] += 1
+    if reasons:
+        for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+            print(f"  {count} x {reason}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
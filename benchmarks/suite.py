@@ -0,0 +1,320 @@
+"""Reproducible benchmark suite for the analysis hot paths.
+
+Corpora:
+
+  * synthetic-N: N seeded documents of permuted template sentences from
+    app.ai_generator.generate_documents, alternately labelled AI and human,
+  * uploads: the text of the PDFs in uploads/.
+
+Each corpus is loaded into its own scratch database and reference index,
+then every case runs in a fresh process so its peak RSS is its own:
+
+  * calculate_perplexity / calculate_burstiness over a sample of the corpus,
+  * compare_with_documents of a few queries against the whole corpus,
+  * comprehensive_text_analysis of the queries (feature cache cleared
+    before every pass),
+  * PDF extraction of uploads/ (uploads corpus only),
+
+plus the time to build the corpus' reference index. Every case reports
+its best of --repeat passes as items/s and MB/s of input text, and its
+peak RSS. Results are written as JSON; compare two result files to flag
+throughput drops and memory growth beyond a tolerance.
+
+No language model is trained, so perplexity is the self-perplexity
+fallback.
+
+Usage:
+    python -m benchmarks.suite run [--sizes 100 1000 10000 100000] [--no-uploads]
+                                   [--limit N] [--repeat R] [--output results.json]
+    python -m benchmarks.suite compare baseline.json results.json [--tolerance 0.1]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.common import basedir, upload_pdfs
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+TOPICS = ['Artificial Intelligence', 'Computer Systems', 'Networks', 'Software Engineering',
+          'Theory of Computation', 'Human-Computer Interaction']
+CASES = ['calculate_perplexity', 'calculate_burstiness', 'compare_with_documents', 'comprehensive_text_analysis']
+INSERT_BATCH_SIZE = 1000
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_documents(n, seed):
+    """n reproducible documents of 8-24 template sentences each, topics taking turns"""
+    from app.ai_generator import generate_documents
+
+    documents = generate_documents(-(-n // len(TOPICS)), min_sentences=8, max_sentences=24, seed=seed)
+    for _, (_, text) in zip(range(n), documents):
+        yield text
+
+
+def corpus_environment(scratch, corpus):
+    """Environment pointing the app at the corpus' scratch database and index"""
+    folder = os.path.join(scratch, corpus)
+    return {
+        'DATABASE_URL': 'sqlite:///' + os.path.join(folder, 'bench.db'),
+        'INDEX_FOLDER': os.path.join(folder, 'index'),
+        'CONTENT_FOLDER': os.path.join(folder, 'content'),
+        'LANGUAGE_MODEL_FOLDER': os.path.join(folder, 'ngram'),
+        'SCORE_MODEL_FOLDER': os.path.join(folder, 'score'),
+        'ANALYSIS_ASYNC': '0',
+    }
+
+
+def in_fresh_process(environment, function, *args):
+    """Run function in a new process that sees environment"""
+    os.environ.update(environment)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def timed_passes(repeat, run):
+    """Best wall time of repeat calls of run(pass_number)"""
+    best = float('inf')
+    for number in range(repeat):
+        start = time.perf_counter()
+        run(number)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def case_result(seconds, items, n_bytes, rss_before):
+    return {
+        'seconds': seconds,
+        'items': items,
+        'items_per_second': items / seconds if seconds else 0.0,
+        'mb_per_second': n_bytes / seconds / 1e6 if seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - rss_before,
+    }
+
+
+def build_corpus(corpus, size, seed, limit):
+    """Load a corpus into the scratch database and index it (runs in its own process)"""
+    from app import app, db
+    from app.content_store import store_content
+    from app.models import Text, content_fields
+    from app.reference_index import update_reference_index
+
+    if corpus == 'uploads':
+        from benchmarks.common import upload_texts
+        texts = (text for _, text in upload_texts(limit))
+    else:
+        texts = synthetic_documents(size, seed)
+
+    with app.app_context():
+        db.create_all()
+        count = n_bytes = 0
+        batch = []
+        for text in texts:
+            fields = content_fields(text)
+            store_content(fields['content_hash'], text)
+            batch.append(dict(fields, source='benchmark', topic=corpus, is_ai=count % 2 == 0))
+            count += 1
+            n_bytes += len(text.encode('utf-8'))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                db.session.execute(db.insert(Text), batch)
+                batch = []
+        if batch:
+            db.session.execute(db.insert(Text), batch)
+        db.session.commit()
+
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        update_reference_index()
+        return count, case_result(time.perf_counter() - start, count, n_bytes, rss_before)
+
+
+def run_case(corpus, case, options):
+    """Time one case against a built corpus (runs in its own process)"""
+    from types import SimpleNamespace
+
+    from app import app, db
+    from app.content_store import load_content
+    from app.models import FeatureCache, Text
+    from app.text_analyzer import (calculate_burstiness, calculate_perplexity, compare_with_documents,
+                                   comprehensive_text_analysis)
+
+    with app.app_context():
+        if corpus == 'uploads':
+            queries = [load_content(h) for (h,) in db.session.query(Text.content_hash).order_by(Text.id)
+                       .limit(options['queries'])]
+        else:
+            queries = list(synthetic_documents(options['queries'], options['seed'] + 1))
+
+        if case in ('calculate_perplexity', 'calculate_burstiness'):
+            texts = [load_content(h) for (h,) in db.session.query(Text.content_hash).order_by(Text.id)
+                     .limit(options['sample'])]
+            function = calculate_perplexity if case == 'calculate_perplexity' else calculate_burstiness
+
+            def run(number):
+                for text in texts:
+                    function(text)
+        elif case == 'compare_with_documents':
+            texts = queries[:options['compare_queries']]
+            documents = [SimpleNamespace(content=load_content(h)) for (h,) in db.session.query(Text.content_hash)]
+
+            def run(number):
+                for text in texts:
+                    compare_with_documents(text, documents)
+        else:
+            texts = queries
+            comprehensive_text_analysis(next(synthetic_documents(1, options['seed'] + 2)))  # Load the index
+
+            def run(number):
+                # Measure the analysis, not feature cache hits from the previous pass
+                FeatureCache.query.delete()
+                db.session.commit()
+                for text in texts:
+                    comprehensive_text_analysis(text)
+
+        n_bytes = sum(len(text.encode('utf-8')) for text in texts)
+        rss_before = peak_rss_mb()
+        return case_result(timed_passes(options['repeat'], run), len(texts), n_bytes, rss_before)
+
+
+def run_pdf_extraction(limit, repeat):
+    """Time text extraction of the PDFs in uploads/ (runs in its own process)"""
+    from app.pdf_extractor import extract_text_from_pdf
+
+    paths = upload_pdfs(limit)
+    n_bytes = sum(os.path.getsize(path) for path in paths)
+    rss_before = peak_rss_mb()
+
+    def run(number):
+        for path in paths:
+            extract_text_from_pdf(path)
+
+    return case_result(timed_passes(repeat, run), len(paths), n_bytes, rss_before)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=basedir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    corpora = [(f'synthetic-{size}', size) for size in args.sizes]
+    if args.uploads:
+        corpora.append(('uploads', None))
+    options = {'queries': args.queries, 'compare_queries': args.compare_queries, 'sample': args.sample,
+               'seed': args.seed, 'repeat': args.repeat}
+
+    results = {}
+
+    def report(key, result):
+        results[key] = result
+        print(f"{key:<48}{result['items_per_second']:>12.2f}{result['mb_per_second']:>10.3f}"
+              f"{result['peak_rss_mb']:>10.1f}", flush=True)
+
+    print(f"{'case':<48}{'items/s':>12}{'MB/s':>10}{'peak MB':>10}")
+    scratch = tempfile.mkdtemp()
+    environment = dict(os.environ)
+    try:
+        for corpus, size in corpora:
+            corpus_env = corpus_environment(scratch, corpus)
+            os.makedirs(os.path.dirname(corpus_env['DATABASE_URL'][len('sqlite:///'):]))
+            count, result = in_fresh_process(corpus_env, build_corpus, corpus, size, args.seed, args.limit)
+            report(f'{corpus}/index_build', dict(result, documents=count))
+            for case in CASES:
+                report(f'{corpus}/{case}', in_fresh_process(corpus_env, run_case, corpus, case, options))
+            if corpus == 'uploads':
+                report(f'{corpus}/pdf_extraction', in_fresh_process(corpus_env, run_pdf_extraction,
+                                                                    args.limit, args.repeat))
+    finally:
+        os.environ.clear()
+        os.environ.update(environment)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'options': dict(options, sizes=args.sizes, uploads=args.uploads, limit=args.limit),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+
+def compare_results(baseline, current, tolerance):
+    """Print both runs side by side; returns the keys that regressed"""
+    regressions = []
+    print(f"{'case':<48}{'items/s':>12}{'change':>9}{'peak MB':>10}{'change':>9}")
+    for key in sorted(set(baseline['results']) & set(current['results'])):
+        old, new = baseline['results'][key], current['results'][key]
+        speed = new['items_per_second'] / old['items_per_second'] - 1 if old['items_per_second'] else 0.0
+        memory = new['peak_rss_mb'] / old['peak_rss_mb'] - 1 if old['peak_rss_mb'] else 0.0
+        regressed = speed < -tolerance or memory > tolerance
+        if regressed:
+            regressions.append(key)
+        print(f"{key:<48}{new['items_per_second']:>12.2f}{speed:>+9.1%}{new['peak_rss_mb']:>10.1f}"
+              f"{memory:>+9.1%}{'  REGRESSION' if regressed else ''}")
+    for key in sorted(set(baseline['results']) ^ set(current['results'])):
+        print(f"{key:<48}  only in {'baseline' if key in baseline['results'] else 'current run'}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the suite and write the results as JSON')
+    run.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES, help='synthetic corpus sizes')
+    run.add_argument('--no-uploads', dest='uploads', action='store_false', help='skip the uploads/ corpus')
+    run.add_argument('--limit', type=int, default=10, help='PDFs taken from uploads/')
+    run.add_argument('--queries', type=int, default=20, help='texts analysed per comprehensive pass')
+    run.add_argument('--compare-queries', type=int, default=3, help='texts per compare_with_documents pass')
+    run.add_argument('--sample', type=int, default=1000, help='corpus texts per perplexity/burstiness pass')
+    run.add_argument('--repeat', type=int, default=3, help='passes per case; the best one counts')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', default='benchmark-results.json')
+
+    compare = commands.add_parser('compare', help='flag regressions between two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=0.1,
+                         help='allowed relative throughput drop or peak memory growth')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_suite(args)
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,81 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite file settings applied to every new connection (see app.storage):
+    # WAL lets readers run alongside the single writer, and writers wait up
+    # to SQLITE_BUSY_TIMEOUT ms for the lock instead of failing at once
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')  # Durable with WAL, fewer fsyncs
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 30000))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384))  # Page cache per connection
+    # Connections per process: DATABASE_POOL_SIZE kept open plus up to
+    # DATABASE_MAX_OVERFLOW more under load; beyond that a request waits
+    # DATABASE_POOL_TIMEOUT seconds for one to be returned
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI in ('sqlite://', 'sqlite:///:memory:') else {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+    }
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
+    # Compressed text bodies, one file per content hash (see app.content_store)
+    CONTENT_FOLDER = os.environ.get('CONTENT_FOLDER') or os.path.join(basedir, 'content')
+    INDEX_FOLDER = os.environ.get('INDEX_FOLDER') or os.path.join(basedir, 'index')  # TF-IDF reference index
+    # Ceiling on the working set while the reference set is scored block by block
+    SIMILARITY_MEMORY_LIMIT = int(os.environ.get('SIMILARITY_MEMORY_LIMIT', 64 * 1024 * 1024))
+    # 'mean' averages over every reference document; 'top_k' averages over the
+    # k nearest ones per label, found through the index's LSH buckets
+    SIMILARITY_MODE = os.environ.get('SIMILARITY_MODE', 'mean')
+    SIMILARITY_TOP_K = int(os.environ.get('SIMILARITY_TOP_K', 10))
+    SIMILARITY_LSH_BAND_BITS = 16  # Bits per LSH band (fewer bits: more candidates, higher recall)
+    # Compare a text that has an ACM topic (see app.topics) only with references
+    # of the same topic, unless the topic has too few texts of either label
+    SIMILARITY_SAME_TOPIC = os.environ.get('SIMILARITY_SAME_TOPIC', '1') != '0'
+    SIMILARITY_TOPIC_MIN_REFERENCES = int(os.environ.get('SIMILARITY_TOPIC_MIN_REFERENCES', 5))
+    # Reference uploads whose estimated shingle Jaccard similarity with a stored
+    # text of the same label reaches the threshold are near-duplicates:
+    # 'collapse' rejects them, 'flag' stores them but keeps them out of the
+    # reference index and language model
+    NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.8))
+    NEAR_DUPLICATE_ACTION = os.environ.get('NEAR_DUPLICATE_ACTION', 'collapse')
+    # Tokenizer data (punkt) looked up here before NLTK's default locations;
+    # fill it with python -m app.nltk_setup
+    NLTK_DATA_FOLDER = os.environ.get('NLTK_DATA_FOLDER') or os.path.join(basedir, 'nltk_data')
+    LANGUAGE_MODEL_FOLDER = os.environ.get('LANGUAGE_MODEL_FOLDER') or os.path.join(basedir, 'models', 'ngram')
+    LANGUAGE_MODEL_ORDER = 2
+    # Versions of the calibrated overall AI score, trained with python -m app.scoring train
+    SCORE_MODEL_FOLDER = os.environ.get('SCORE_MODEL_FOLDER') or os.path.join(basedir, 'models', 'score')
+    # Bounds of the content-hash feature cache, evicted least recently used first
+    FEATURE_CACHE_MAX_ENTRIES = int(os.environ.get('FEATURE_CACHE_MAX_ENTRIES', 10000))
+    FEATURE_CACHE_MAX_BYTES = int(os.environ.get('FEATURE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    # In-process cache of rendered result pages and fragments (see app.http_cache)
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # Per-section scores: windows of N sentences every STRIDE sentences; texts
+    # longer than ANALYSIS_STREAMING_MIN_CHARS are split and scored window by
+    # window instead of being tokenized whole
+    ANALYSIS_WINDOW_SENTENCES = int(os.environ.get('ANALYSIS_WINDOW_SENTENCES', 40))
+    ANALYSIS_WINDOW_STRIDE = int(os.environ.get('ANALYSIS_WINDOW_STRIDE', 40))
+    ANALYSIS_STREAMING_MIN_CHARS = int(os.environ.get('ANALYSIS_STREAMING_MIN_CHARS', 200000))
+    # Background analysis queue for /detect (set ANALYSIS_ASYNC=0 to analyse inline)
+    ANALYSIS_ASYNC = os.environ.get('ANALYSIS_ASYNC', '1') != '0'
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+    ANALYSIS_JOB_TIMEOUT = 30 * 60  # Seconds before a running job is considered abandoned
+    ANALYSIS_MAX_ATTEMPTS = 3
+    ANALYSIS_POLL_INTERVAL = 1.0  # Seconds between queue polls when idle
+    # Parallel PDF extraction: worker processes, per-page timeout in seconds
+    # (0 for none), and the page count below which a PDF is extracted
+    # in-process when there is no timeout to enforce
+    PDF_WORKERS = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))
+    PDF_PAGE_TIMEOUT = 30
+    PDF_PARALLEL_MIN_PAGES = 8
+    # Opt-in cProfile dump of every analysis, written to PROFILE_FOLDER and
+    # linked from its AnalysisResult
+    PROFILE_ANALYSIS = os.environ.get('PROFILE_ANALYSIS', '0') != '0'
+    PROFILE_FOLDER = os.environ.get('PROFILE_FOLDER') or os.path.join(basedir, 'profiles')
+    # Shared by every serving process (e.g. gunicorn workers) so /metrics
+    # reports all of them; unset, each process reports only its own stages
+    METRICS_FOLDER = os.environ.get('METRICS_FOLDER')
+    LIST_PAGE_SIZE = 50  # Documents per page of the document and analysis lists
+    BATCH_MAX_DOCUMENTS = 1000  # Per call to /api/detect_batch
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     SECRET_KEY = 'dummy-secret-key-for-session-management'  # Add this line
\ No newline at end of file
@@ -1,5 +1,6 @@
 from app import app, db
 from app.routes import initialize_app
+from app.schema import upgrade_schema
 import os
 
 # Ensure upload directory exists
@@ -7,7 +8,7 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize database and app
 with app.app_context():
-    db.create_all()
+    upgrade_schema()
     initialize_app()
     print("Database initialized and app configured")
 
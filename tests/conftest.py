@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+
+# The app reads its configuration at import, so the scratch folders are
+# set before anything imports it
+_folder = tempfile.mkdtemp()
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_folder, 'test.db'),
+    'CONTENT_FOLDER': os.path.join(_folder, 'content'),
+    'INDEX_FOLDER': os.path.join(_folder, 'index'),
+    'LANGUAGE_MODEL_FOLDER': os.path.join(_folder, 'ngram'),
+    'SCORE_MODEL_FOLDER': os.path.join(_folder, 'score'),
+    'ANALYSIS_ASYNC': '0',
+})
+
+import pytest
+
+from app import app, db
+from app import http_cache, topics
+from app.ai_generator import initialize_acm_topics
+from app.reference_index import get_reference_index
+
+app.config['UPLOAD_FOLDER'] = os.path.join(_folder, 'uploads')
+
+
+@pytest.fixture
+def context():
+    """An app context over an empty database, index, content store and model folders"""
+    with app.app_context():
+        db.drop_all()
+        for name in ('CONTENT_FOLDER', 'LANGUAGE_MODEL_FOLDER', 'SCORE_MODEL_FOLDER', 'UPLOAD_FOLDER'):
+            shutil.rmtree(app.config[name], ignore_errors=True)
+        db.create_all()
+        get_reference_index().clear()
+        # Process-wide caches keyed by versions an empty database repeats
+        topics._centroids = None
+        http_cache._cache = None
+        initialize_acm_topics()
+        yield
+        db.session.remove()
@@ -0,0 +1,33 @@
+import io
+import os
+
+from app import app
+from app import routes
+
+
+def test_oversized_batch_is_rejected_before_any_pdf_is_read(context, monkeypatch):
+    monkeypatch.setitem(app.config, 'BATCH_MAX_DOCUMENTS', 2)
+    extracted = []
+    monkeypatch.setattr(routes, 'extract_upload', lambda file: extracted.append(file) or (None, 'text'))
+
+    response = app.test_client().post('/api/detect_batch', data={
+        'texts': ['one text'],
+        'files': [(io.BytesIO(b'%PDF-1.4'), 'a.pdf'), (io.BytesIO(b'%PDF-1.4'), 'b.pdf')],
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 413
+    assert extracted == []
+    folder = app.config['UPLOAD_FOLDER']
+    assert not os.path.isdir(folder) or not os.listdir(folder)
+
+
+def test_batch_limits_json_lists_too(context, monkeypatch):
+    monkeypatch.setitem(app.config, 'BATCH_MAX_DOCUMENTS', 2)
+    client = app.test_client()
+    assert client.post('/api/detect_batch', json={'texts': ['a', 'b', 'c']}).status_code == 413
+    assert client.post('/api/detect_batch', json={'texts': []}).status_code == 400
+
+    response = client.post('/api/detect_batch', json={'texts': ['Short text to score. It has two sentences.', '']})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert 'results' in results[0] and results[1]['error'] == 'Empty text'
@@ -0,0 +1,42 @@
+from app import db
+from app.corpus_stats import corpus_stats, rebuild_corpus_stats, record_texts
+from app.models import AnalysisResult, Text
+
+
+def counters():
+    return {key: count for key, count in corpus_stats().items() if count}
+
+
+def test_counters_follow_inserts_updates_and_deletes(context):
+    texts = [Text(content=f'Text number {i}.', source=source, topic='x', is_ai=is_ai, acm_topic=topic)
+             for i, (source, is_ai, topic) in enumerate([('pdf', False, 'Networks'), ('generated', True, 'Networks'),
+                                                          ('manual', False, None), ('pdf', True, 'Security')])]
+    db.session.add_all(texts)
+    db.session.flush()
+    db.session.add_all([AnalysisResult(text_id=texts[0].id, ai_proportion=0.15, overall_score=0.95),
+                        AnalysisResult(text_id=texts[1].id, ai_proportion=0.85, overall_score=None)])
+    db.session.commit()
+    # Bulk inserts bypass the mapper events and are counted by record_texts
+    rows = [dict(source='pdf', topic='x', is_ai=False, acm_topic='Networks', content_hash='0' * 64)]
+    db.session.execute(db.insert(Text), rows)
+    record_texts(rows)
+    db.session.commit()
+
+    assert counters()['texts:ai'] == 2 and counters()['texts:human'] == 3
+    assert counters()['ai_proportion:1'] == counters()['ai_score:9'] == 1
+
+    texts[2].is_ai = True
+    texts[3].acm_topic = 'Networks'
+    texts[0].analysis.overall_score = 0.05
+    db.session.commit()
+    db.session.delete(texts[1].analysis)
+    db.session.delete(texts[1])
+    db.session.commit()
+
+    incremental = counters()
+    rebuild_corpus_stats()
+    assert incremental == counters()
+    assert incremental['texts:ai'] == 2 and incremental['texts:human'] == 2
+    assert incremental['analyses'] == 1 and 'ai_proportion:8' not in incremental
+    assert incremental['ai_score:0'] == 1 and 'ai_score:9' not in incremental
+    assert incremental['acm_topic:Networks'] == 3 and 'acm_topic:Security' not in incremental
@@ -0,0 +1,47 @@
+from app import app, db
+from app.ai_generator import bulk_generate
+from app.dedupe import add_reference_text, dedupe_database
+from app.models import AnalysisJob, MinHashBand, Text
+from app.reference_index import get_reference_index, update_reference_index
+
+REFERENCE = ('Sparse matrix products dominate the cost of comparing a document with every stored reference, '
+             'so the index keeps its rows in compressed form and scores them a block at a time. ')
+
+
+def test_generated_texts_survive_dedupe(context):
+    client = app.test_client()
+    for _ in range(12):
+        client.post('/generate_ai', data={'topic': 'Networks'})
+    bulk_generate(20, seed=1)
+    update_reference_index()
+    generated = Text.query.filter_by(source='generated').count()
+
+    stats = dedupe_database(app.config['NEAR_DUPLICATE_THRESHOLD'])
+
+    assert stats['duplicates'] == 0
+    assert Text.query.filter(Text.duplicate_of.isnot(None)).count() == 0
+    assert MinHashBand.query.count() == 0
+    assert len(get_reference_index().doc_ids) == generated == 12 + 20 * 6
+
+
+def test_detect_texts_are_never_kept_references(context):
+    submitted = Text(content=REFERENCE * 3, source='manual', topic='Manual Input for Detection')
+    db.session.add(submitted)
+    db.session.flush()
+    db.session.add(AnalysisJob(text_id=submitted.id, status='done'))
+    uploaded = Text(content=REFERENCE * 3 + 'A closing remark.', source='pdf', topic='x')
+    db.session.add(uploaded)
+    db.session.commit()
+    copy = Text(content=REFERENCE * 3 + 'Another closing remark.', source='pdf', topic='x')
+    db.session.add(copy)
+    db.session.commit()
+
+    stats = dedupe_database(app.config['NEAR_DUPLICATE_THRESHOLD'])
+
+    assert stats['texts'] == 2
+    assert db.session.get(Text, submitted.id).duplicate_of is None
+    assert db.session.get(Text, uploaded.id).duplicate_of is None
+    assert db.session.get(Text, copy.id).duplicate_of == uploaded.id
+    assert {band.text_id for band in MinHashBand.query} == {uploaded.id}
+    # Later uploads are still checked against the kept reference only
+    assert add_reference_text(Text(content=REFERENCE * 3, source='pdf', topic='x'))[0] == uploaded.id
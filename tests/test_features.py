@@ -0,0 +1,77 @@
+import os
+
+from app import app, db
+from app.content_store import FEATURES_SUFFIX, content_path
+from app.dedupe import add_reference_text
+from app import tokenization
+from app.feature_cache import cached_document, decode_features, document_features, load_features
+from app.ingest import ingest
+from app.models import Text
+from app.reference_index import update_reference_index
+from app.tokenization import TokenizedDocument
+
+CONTENT = ('Caches keyed by content hashes let a repeated upload skip the work done the first time. '
+           'Every later stage reads the same tokens back instead of splitting the text again. ') * 5
+
+
+def count_tokenizations(monkeypatch):
+    calls = []
+    init = TokenizedDocument.__init__
+
+    def counting_init(self, *args, **kwargs):
+        calls.append(1)
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(TokenizedDocument, '__init__', counting_init)
+    return calls
+
+
+def test_an_upload_is_tokenized_once(context, monkeypatch):
+    calls = count_tokenizations(monkeypatch)
+    text = Text(content=CONTENT, source='pdf', topic='x', is_ai=False)
+    add_reference_text(text)
+    db.session.commit()
+    update_reference_index()
+    document, _ = document_features(text.content_hash)
+
+    assert len(calls) == 1
+    assert text.minhash is not None
+    assert document.tokens[:3] == ['caches', 'keyed', 'by']
+
+
+def test_ingested_documents_keep_their_features(context, tmp_path):
+    words = CONTENT.split()
+    for i in range(3):
+        # Far enough apart not to be near-duplicates
+        (tmp_path / f'{i}.txt').write_text(' '.join(words[i::3] * 3) + '.')
+    assert ingest([str(tmp_path)], is_ai=False, workers=1)['inserted'] == 3
+
+    for text in Text.query:
+        with open(content_path(text.content_hash, suffix=FEATURES_SUFFIX), 'rb') as f:
+            features = decode_features(f.read())
+        assert set(features) == {'vocabulary', 'token_ids', 'sentence_lengths', 'term_counts', 'metrics', 'splitter'}
+        assert features['splitter'] == tokenization.splitter_name()
+        assert sum(features['term_counts'].values()) > 0
+
+
+def test_features_of_another_sentence_splitter_are_not_reused(context, monkeypatch):
+    monkeypatch.setattr(tokenization, '_sent_tokenize', tokenization._fallback_sent_tokenize)
+    text = Text(content=CONTENT, source='pdf', topic='x', is_ai=False)
+    add_reference_text(text)
+    db.session.commit()
+    key, _, _ = cached_document(CONTENT)
+    assert load_features(key) is not None
+
+    # As if the punkt model had been installed since
+    monkeypatch.setattr(tokenization, '_sent_tokenize', lambda content: [content])
+    assert tokenization.splitter_name() == 'punkt'
+    calls = count_tokenizations(monkeypatch)
+
+    assert load_features(key) is None
+    document, features = document_features(text.content_hash)
+    assert features['splitter'] == 'punkt'
+    assert len(document.sentence_lengths) == 1
+    assert len(calls) == 1
+    # Persisted again under the new splitter
+    document_features(text.content_hash)
+    assert len(calls) == 1
@@ -0,0 +1,110 @@
+import datetime
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from app import app, db
+from app.jobs import JobDispatcher, claim_job, claim_next_job, job_pdf_workers, requeue_jobs, requeue_stale_jobs
+from app.models import AnalysisJob, Text
+
+
+class BrokenExecutor:
+    """Stands in for a pool whose worker dies on every job"""
+
+    def __init__(self):
+        self.closed = False
+
+    def submit(self, fn, *args):
+        if self.closed:
+            raise RuntimeError('shut down')
+        future = Future()
+        future.set_exception(BrokenProcessPool('worker died'))
+        return future
+
+
+def add_job(status='pending', attempts=0):
+    text = Text(content='Some text to analyse.', source='manual', topic='x')
+    db.session.add(text)
+    db.session.flush()
+    job = AnalysisJob(text_id=text.id, status=status, attempts=attempts)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def test_jobs_are_claimed_oldest_first_and_once(context):
+    first = add_job()
+    second = add_job()
+
+    assert claim_next_job() == first
+    assert not claim_job(first)
+    assert claim_next_job() == second
+    assert claim_next_job() is None
+    job = db.session.get(AnalysisJob, first)
+    assert job.status == 'running' and job.attempts == 1 and job.started_at is not None
+
+
+def test_stale_jobs_are_requeued_until_out_of_attempts(context):
+    stale = add_job()
+    recent = add_job()
+    for job_id in (stale, recent):
+        claim_job(job_id)
+    db.session.get(AnalysisJob, stale).started_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    db.session.commit()
+
+    requeue_stale_jobs(timeout=60, max_attempts=2)
+    assert db.session.get(AnalysisJob, stale).status == 'pending'
+    assert db.session.get(AnalysisJob, recent).status == 'running'
+
+    # Claimed a second time, and abandoned again
+    assert claim_next_job() == stale
+    db.session.get(AnalysisJob, stale).started_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+    db.session.commit()
+    requeue_stale_jobs(timeout=60, max_attempts=2)
+    job = db.session.get(AnalysisJob, stale)
+    assert job.status == 'failed' and job.attempts == 2
+    assert job.error == 'Analysis did not finish'
+
+
+def test_requeue_jobs_applies_max_attempts(context):
+    retried = add_job('running', attempts=1)
+    exhausted = add_job('running', attempts=3)
+    finished = add_job('done', attempts=1)
+
+    requeue_jobs([retried, exhausted, finished], max_attempts=3)
+
+    assert db.session.get(AnalysisJob, retried).status == 'pending'
+    assert db.session.get(AnalysisJob, exhausted).status == 'failed'
+    assert db.session.get(AnalysisJob, exhausted).error == 'Analysis worker died'
+    assert db.session.get(AnalysisJob, finished).status == 'done'
+
+
+def test_dispatcher_requeues_jobs_of_a_broken_pool_at_once(context, monkeypatch):
+    monkeypatch.setitem(app.config, 'ANALYSIS_POLL_INTERVAL', 0.01)
+    job_id = add_job()
+    executor = BrokenExecutor()
+    dispatcher = JobDispatcher(app)
+    dispatcher._new_executor = lambda: executor
+    dispatcher.start()
+    try:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db.session.expire_all()
+            if db.session.get(AnalysisJob, job_id).status == 'failed':
+                break
+            time.sleep(0.01)
+        job = db.session.get(AnalysisJob, job_id)
+        # Retried straight away rather than after ANALYSIS_JOB_TIMEOUT
+        assert job.status == 'failed'
+        assert job.attempts == app.config['ANALYSIS_MAX_ATTEMPTS']
+    finally:
+        # The next claim's submit stops the dispatcher
+        executor.closed = True
+        add_job()
+        dispatcher.join(10)
+    assert not dispatcher.is_alive()
+
+
+def test_job_workers_share_the_pdf_worker_budget():
+    assert job_pdf_workers({'PDF_WORKERS': 8, 'ANALYSIS_WORKERS': 4}) == 2
+    assert job_pdf_workers({'PDF_WORKERS': 2, 'ANALYSIS_WORKERS': 4}) == 1
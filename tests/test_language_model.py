@@ -0,0 +1,60 @@
+import random
+
+import numpy as np
+
+from app import db
+from app.ai_generator import bulk_generate
+from app.feature_cache import document_features
+from app.language_model import NgramLanguageModel, build_language_model, get_language_model
+from app.models import AnalysisJob, Text
+from app.text_analyzer import analyze_text, estimate_ai_proportion
+
+WORDS = ('river', 'lantern', 'orchard', 'quarrel', 'biscuit', 'harbour', 'velvet', 'gossip', 'thimble', 'meadow',
+         'chimney', 'parcel', 'saddle', 'kettle', 'whistle', 'puddle', 'ledger', 'mustard', 'pebble', 'tavern')
+
+
+def human_text(rng):
+    """Uneven sentences over a loose vocabulary, unlike the generator's templates"""
+    sentences = [' '.join(rng.choice(WORDS) + rng.choice(('', 's', 'ed', 'ing')) for _ in range(rng.randint(2, 30)))
+                 for _ in range(rng.randint(10, 20))]
+    return '. '.join(sentence.capitalize() for sentence in sentences) + '.'
+
+
+def test_human_and_ai_references_get_different_ai_proportions(context):
+    rng = random.Random(0)
+    db.session.add_all(Text(content=human_text(rng), source='manual', topic='Human', is_ai=False) for _ in range(60))
+    db.session.commit()
+    bulk_generate(10, seed=0)
+    build_language_model()
+    model = get_language_model()
+
+    assert model.meta['perplexity_percentiles']['95'] > model.meta['perplexity_percentiles']['5']
+    proportions = {True: [], False: []}
+    for text in Text.query:
+        proportions[text.is_ai].append(analyze_text(document_features(text.content_hash)[0], model)[2])
+    assert np.mean(proportions[True]) > np.mean(proportions[False]) + 0.2
+    assert 0 < np.mean(proportions[False]) and np.mean(proportions[True]) < 1
+
+
+def test_perplexity_is_read_on_the_scale_of_the_model():
+    model = NgramLanguageModel(None, {}, {'order': 2, 'version': None, 'unknown_prob': 1e-6,
+                                          'perplexity_percentiles': {'5': 200.0, '50': 500.0, '95': 1250.0}})
+    # Perplexities in the hundreds no longer all read as fully human
+    assert 0 < model.normalized_perplexity(798.96) < 1
+    assert model.normalized_perplexity(150.0) == 0 and model.normalized_perplexity(5000.0) == 1
+    assert estimate_ai_proportion(300.0, 0.2, model) > estimate_ai_proportion(798.96, 0.2, model) > 0
+    assert estimate_ai_proportion(798.96, 0.2) == estimate_ai_proportion(5000.0, 0.2)
+
+
+def test_language_model_leaves_out_detect_submissions(context):
+    bulk_generate(5, seed=0)
+    build_language_model()
+    n_tokens = get_language_model().meta['n_tokens']
+
+    submitted = Text(content=human_text(random.Random(1)), source='manual', topic='Manual Input for Detection')
+    db.session.add(submitted)
+    db.session.flush()
+    db.session.add(AnalysisJob(text_id=submitted.id, status='done'))
+    db.session.commit()
+    build_language_model()
+    assert get_language_model().meta['n_tokens'] == n_tokens
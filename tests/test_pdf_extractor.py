@@ -0,0 +1,84 @@
+import io
+import os
+from concurrent.futures import Future
+
+import PyPDF2
+from werkzeug.datastructures import FileStorage
+
+from app import pdf_extractor
+
+
+class StuckPool:
+    """Stands in for a pool whose worker hangs on every page"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        return Future()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def write_pdf(path, pages):
+    writer = PyPDF2.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def test_small_pdfs_are_extracted_under_the_page_timeout(tmp_path, monkeypatch):
+    path = str(tmp_path / 'small.pdf')
+    write_pdf(path, 1)
+    pool = StuckPool()
+    monkeypatch.setattr(pdf_extractor, '_get_pool', lambda workers: pool)
+
+    assert list(pdf_extractor.iter_pdf_pages(path, workers=1, page_timeout=0.05)) == ['']
+    assert pool.submitted == [(path, 0)]
+
+
+def test_pdfs_are_extracted_inline_without_a_timeout(tmp_path, monkeypatch):
+    path = str(tmp_path / 'small.pdf')
+    write_pdf(path, 2)
+    pool = StuckPool()
+    monkeypatch.setattr(pdf_extractor, '_get_pool', lambda workers: pool)
+
+    with open(path, 'rb') as stream:
+        assert list(pdf_extractor.iter_pdf_pages(path, workers=4, page_timeout=0, stream=stream)) == ['', '']
+    assert pool.submitted == []
+
+
+def receive(data, folder):
+    with pdf_extractor.receive_upload(FileStorage(io.BytesIO(data), 'paper.PDF'), str(folder)) as upload:
+        return upload, upload.stream.name, upload.stream.read()
+
+
+def test_uploads_are_stored_by_hash_and_read_once(tmp_path):
+    data = b'%PDF-1.4 some bytes' * 1000
+    upload, stream_name, streamed = receive(data, tmp_path)
+
+    # Extraction reads the spooled bytes, not the stored file
+    assert streamed == data
+    assert stream_name.endswith('.part')
+    assert os.path.basename(upload.path) == upload.sha256 + '.pdf'
+    assert not upload.existed and upload.size == len(data)
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+
+    again, _, streamed = receive(data, tmp_path)
+    assert again.existed and again.path == upload.path and streamed == data
+    assert os.listdir(tmp_path) == [os.path.basename(upload.path)]
+
+
+def test_uploads_are_stored_without_hard_links(tmp_path, monkeypatch):
+    def no_links(source, target):
+        raise OSError('hard links not supported')
+
+    monkeypatch.setattr(os, 'link', no_links)
+    upload, _, streamed = receive(b'%PDF-1.4 other bytes', tmp_path)
+
+    assert streamed == b'%PDF-1.4 other bytes' and not upload.existed
+    assert os.listdir(tmp_path) == [os.path.basename(upload.path)]
@@ -0,0 +1,51 @@
+import random
+import types
+
+import numpy as np
+
+from app.reference_index import ReferenceIndex
+from app.text_analyzer import compare_with_documents
+
+WORDS = ('sparse matrix index block score query vector corpus term weight '
+         'document label human model append reopen memory disk row column').split()
+
+
+def random_texts(n, length, seed):
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(WORDS, k=length)) for _ in range(n)]
+
+
+def test_appended_index_matches_the_sklearn_baseline_after_reopening(tmp_path):
+    references = random_texts(30, 40, seed=1)
+    query = random_texts(1, 30, seed=2)[0]
+
+    index = ReferenceIndex(str(tmp_path))
+    # The query is stored too and left out of its own scores, so the IDF
+    # covers the same texts as compare_with_documents fits on
+    first = [(1, True, query)] + [(i + 2, False, text) for i, text in enumerate(references[:20])]
+    assert index.add_documents(first) == 21
+    assert index.add_documents((i + 2, False, text) for i, text in enumerate(references)) == 10
+    before = index.mean_similarities_batch([query], [1])[0]
+
+    reopened = ReferenceIndex(str(tmp_path))
+    assert reopened.doc_ids.tolist() == list(range(1, 32))
+    assert reopened.version == index.version
+    after = reopened.mean_similarities_batch([query], [1])[0]
+
+    baseline = compare_with_documents(query, [types.SimpleNamespace(content=text) for text in references])
+    assert after == before
+    assert after[0] == 0.0
+    assert np.isclose(after[1], baseline, rtol=0, atol=1e-9)
+
+
+def test_other_instances_pick_up_appended_documents(tmp_path):
+    texts = random_texts(6, 20, seed=3)
+    writer = ReferenceIndex(str(tmp_path))
+    reader = ReferenceIndex(str(tmp_path))
+    writer.add_documents((i + 1, i % 2 == 0, text) for i, text in enumerate(texts))
+
+    assert reader.n_docs == 0
+    reader.refresh()
+    assert reader.n_docs == 6
+    assert reader.labels.tolist() == [True, False] * 3
+    assert np.allclose(reader.mean_similarities_batch(texts[:2]), writer.mean_similarities_batch(texts[:2]))
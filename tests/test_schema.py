@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+
+from app import db
+from app.content_store import load_content
+from app.models import PREVIEW_LENGTH, Text
+from app.schema import migrate_content_to_store
+
+BODIES = ['First legacy body. ' * 40, 'Second legacy body.', '']
+
+
+def test_inline_content_moves_to_the_content_store(context):
+    # A database from before the content store kept bodies in text.content
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE text ADD COLUMN content TEXT'))
+        for body in BODIES:
+            connection.execute(text("INSERT INTO text (source, topic, is_ai, content) VALUES ('pdf', 'x', 0, :body)"),
+                               {'body': body})
+
+    assert migrate_content_to_store(batch_size=2) == len(BODIES)
+
+    assert 'content' not in {column['name'] for column in inspect(db.engine).get_columns('text')}
+    texts = Text.query.order_by(Text.id).all()
+    assert [t.content for t in texts] == BODIES
+    for t, body in zip(texts, BODIES):
+        assert load_content(t.content_hash) == body
+        assert t.preview == body[:PREVIEW_LENGTH]
+        assert t.content_length == len(body)
+    # Already migrated
+    assert migrate_content_to_store() == 0
@@ -0,0 +1,33 @@
+import pytest
+
+from app.tokenization import iter_windows
+
+
+@pytest.mark.parametrize('n_items,size,stride', [
+    (0, 4, 2), (3, 4, 2), (4, 4, 4), (9, 4, 3), (10, 4, 3), (10, 4, 2), (11, 4, 4), (10, 1, 1),
+])
+def test_windows_cover_every_item_in_order(n_items, size, stride):
+    windows = list(iter_windows(iter(range(n_items)), size, stride))
+
+    covered = set()
+    for i, (start, items) in enumerate(windows):
+        assert items == list(range(start, start + len(items)))
+        assert 0 < len(items) <= size
+        if i < len(windows) - 1:
+            assert len(items) == size and windows[i + 1][0] == start + stride
+        covered.update(items)
+    assert covered == set(range(n_items))
+    # The tail window only adds what the full windows left out
+    if len(windows) > 1:
+        assert windows[-1][0] + len(windows[-1][1]) > windows[-2][0] + size
+
+
+def test_windows_tail_is_shorter():
+    assert list(iter_windows(range(9), 4, 3)) == [(0, [0, 1, 2, 3]), (3, [3, 4, 5, 6]), (6, [6, 7, 8])]
+    assert list(iter_windows(range(10), 4, 3)) == [(0, [0, 1, 2, 3]), (3, [3, 4, 5, 6]), (6, [6, 7, 8, 9])]
+
+
+@pytest.mark.parametrize('size,stride', [(4, 5), (4, 0), (0, 0), (-1, 1)])
+def test_windows_reject_strides_that_skip_items(size, stride):
+    with pytest.raises(ValueError):
+        iter_windows(range(10), size, stride)
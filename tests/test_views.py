@@ -0,0 +1,59 @@
+import datetime
+
+from app import app, db
+from app.jobs import save_analysis_result
+from app.models import AnalysisResult, Text
+
+
+def add_analysis(ai_proportion, overall_score, is_ai=False):
+    text = Text(content='A text with stored scores.', source='pdf', topic='x', is_ai=is_ai)
+    db.session.add(text)
+    db.session.flush()
+    db.session.add(AnalysisResult(text_id=text.id, perplexity=50.0, burstiness=0.5, ai_proportion=ai_proportion,
+                                  overall_score=overall_score, analyzed_at=datetime.datetime(2024, 1, 1)))
+    db.session.commit()
+    return text.id
+
+
+def listed(**filters):
+    response = app.test_client().get('/view_all_analyses', query_string=dict(filters, format='json'))
+    assert response.status_code == 200
+    return {row['text']['id'] for row in response.get_json()['analyses']}
+
+
+def test_score_filters_apply_to_their_own_columns(context):
+    proportion_high = add_analysis(ai_proportion=0.9, overall_score=0.1)
+    score_high = add_analysis(ai_proportion=0.1, overall_score=0.9, is_ai=True)
+    unscored = add_analysis(ai_proportion=0.5, overall_score=None)
+
+    assert listed() == {proportion_high, score_high, unscored}
+    assert listed(min_ai_score=0.8) == {proportion_high}
+    assert listed(max_ai_score=0.2) == {score_high}
+    assert listed(min_overall_score=0.8) == {score_high}
+    assert listed(max_overall_score=0.2) == {proportion_high}
+    assert listed(min_ai_score=0.4, max_overall_score=0.5) == {proportion_high}
+    assert listed(min_ai_score=0.8, min_overall_score=0.8) == set()
+    assert listed(document_type='ai', min_overall_score=0.5) == {score_high}
+
+
+def test_unchanged_pages_are_answered_with_304(context):
+    text_id = add_analysis(ai_proportion=0.3, overall_score=0.4)
+    client = app.test_client()
+    url = f'/view_document/{text_id}'
+
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+    # The JSON variant has a tag of its own
+    assert client.get(url, query_string={'format': 'json'},
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+    # A re-run analysis is served at once
+    results = {'perplexity': 40.0, 'burstiness': 0.2, 'ai_proportion': 0.7, 'ai_similarity': 0.1,
+               'human_similarity': 0.2, 'overall_ai_score': 0.6, 'score_version': None}
+    save_analysis_result(text_id, results)
+    db.session.commit()
+    changed = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']